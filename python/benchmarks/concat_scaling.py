@@ -0,0 +1,77 @@
+"""
+Measures how the merge of out files scales with the number of files.
+
+The repeated `pd.concat([out, df])` pattern that was used in `convert_output` and in `tooling.merger` copies every row already accumulated each time a file is added, which is quadratic in the number of files. Collecting the frames and concatenating them once is linear, so the time per file should stay roughly constant from 10 to 1000 files.
+
+Usage: uv run python benchmarks/concat_scaling.py
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from tooling.merger import merge_animal
+
+FILE_COUNTS = [10, 100, 1000]
+TRIALS_PER_FILE = 500
+NUM_COLUMNS = 70
+
+
+def _session_frame(rng: np.random.Generator) -> pd.DataFrame:
+    return pd.DataFrame(
+        rng.random((TRIALS_PER_FILE, NUM_COLUMNS)),
+        columns=["c" + str(i) for i in range(NUM_COLUMNS)],
+    )
+
+
+def _repeated_concat(frames):
+    for df in frames:
+        if "out" not in locals():
+            out = df.copy()
+        else:
+            out = pd.concat([out, df], ignore_index=True)
+    return out
+
+
+def _single_concat(frames):
+    return pd.concat(frames, ignore_index=True)
+
+
+def _time(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    print("In-memory accumulation (ms per file)")
+    print(f"{'files':>8}{'repeated':>12}{'single':>12}")
+    for n in FILE_COUNTS:
+        frames = [_session_frame(rng) for _ in range(n)]
+        repeated = _time(_repeated_concat, frames) / n * 1000
+        single = _time(_single_concat, frames) / n * 1000
+        print(f"{n:>8}{repeated:>12.3f}{single:>12.3f}")
+
+    print("\ntooling.merger.merge_animal (ms per file)")
+    print(f"{'files':>8}{'merge':>12}")
+    for n in FILE_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp:
+            animal_dir = Path(tmp) / "ABC0000"
+            for i in range(n):
+                session_dir = animal_dir / f"{i:06d}"
+                session_dir.mkdir(parents=True)
+                _session_frame(rng).to_csv(
+                    session_dir / ("out_ABC0000_" + session_dir.name + ".csv"),
+                    index=False,
+                )
+            merge = _time(merge_animal, animal_dir) / n * 1000
+        print(f"{n:>8}{merge:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measures the import time of the `startup` entry point, which runs before the experimenter sees the first prompt.
+
+Each run imports `startup.__main__` in a fresh interpreter with `python -X importtime` and reads the cumulative time of the module from the report. The startup should stay within `IMPORT_BUDGET_MS` and shouldn't import any of the `HEAVY_MODULES`, which are only needed when a CSV file is compiled or when there's no state of the last session. The script exits with an error if the median import time is over budget or if a heavy module is imported.
+
+Usage: uv run python benchmarks/startup_import_time.py
+"""
+
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+MODULE = "startup.__main__"
+RUNS = 10
+IMPORT_BUDGET_MS = 150
+
+# Libraries that take hundreds of milliseconds to import
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "pydantic", "matplotlib", "scipy"]
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+
+
+def import_report(module: str) -> dict:
+    """
+    Imports a module in a new interpreter and parses the `-X importtime` report.
+
+    Parameters
+    ----------
+    module : str
+        the name of the module to import.
+
+    Returns
+    -------
+    dict
+        a dictionary with the names of every imported module as keys and their cumulative import times (ms) as values.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Lines look like "import time:   self [us] | cumulative | imported package"
+    report = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        report[name.strip()] = int(cumulative) / 1000
+    return report
+
+
+def main():
+    # The first run fills the bytecode cache, so it isn't measured
+    import_report(MODULE)
+    reports = [import_report(MODULE) for _ in range(RUNS)]
+
+    times = [report[MODULE] for report in reports]
+    median = statistics.median(times)
+    heavy = sorted({name.split(".")[0] for name in reports[0]} & set(HEAVY_MODULES))
+
+    print(f"{MODULE} import time over {RUNS} runs (ms)")
+    print(f"{'median':>8}{'min':>8}{'max':>8}{'budget':>8}")
+    print(f"{median:>8.1f}{min(times):>8.1f}{max(times):>8.1f}{IMPORT_BUDGET_MS:>8}")
+
+    print("\nSlowest imports (cumulative ms)")
+    slowest = sorted(reports[0].items(), key=lambda item: item[1], reverse=True)
+    for name, cumulative in slowest[1:11]:
+        print(f"{cumulative:>8.1f}  {name}")
+
+    failed = False
+    if median > IMPORT_BUDGET_MS:
+        print(f"\nThe import time is over the budget of {IMPORT_BUDGET_MS} ms")
+        failed = True
+    if heavy:
+        print("\nHeavy modules imported at startup: " + ", ".join(heavy))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import time
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import yaml
+
+from monitor.tail import RollingTrials, SessionTail
+from shutdown.block_plots import _apply_common_axis_style, _scatter_by_conditions
+from shutdown.session_index import last_session
+from shutdown.stats import condition_indices, encode_conditions
+
+# Number of trials of the running averages
+RUNNING_WINDOW = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Monitors a session while it is running, updating its performance, bias, abort ratio and reaction time as new trials are saved."
+    )
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="the session directory. If omitted, the latest session of the animal in animal.yml is monitored.",
+    )
+    parser.add_argument(
+        "-i",
+        "--interval",
+        type=float,
+        default=2.0,
+        help="the time (s) between checks for new trials (default: 2).",
+    )
+    parser.add_argument(
+        "-w",
+        "--window",
+        type=int,
+        default=200,
+        help="the number of most recent trials shown (default: 200).",
+    )
+    parser.add_argument(
+        "--no-plot",
+        action="store_true",
+        help="only print the summary of the new trials, without opening the figure.",
+    )
+    args = parser.parse_args()
+
+    session_dir = Path(args.path) if args.path is not None else find_active_session()
+    tail = SessionTail(session_dir)
+    trials = RollingTrials(args.window)
+
+    fig = ax = None
+    if not args.no_plot:
+        plt.ion()
+        fig, ax = plt.subplots(2, 2, figsize=(12, 8))
+        plt.subplots_adjust(wspace=0.3, hspace=0.4)
+        fig.suptitle(str(session_dir), fontsize=10, fontweight="bold")
+
+    print("Monitoring " + str(session_dir))
+    try:
+        while True:
+            records = tail.poll()
+            if len(records) > 0:
+                trials.extend(records)
+                print(format_summary(trials.summary()))
+                if fig is not None:
+                    draw(ax, trials.to_frame())
+                    fig.canvas.draw_idle()
+
+            # Wait without blocking the figure's event loop
+            if fig is not None:
+                if not plt.fignum_exists(fig.number):
+                    break
+                plt.pause(args.interval)
+            else:
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def find_active_session() -> Path:
+    """
+    Finds the latest session of the animal set in the `animal.yml` file, which is the one being run by the task.
+
+    Returns
+    -------
+    Path
+        the path to the session directory.
+    """
+    with open("../src/config/config.yml", "r") as file:
+        config = yaml.safe_load(file)
+    with open(config["paths"]["animal"], "r") as file:
+        animal_config = yaml.safe_load(file)
+
+    animal_dir = (
+        Path(config["paths"]["output"])
+        / animal_config["batch"]
+        / animal_config["animal_id"]
+    )
+    return last_session(animal_dir)
+
+
+def format_summary(summary: dict) -> str:
+    if "performance" not in summary:
+        return "Trials: " + str(summary["trials"])
+    return (
+        f"Trials: {summary['trials']} | "
+        f"Rate: {summary['trial_rate']:.1f}/min | "
+        f"Performance: {summary['performance']:.2f} | "
+        f"Abort ratio: {summary['abort_ratio']:.2f} | "
+        f"Bias: {summary['bias']:+.2f} | "
+        f"Median RT: {1000 * summary['median_rt']:.0f} ms"
+    )
+
+
+def draw(ax, df: pd.DataFrame):
+    """
+    Redraws the monitor panels with the trials of the window, using the same panels and styles of the block plots.
+
+    Parameters
+    ----------
+    ax : np.ndarray
+        the 2x2 axes of the monitor figure.
+    df : pd.DataFrame
+        the trials of the window.
+    """
+    df = encode_conditions(df)
+    empty = np.empty(0, dtype=int)
+    by_outcome = condition_indices(df, ["outcome"])
+    by_side = condition_indices(df, ["outcome", "side"])
+
+    # The running averages are computed over the last RUNNING_WINDOW trials
+    success = df["success"].to_numpy(dtype=float)
+    response = df["response_poke"].to_numpy(dtype=float)
+    answered = pd.Series(np.where((success == 1) | (success == -1), 1.0, np.nan))
+    df = df.assign(
+        running_perf=(pd.Series(success == 1, dtype=float).where(answered.notna()))
+        .rolling(RUNNING_WINDOW, min_periods=1)
+        .mean(),
+        running_abort=pd.Series(success == 0, dtype=float)
+        .rolling(RUNNING_WINDOW, min_periods=1)
+        .mean(),
+        running_bias=pd.Series(np.sign(response) * answered)
+        .rolling(RUNNING_WINDOW, min_periods=1)
+        .mean(),
+        timed_rt_ms=df["timed_rt"].to_numpy(dtype=float) * 1000,
+    )
+
+    for axis in ax.flat:
+        axis.cla()
+
+    ild = np.abs(df["ILD"].to_numpy(dtype=float))
+    limit = 1.1 * np.nanmax(ild) if np.any(ild > 0) else 1
+    _apply_common_axis_style(
+        ax[0, 0],
+        title="ILD condition and t. outcome",
+        xlabel="Trial",
+        ylabel="Left    ILD (dB SPL)    Right",
+        ylim=(-limit, limit),
+        hline={"y": 0, "color": "black"},
+    )
+    _scatter_by_conditions(
+        ax[0, 0],
+        df,
+        x_col="trial",
+        y_col="ILD",
+        combos=[
+            {"rows": by_outcome.get((outcome,), empty), "edgecolor": color}
+            for outcome, color in [
+                ("correct", "green"),
+                ("incorrect", "red"),
+                ("abort", "black"),
+            ]
+        ],
+    )
+
+    _apply_common_axis_style(
+        ax[0, 1],
+        title="Running performance and abort rate",
+        xlabel="Trial",
+        ylabel="Proportion",
+        ylim=(0, 1),
+        hline={"y": 0.5, "color": "black", "linestyle": ":"},
+    )
+    ax[0, 1].plot(df["trial"], df["running_perf"], "-", color="green")
+    ax[0, 1].plot(df["trial"], df["running_abort"], "-", color="black")
+
+    _apply_common_axis_style(
+        ax[1, 0],
+        title="Running bias (right - left)",
+        xlabel="Trial",
+        ylabel="Bias",
+        ylim=(-1, 1),
+        hline={"y": 0, "color": "black", "linestyle": ":"},
+    )
+    ax[1, 0].plot(df["trial"], df["running_bias"], "-", color="black")
+
+    _apply_common_axis_style(
+        ax[1, 1], title="Reaction Time", xlabel="Trial", ylabel="Time (ms)"
+    )
+    _scatter_by_conditions(
+        ax[1, 1],
+        df,
+        x_col="trial",
+        y_col="timed_rt_ms",
+        combos=[
+            {"rows": by_side.get(key, empty), "marker": marker, "edgecolor": color}
+            for key, marker, color in [
+                (("correct", "left"), "<", "green"),
+                (("correct", "right"), ">", "green"),
+                (("incorrect", "left"), "<", "red"),
+                (("incorrect", "right"), ">", "red"),
+            ]
+        ]
+        + [{"rows": by_outcome.get(("abort",), empty), "edgecolor": "black"}],
+    )
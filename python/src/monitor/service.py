@@ -0,0 +1,414 @@
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+import yaml
+
+from monitor.tail import RollingTrials, SessionTail
+from shutdown.session_index import animal_dirs, batch_dirs, last_session
+
+# Sessions whose out files weren't modified for longer than this (s) are no longer monitored
+MAX_IDLE = 15 * 60
+
+# Maximum time (s) a client can take to receive a message before it's disconnected
+SEND_TIMEOUT = 5.0
+
+# GUID used to compute the WebSocket handshake response (RFC 6455)
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+INDEX_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Sound Lateralization Task</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; }
+th, td { padding: 0.3em 1em; border-bottom: 1px solid #ccc; text-align: right; }
+th:first-child, td:first-child { text-align: left; }
+.idle { color: #c00; font-weight: bold; }
+</style>
+</head>
+<body>
+<h2>Active sessions</h2>
+<table>
+<thead><tr><th>Session</th><th>Box</th><th>Trials</th><th>Rate (/min)</th><th>Performance</th><th>Abort ratio</th><th>Bias</th><th>Median RT (ms)</th><th>Last trial (s ago)</th></tr></thead>
+<tbody id="boxes"></tbody>
+</table>
+<script>
+const fmt = (v, d) => (v === null || v === undefined) ? "-" : Number(v).toFixed(d);
+const socket = new WebSocket("ws://" + location.host + "/ws");
+socket.onmessage = (event) => {
+  // The values are set as text, since the session names come from the directory names
+  const rows = JSON.parse(event.data).map((b) => {
+    const row = document.createElement("tr");
+    const values = [
+      b.session, fmt(b.box, 0), b.trials, fmt(b.trial_rate, 1), fmt(b.performance, 2),
+      fmt(b.abort_ratio, 2), fmt(b.bias, 2),
+      fmt(b.median_rt === null ? null : b.median_rt * 1000, 0), fmt(b.last_trial_latency, 0),
+    ];
+    for (const value of values) {
+      const cell = document.createElement("td");
+      cell.textContent = value;
+      row.appendChild(cell);
+    }
+    if (b.last_trial_latency > 120) {
+      row.lastChild.className = "idle";
+    }
+    return row;
+  });
+  document.getElementById("boxes").replaceChildren(...rows);
+};
+</script>
+</body>
+</html>
+"""
+
+
+class BoxState:
+    """
+    The state of a session being monitored: the position in its out files and the trials of the rolling window.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+    window : int
+        the number of most recent trials used to compute the summary metrics.
+    """
+
+    def __init__(self, session_dir: Path, window: int):
+        self.session_dir = session_dir
+        self.tail = SessionTail(session_dir)
+        self.trials = RollingTrials(window)
+        self.last_trial_time: Optional[float] = None
+
+    def update(self) -> bool:
+        # An error in one session (for example, a file removed while it's read) shouldn't stop the monitoring of the others
+        try:
+            records = self.tail.poll()
+            if len(records) == 0:
+                return False
+            self.trials.extend(records)
+        except Exception as e:
+            print(
+                "It was not possible to update "
+                + str(self.session_dir)
+                + ": "
+                + type(e).__name__
+                + ": "
+                + str(e)
+            )
+            return False
+
+        # The trials were written when the out file was last modified, which can be long before they're read (for example, when the service starts in the middle of a session)
+        try:
+            self.last_trial_time = self.tail.file.stat().st_mtime
+        except OSError:
+            self.last_trial_time = time.time()
+        return True
+
+    def summary(self) -> dict:
+        summary = self.trials.summary()
+        frame = self.trials.to_frame()
+        summary["session"] = "/".join(self.session_dir.parts[-3:])
+        summary["box"] = frame["box"].iloc[-1] if frame.shape[0] else None
+        summary["last_trial_latency"] = (
+            None if self.last_trial_time is None else time.time() - self.last_trial_time
+        )
+        # Convert to JSON values (NaN isn't valid JSON)
+        summary = {
+            k: (v.item() if isinstance(v, np.generic) else v)
+            for k, v in summary.items()
+        }
+        return {
+            k: (None if isinstance(v, float) and math.isnan(v) else v)
+            for k, v in summary.items()
+        }
+
+
+def find_active_sessions(output_root: Path, max_idle: float = MAX_IDLE) -> List[Path]:
+    """
+    Finds the sessions whose out files are being written, i.e. the latest session of each animal whose newest `out.json` file was modified in the last `max_idle` seconds.
+
+    Parameters
+    ----------
+    output_root : Path
+        the output directory, which contains the batch directories.
+    max_idle : float
+        the maximum time (s) since the last modification of an active session.
+
+    Returns
+    -------
+    list[Path]
+        the paths to the active session directories.
+    """
+    now = time.time()
+    sessions = []
+    for batch_dir in batch_dirs(output_root):
+        for animal_dir in animal_dirs(batch_dir):
+            # Only the latest session of each animal can be running
+            session_dir = last_session(animal_dir)
+            if session_dir is None:
+                continue
+            out_files = sorted((session_dir / "unparsed_out").glob("out_*.json"))
+            try:
+                if out_files and now - out_files[-1].stat().st_mtime <= max_idle:
+                    sessions.append(session_dir)
+            except OSError:
+                # The file was removed or renamed since the directory was listed
+                continue
+    return sessions
+
+
+class LiveService:
+    """
+    Watches every active session under the output directory and serves their summary metrics over HTTP (`/api/boxes`) and WebSocket (`/ws`), with a control-room page at `/`.
+
+    Only the new lines of each out file are parsed and each session only keeps its rolling window of trials, so the memory used doesn't grow with the length of the sessions. The sessions that stop being written are dropped.
+
+    Parameters
+    ----------
+    output_root : Path
+        the output directory, which contains the batch directories.
+    interval : float
+        the time (s) between checks for new trials.
+    window : int
+        the number of most recent trials used to compute the summary metrics of each session.
+    max_idle : float
+        the time (s) after which a session that isn't written anymore is dropped.
+    """
+
+    def __init__(
+        self,
+        output_root: Path,
+        interval: float = 2.0,
+        window: int = 200,
+        max_idle: float = MAX_IDLE,
+    ):
+        self.output_root = Path(output_root)
+        self.interval = interval
+        self.window = window
+        self.max_idle = max_idle
+        self.boxes: Dict[Path, BoxState] = {}
+        self.clients: Set[asyncio.StreamWriter] = set()
+        self._summaries: List[dict] = []
+
+    def poll(self) -> bool:
+        """
+        Updates the list of active sessions and parses their new trials.
+
+        Returns
+        -------
+        bool
+            whether any session was added, removed or has new trials.
+        """
+        try:
+            active = find_active_sessions(self.output_root, self.max_idle)
+        except OSError as e:
+            print("It was not possible to list the active sessions: " + str(e))
+            return False
+        changed = set(active) != set(self.boxes)
+        self.boxes = {
+            session: self.boxes.get(session) or BoxState(session, self.window)
+            for session in active
+        }
+        for box in self.boxes.values():
+            changed = box.update() or changed
+
+        # The summaries are replaced at once, so the requests always see a consistent list
+        self._summaries = [box.summary() for box in self.boxes.values()]
+        return changed
+
+    def summaries(self) -> List[dict]:
+        return self._summaries
+
+    async def watch(self):
+        # The files are read in a worker thread, so that the requests are still served while they are parsed. Only this thread touches the sessions, while the requests use the last summaries.
+        while True:
+            try:
+                await asyncio.to_thread(self.poll)
+            except Exception as e:
+                print("It was not possible to poll the sessions: " + str(e))
+            await self.broadcast()
+            await asyncio.sleep(self.interval)
+
+    async def broadcast(self):
+        # The clients are sent the message at the same time, so that a stalled client doesn't delay the others
+        message = _websocket_frame(json.dumps(self.summaries()).encode())
+        await asyncio.gather(*[self._send(w, message) for w in list(self.clients)])
+
+    async def _send(self, writer: asyncio.StreamWriter, message: bytes):
+        try:
+            writer.write(message)
+            await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            self.clients.discard(writer)
+            writer.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+
+        lines = request.decode("latin-1").split("\r\n")
+        request_line = lines[0].split(" ")
+        if len(request_line) < 3:
+            _respond(writer, "400 Bad Request", "text/plain", b"")
+            await writer.drain()
+            writer.close()
+            return
+        method, target = request_line[:2]
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+
+        if method != "GET":
+            _respond(writer, "405 Method Not Allowed", "text/plain", b"")
+        elif target == "/ws" and "sec-websocket-key" in headers:
+            await self._serve_websocket(reader, writer, headers["sec-websocket-key"])
+            return
+        elif target == "/api/boxes":
+            body = json.dumps(self.summaries()).encode()
+            _respond(writer, "200 OK", "application/json", body)
+        elif target == "/":
+            _respond(writer, "200 OK", "text/html; charset=utf-8", INDEX_PAGE.encode())
+        else:
+            _respond(writer, "404 Not Found", "text/plain", b"")
+
+        await writer.drain()
+        writer.close()
+
+    async def _serve_websocket(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, key: str
+    ):
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest())
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\n"
+            b"Connection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+        )
+        writer.write(_websocket_frame(json.dumps(self.summaries()).encode()))
+        await writer.drain()
+        self.clients.add(writer)
+
+        # The clients only send control frames, which are read until the connection is closed
+        try:
+            while True:
+                opcode, payload = await _read_websocket_frame(reader)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    writer.write(_websocket_frame(payload, opcode=0xA))
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765):
+        server = await asyncio.start_server(self.handle, host, port)
+        print("Serving on http://" + host + ":" + str(port))
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.watch())
+
+
+def _respond(writer: asyncio.StreamWriter, status: str, content_type: str, body: bytes):
+    writer.write(
+        (
+            "HTTP/1.1 " + status + "\r\n"
+            "Content-Type: " + content_type + "\r\n"
+            "Content-Length: " + str(len(body)) + "\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+        + body
+    )
+
+
+def _websocket_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    # Unmasked frame sent by the server, with the payload length encoded in 7, 16 or 64 bits
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + length.to_bytes(2, "big")
+    else:
+        header += bytes([127]) + length.to_bytes(8, "big")
+    return header + payload
+
+
+async def _read_websocket_frame(reader: asyncio.StreamReader):
+    # Frames sent by the clients are always masked
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    mask = await reader.readexactly(4) if second & 0x80 else bytes(4)
+    payload = await reader.readexactly(length)
+    return first & 0x0F, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serves the live summary metrics of every active session under the output directory."
+    )
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="the output directory. If omitted, the output path in config.yml is used.",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="the address to listen on (default: 127.0.0.1).",
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=8765,
+        help="the port to listen on (default: 8765).",
+    )
+    parser.add_argument(
+        "-i",
+        "--interval",
+        type=float,
+        default=2.0,
+        help="the time (s) between checks for new trials (default: 2).",
+    )
+    parser.add_argument(
+        "-w",
+        "--window",
+        type=int,
+        default=200,
+        help="the number of most recent trials used by the metrics (default: 200).",
+    )
+    args = parser.parse_args()
+
+    if args.path is None:
+        with open("../src/config/config.yml", "r") as file:
+            output_root = Path(yaml.safe_load(file)["paths"]["output"])
+    else:
+        output_root = Path(args.path)
+
+    service = LiveService(output_root, args.interval, args.window)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
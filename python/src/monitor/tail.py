@@ -0,0 +1,174 @@
+from collections import deque
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from shutdown.flatten import OUT_LEAVES, _make_getter
+from shutdown.reader import iter_out_records
+
+# Columns of the out structure kept by the monitor
+MONITOR_COLUMNS = [
+    "animal",
+    "box",
+    "trial",
+    "trial_start",
+    "block",
+    "training_level",
+    "ILD",
+    "success",
+    "response_poke",
+    "abort_type",
+    "timed_rt",
+    "timed_mt",
+]
+
+
+class SessionTail:
+    """
+    Follows the `out.json` files of a session while they are being written, parsing only the lines added since the last poll.
+
+    The file is only opened for reading during each poll, so the task is never blocked. When the task is restarted, the newer `out.json` file is followed from its beginning.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+    """
+
+    def __init__(self, session_dir: Path):
+        self.session_dir = Path(session_dir)
+        self.file: Optional[Path] = None
+        self.offset = 0
+
+    def _latest_file(self) -> Optional[Path]:
+        files = sorted((self.session_dir / "unparsed_out").glob("out_*.json"))
+        return files[-1] if files else None
+
+    def poll(self) -> List[dict]:
+        """
+        Parses the records written since the last poll.
+
+        Returns
+        -------
+        list[dict]
+            the new records, in the order they were written.
+        """
+        latest = self._latest_file()
+        if latest is None:
+            return []
+        if latest != self.file:
+            self.file = latest
+            self.offset = 0
+
+        # Start over if the file was replaced by a shorter one
+        try:
+            if self.file.stat().st_size < self.offset:
+                self.offset = 0
+        except OSError:
+            return []
+
+        records = []
+        while True:
+            try:
+                for record, offset in iter_out_records(self.file, self.offset):
+                    records.append(record)
+                    self.offset = offset
+                return records
+            except ValueError:
+                # Skip the line that isn't valid JSON, so that the following ones are still read
+                print("Skipping an invalid line of " + str(self.file))
+                if not self._skip_line():
+                    return records
+
+    def _skip_line(self) -> bool:
+        with open(self.file, "rb") as f:
+            f.seek(self.offset)
+            line = f.readline()
+        if not line.endswith(b"\n"):
+            return False
+        self.offset += len(line)
+        return True
+
+
+class RollingTrials:
+    """
+    Keeps the last `window` trials of a session, so that the memory used doesn't grow with the length of the session.
+
+    Parameters
+    ----------
+    window : int
+        the maximum number of trials kept.
+    """
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.total = 0
+        self.leaves = [leaf for leaf in OUT_LEAVES if leaf.column in MONITOR_COLUMNS]
+        self._getter = _make_getter(self.leaves)
+        self._rows = deque(maxlen=window)
+
+    def _values(self, record: dict) -> tuple:
+        try:
+            return self._getter(record)
+        except (KeyError, TypeError):
+            values = []
+            for leaf in self.leaves:
+                value = record
+                try:
+                    for key in leaf.path:
+                        value = value[key]
+                except (KeyError, TypeError):
+                    value = np.nan
+                values.append(value)
+            return tuple(values)
+
+    def extend(self, records: List[dict]):
+        for record in records:
+            self._rows.append(self._values(record))
+        self.total += len(records)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the trials of the window as an out DataFrame with the columns in `MONITOR_COLUMNS`.
+        """
+        df = pd.DataFrame(
+            list(self._rows), columns=[leaf.column for leaf in self.leaves]
+        )
+        return df.replace("NaN", np.nan)
+
+    def summary(self) -> dict:
+        """
+        Computes the summary metrics of the trials in the window.
+
+        Returns
+        -------
+        dict
+            the total number of trials of the session (`trials`), the trial rate (trials per minute), the `performance`, `abort_ratio` and `bias` (the proportion of right responses minus the proportion of left responses) of the window, the median reaction time (`median_rt`) and the start time of the last trial (`last_trial_start`).
+        """
+        df = self.to_frame()
+        if df.shape[0] == 0:
+            return {"trials": self.total}
+
+        success = df["success"].to_numpy(dtype=float)
+        answered = df[(success == 1) | (success == -1)]
+        right = (answered["response_poke"] > 0).sum()
+        left = (answered["response_poke"] < 0).sum()
+        starts = df["trial_start"].to_numpy(dtype=float)
+        elapsed = starts[-1] - starts[0]
+
+        return {
+            "trials": self.total,
+            "trial_rate": 60 * (df.shape[0] - 1) / elapsed if elapsed > 0 else np.nan,
+            "performance": (success == 1).sum() / answered.shape[0]
+            if answered.shape[0]
+            else np.nan,
+            "abort_ratio": float((success == 0).mean()),
+            "bias": (right - left) / (right + left) if right + left else np.nan,
+            "median_rt": float(answered["timed_rt"].median()),
+            "last_trial_start": float(starts[-1]),
+        }
@@ -2,7 +2,8 @@ from pathlib import Path
 
 import yaml
 
-from shutdown.utils import convert_output
+from shutdown.session_index import last_session
+from shutdown.utils import CHUNK_SIZE, convert_output
 
 
 def main():
@@ -29,9 +30,10 @@ def main():
             / animal_config["animal_id"]
         )
 
-    # Get all of the directories inside the animal directory
-    session_dir = [entry for entry in animal_dir.iterdir() if entry.is_dir()][-1]
+    # Get the latest session directory inside the animal directory
+    session_dir = last_session(animal_dir)
     if animal_backup_dir is not None:
         session_backup_dir = animal_backup_dir / session_dir.name
 
-    convert_output(session_dir, session_backup_dir)
+    # The session is converted in chunks, since the acquisition computers are still busy saving the videos
+    convert_output(session_dir, session_backup_dir, chunk_size=CHUNK_SIZE)
@@ -1,11 +1,30 @@
+import hashlib
+import io
+import json
 import os
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from matplotlib.ticker import LogFormatter, MaxNLocator
 
+from shutdown.stats import (
+    ABORT_TYPES,
+    condition_indices,
+    encode_conditions,
+    performance_by_ild,
+)
+
+# File inside the plots directory with the content hash of each block figure
+PLOT_HASHES = "plot_hashes.json"
+
+_CODE_HASH = hashlib.sha256(
+    Path(__file__).read_bytes() + (Path(__file__).parent / "stats.py").read_bytes()
+).hexdigest()
+
 
 def _apply_common_axis_style(
     ax,
@@ -68,7 +87,7 @@ def _scatter_by_conditions(ax, df, x_col, y_col, combos, y_mult=1.0, markerface=
     """
     Generic scatter helper to plot multiple condition combos on the same axes.
     - combos: list of dicts with keys:
-        - 'mask': boolean mask (same length as df) OR callable(df)->mask
+        - 'rows': positions of the trials (as returned by `condition_indices`) OR callable(df)->positions
         - 'marker': marker symbol
         - 'edgecolor': color
         - 'edgewidth': linewidth (optional, default 1.5)
@@ -76,21 +95,21 @@ def _scatter_by_conditions(ax, df, x_col, y_col, combos, y_mult=1.0, markerface=
         - 'mult': multiplier for y values (overrides y_mult for that combo)
     """
     for c in combos:
-        # derive boolean mask
-        mask = c["mask"](df) if callable(c["mask"]) else c["mask"]
-        if mask.sum() == 0:
+        # derive the positions of the trials of the condition
+        rows = c["rows"](df) if callable(c["rows"]) else c["rows"]
+        if rows.size == 0:
             continue
 
         edgewidth = c.get("edgewidth", 1.5)
         mult = c.get("mult", y_mult)
 
         if "y_const" in c:
-            yvals = np.full(mask.sum(), c["y_const"])
+            yvals = np.full(rows.size, c["y_const"])
         else:
-            yvals = df.loc[mask, y_col] * mult
+            yvals = df[y_col].to_numpy()[rows] * mult
 
         ax.plot(
-            df.loc[mask, x_col],
+            df[x_col].to_numpy()[rows],
             yvals,
             c.get("marker", "o"),
             markerfacecolor=markerface,
@@ -114,380 +133,504 @@ def _build_text_block(df):
     return txt
 
 
-def generate_plots(data: pd.DataFrame, path: str, backup_path: Optional[str] = None):
+def generate_plots(
+    data: pd.DataFrame,
+    path: str,
+    backup_path: Optional[str] = None,
+    workers: Optional[int] = None,
+):
     """
     Refactored plotting function that produces the same 3x3 layout per block
     but with much less repeated code. Save each block to path/block_<n>.png
+
+    Each figure is rendered once and the same PNG is written to both destinations. Blocks whose rows didn't change since their figure was saved (see `PLOT_HASHES`) are skipped, and the remaining blocks are rendered in parallel by `workers` processes (1 renders them in the current process).
     """
-    # Precompute and map some commonly used items to avoid recomputing repeatedly.
-    colors_success = {
-        1: "green",
-        -1: "red",
-        0: "black",
-    }
+    data = _prepare_data(data)
+
+    hashes = _load_hashes(path)
+    destinations = [p for p in [path, backup_path] if p is not None]
+
+    # Find the blocks whose figures are missing or outdated
+    blocks = {}
+    for block_num, df in data.groupby("block", sort=False):
+        digest = _block_hash(df)
+        file_name = f"block_{block_num}.png"
+        if hashes.get(file_name) == digest and all(
+            os.path.isfile(os.path.join(p, file_name)) for p in destinations
+        ):
+            continue
+        blocks[file_name] = (df, digest)
 
-    # colors for abort types (preserve approximate mapping to your original HSV)
-    abort_types = ["CNP", "Fixation", "RT+", "RT-", "MT+", "MT-", "LNP", "IO"]
-    colors_aborts = plt.cm.hsv(np.linspace(0.75, 0, len(abort_types) + 2))
+    if workers == 1 or len(blocks) <= 1:
+        images = map(_render_block, [df for df, _ in blocks.values()])
+        _write_images(blocks, images, destinations, hashes)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            images = pool.map(_render_block, [df for df, _ in blocks.values()])
+            _write_images(blocks, images, destinations, hashes)
 
+    _save_hashes(path, hashes)
+
+
+class BlockPlotter:
+    """
+    Produces the same figures as `generate_plots` for a session whose trials are added in chunks, keeping in memory only the trials of the block that is still being read.
+
+    Blocks are expected to be contiguous in the out structure, so a block is rendered as soon as a trial of another block is added. If the trials of a block were split by trials of other blocks, only its last run of trials would be plotted. The figures are rendered in the current process, one at a time.
+
+    Parameters
+    ----------
+    path : str
+        the path to the directory where the figures are saved.
+    backup_path : str, optional
+        the path to the backup directory where the figures are also saved.
+    """
+
+    def __init__(self, path: str, backup_path: Optional[str] = None):
+        self.path = path
+        self.destinations = [p for p in [path, backup_path] if p is not None]
+        self.hashes = _load_hashes(path)
+        self.blocks: List = []
+        self._pending: List[pd.DataFrame] = []
+
+    def add(self, chunk: pd.DataFrame):
+        """
+        Adds a chunk of trials, rendering the blocks that it completes.
+
+        Parameters
+        ----------
+        chunk : pd.DataFrame
+            the next trials of the out structure.
+        """
+        # Split the chunk into runs of trials of the same block
+        block = chunk["block"].to_numpy()
+        bounds = [0, *(np.flatnonzero(block[1:] != block[:-1]) + 1), block.size]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if self._pending and self._pending[0]["block"].iloc[0] != block[start]:
+                self._flush()
+            self._pending.append(chunk.iloc[start:end])
+
+    def close(self):
+        """
+        Renders the last block and saves the hashes of the figures.
+        """
+        if self._pending:
+            self._flush()
+        _save_hashes(self.path, self.hashes)
+
+    def _flush(self):
+        df = _prepare_data(pd.concat(self._pending, ignore_index=True))
+        self._pending = []
+
+        block_num = df["block"].iloc[0]
+        self.blocks.append(block_num)
+        file_name = f"block_{block_num}.png"
+        digest = _block_hash(df)
+        if self.hashes.get(file_name) == digest and all(
+            os.path.isfile(os.path.join(p, file_name)) for p in self.destinations
+        ):
+            return
+        _write_images(
+            {file_name: (df, digest)},
+            [_render_block(df)],
+            self.destinations,
+            self.hashes,
+        )
+
+
+def _prepare_data(data: pd.DataFrame) -> pd.DataFrame:
     # Multiply times once (avoid repeated multiplications in loops)
     data = data.copy()
     data["timed_rt_ms"] = data["timed_rt"] * 1000
     data["timed_mt_ms"] = data["timed_mt"] * 1000
 
-    block_nums = data["block"].unique()
+    # Encode the conditions of every trial once for all blocks
+    return encode_conditions(data)
 
-    for block_num in block_nums:
-        df = data[data["block"] == block_num]
 
-        # Create figure and 3x3 axes
-        fig, ax = plt.subplots(3, 3, figsize=(14, 10))
-        plt.subplots_adjust(wspace=0.4, hspace=0.4)
+def _write_images(blocks: dict, images, destinations: List[str], hashes: dict):
+    for (file_name, (_, digest)), image in zip(blocks.items(), images):
+        for destination in destinations:
+            with open(os.path.join(destination, file_name), "wb") as file:
+                file.write(image)
+        hashes[file_name] = digest
 
-        # Titles/labels arrays (kept from original)
-        titles = np.array(
-            [
-                ["", "ILD condition and t. outcome", "Outcome with abort tags"],
-                [
-                    "Running average performance and abort rate",
-                    "Performance and abort rate for all ILD conditions",
-                    "Time to central nose poke",
-                ],
-                ["Reaction Time", "Movement time", ""],
-            ]
-        )
-        xlabels = np.array(
-            [
-                ["", "Trial", "Trial"],
-                ["Trial", "ILD step", "Trial"],
-                ["Trial", "Trial", ""],
-            ]
-        )
-        ylabels = np.array(
-            [
-                ["", "Left    ILD (dB SPL)    Right", "Outcome"],
-                ["Proportion", "Proportion", "Time (s)"],
-                ["Time (ms)", "Time (ms)", ""],
-            ]
-        )
 
-        # Apply styles and metadata for each axis using the helper
-        for i in range(3):
-            for j in range(3):
-                hide_ticks = i == 0 and j == 0  # top-left cell used for text
-                # The bottom-right (2,2) is turned off in original
-                if (i, j) == (2, 2):
-                    ax[i, j].axis("off")
-                    continue
-
-                # Set axis properties (including special yscale/ylim/hlines for certain cells)
-                yscale = None
-                ylim = None
-                hline = None
-                if (i, j) == (0, 1):
-                    ylim = (-1.1 * max(np.abs(df["ILD"])), 1.1 * max(np.abs(df["ILD"])))
-                    hline = {"y": 0, "color": "black"}
-                elif (i, j) == (0, 2):
-                    ylim = (-9, 3)
-                    hline = {"y": 0, "color": "black"}
-                elif (i, j) == (1, 1):
-                    ylim = (0, 1)
-                    hline = {"y": 0.5, "color": "black", "linestyle": ":"}
-                elif (i, j) == (1, 2):
-                    # Time to CNP uses log scale in your original code
-                    yscale = "log"
-                elif (i, j) == (1, 0):
-                    ylim = (0, 1)
-                elif (i, j) == (2, 0) or (i, j) == (2, 1):
-                    # Reaction and movement time panels will be in ms; no special ylim set
-                    pass
-
-                _apply_common_axis_style(
-                    ax[i, j],
-                    title=titles[i, j],
-                    xlabel=xlabels[i, j],
-                    ylabel=ylabels[i, j],
-                    hide_spines=True,
-                    hide_ticks=hide_ticks,
-                    yscale=yscale,
-                    ylim=ylim,
-                    hline=hline,
-                )
-
-        # Add informative text in top-left cell position (uses figure coordinates)
-        info_text = _build_text_block(df)
-        plt.text(
-            ax[0, 0].get_position().x0 + 0.005,
-            ax[0, 0].get_position().y0 + 0.06,
-            info_text,
-            transform=fig.transFigure,
-            fontsize=8,
-            linespacing=1.5,
-        )
-
-        # ------- Panel (0,1): ILD condition and trial outcome markers -------
-        # For ILD we plot three success categories with different edge colors
-        combos_ild = []
-        for succ_val, color in colors_success.items():
-            combos_ild.append(
-                {
-                    "mask": df["success"] == succ_val,
-                    "marker": "o",
-                    "edgecolor": color,
-                    "edgewidth": 1.5,
-                }
-            )
-        _scatter_by_conditions(
-            ax[0, 1], df, x_col="trial", y_col="ILD", combos=combos_ild
-        )
+def _render_block(df: pd.DataFrame) -> bytes:
+    """
+    Renders the 3x3 figure of a block and returns it as PNG bytes.
+    """
+    # Precompute and map some commonly used items to avoid recomputing repeatedly.
+    colors_success = {
+        "correct": "green",
+        "incorrect": "red",
+        "abort": "black",
+    }
 
-        # ------- Panel (0,2): Outcome with abort tags -------
-        # Build combos for success & ILD sign using left "<" and right ">" markers and two levels (success:1, -1)
-        outcome_combos = []
-        # Success correct (1): left if ILD<0, right if ILD>0 (use same color)
-        outcome_combos.append(
-            {
-                "mask": (df["success"] == 1) & (df["ILD"] < 0),
-                "marker": "<",
-                "edgecolor": colors_aborts[0],
-                "y_const": 2,
-            }
-        )
-        outcome_combos.append(
-            {
-                "mask": (df["success"] == 1) & (df["ILD"] > 0),
-                "marker": ">",
-                "edgecolor": colors_aborts[0],
-                "y_const": 2,
-            }
-        )
-        # Incorrect (-1)
-        outcome_combos.append(
-            {
-                "mask": (df["success"] == -1) & (df["ILD"] < 0),
-                "marker": "<",
-                "edgecolor": colors_aborts[1],
-                "y_const": 1,
-            }
-        )
-        outcome_combos.append(
-            {
-                "mask": (df["success"] == -1) & (df["ILD"] > 0),
-                "marker": ">",
-                "edgecolor": colors_aborts[1],
-                "y_const": 1,
-            }
-        )
+    # colors for abort types (preserve approximate mapping to your original HSV)
+    abort_types = ABORT_TYPES
+    colors_aborts = plt.cm.hsv(np.linspace(0.75, 0, len(abort_types) + 2))
 
-        # Add abort type markers at fixed negative y positions (matching original mapping)
-        for idx, atype in enumerate(abort_types):
-            y_const = -(idx + 1)  # maps CNP->-1, Fixation->-2, ...
-            color = colors_aborts[idx + 2]
-            outcome_combos.append(
-                {
-                    "mask": df["abort_type"] == atype,
-                    "marker": "o",
-                    "edgecolor": color,
-                    "y_const": y_const,
-                }
-            )
+    # Group the trials of the block by condition once, instead of building a mask for every condition of every panel
+    empty = np.empty(0, dtype=int)
+    by_outcome = condition_indices(df, ["outcome"])
+    by_side = condition_indices(df, ["outcome", "side"])
+    by_abort = condition_indices(df, ["abort_type"])
 
-        _scatter_by_conditions(
-            ax[0, 2], df, x_col="trial", y_col="trial", combos=outcome_combos
-        )
+    # Create figure and 3x3 axes
+    fig, ax = plt.subplots(3, 3, figsize=(14, 10))
+    plt.subplots_adjust(wspace=0.4, hspace=0.4)
 
-        # Adjust explicit y-ticks labels for outcome panel to match original mapping
-        ax[0, 2].set_yticks(
-            range(3, -9, -1),
+    # Titles/labels arrays (kept from original)
+    titles = np.array(
+        [
+            ["", "ILD condition and t. outcome", "Outcome with abort tags"],
             [
-                "",
-                "Trial +",
-                "Trial -",
-                "",
-                "CNP",
-                "Fixation",
-                "RT+",
-                "RT-",
-                "MT+",
-                "MT-",
-                "LNP",
-                "IO",
+                "Running average performance and abort rate",
+                "Performance and abort rate for all ILD conditions",
+                "Time to central nose poke",
             ],
-        )
-
-        # ------- Panel (1,0): Running average performance (block_perf vs trial) -------
-        perf_combo = [
-            {
-                "mask": np.ones(df.shape[0], dtype=bool),
-                "marker": "o",
-                "edgecolor": "green",
-                "edgewidth": 1.5,
-            }
+            ["Reaction Time", "Movement time", ""],
         ]
-        _scatter_by_conditions(
-            ax[1, 0], df, x_col="trial", y_col="block_perf", combos=perf_combo
-        )
-
-        # ------- Panel (1,1): Performance per ILD (calls get_performance_by_ild) -------
-        perf = get_performance_by_ild(
-            df
-        )  # expected shape (n_steps, 3): [ild, perf_correct, perf_total?]
-        # Plot perf[:,1] and perf[:,2] as in original
-        if perf is not None and perf.size:
-            ax[1, 1].plot(
-                perf[:, 0],
-                perf[:, 1],
-                "o-",
-                markerfacecolor="none",
-                markeredgecolor="green",
-                markeredgewidth=1.5,
-                color="green",
-            )
-            ax[1, 1].plot(
-                perf[:, 0],
-                perf[:, 2],
-                "o-",
-                markerfacecolor="none",
-                markeredgecolor="black",
-                markeredgewidth=1.5,
-                color="black",
+    )
+    xlabels = np.array(
+        [
+            ["", "Trial", "Trial"],
+            ["Trial", "ILD step", "Trial"],
+            ["Trial", "Trial", ""],
+        ]
+    )
+    ylabels = np.array(
+        [
+            ["", "Left    ILD (dB SPL)    Right", "Outcome"],
+            ["Proportion", "Proportion", "Time (s)"],
+            ["Time (ms)", "Time (ms)", ""],
+        ]
+    )
+
+    # Apply styles and metadata for each axis using the helper
+    for i in range(3):
+        for j in range(3):
+            hide_ticks = i == 0 and j == 0  # top-left cell used for text
+            # The bottom-right (2,2) is turned off in original
+            if (i, j) == (2, 2):
+                ax[i, j].axis("off")
+                continue
+
+            # Set axis properties (including special yscale/ylim/hlines for certain cells)
+            yscale = None
+            ylim = None
+            hline = None
+            if (i, j) == (0, 1):
+                ylim = (-1.1 * max(np.abs(df["ILD"])), 1.1 * max(np.abs(df["ILD"])))
+                hline = {"y": 0, "color": "black"}
+            elif (i, j) == (0, 2):
+                ylim = (-9, 3)
+                hline = {"y": 0, "color": "black"}
+            elif (i, j) == (1, 1):
+                ylim = (0, 1)
+                hline = {"y": 0.5, "color": "black", "linestyle": ":"}
+            elif (i, j) == (1, 2):
+                # Time to CNP uses log scale in your original code
+                yscale = "log"
+            elif (i, j) == (1, 0):
+                ylim = (0, 1)
+            elif (i, j) == (2, 0) or (i, j) == (2, 1):
+                # Reaction and movement time panels will be in ms; no special ylim set
+                pass
+
+            _apply_common_axis_style(
+                ax[i, j],
+                title=titles[i, j],
+                xlabel=xlabels[i, j],
+                ylabel=ylabels[i, j],
+                hide_spines=True,
+                hide_ticks=hide_ticks,
+                yscale=yscale,
+                ylim=ylim,
+                hline=hline,
             )
 
-        # ------- Panel (1,2): Time to central nose poke (cnp_time) -------
-        # Use the same pattern as ILD/time panels: different markers for success/ILD sign
-        cnp_combos = []
-        cnp_combos.append(
-            {
-                "mask": (df["success"] == 1) & (df["ILD"] < 0),
-                "marker": "<",
-                "edgecolor": "green",
-            }
-        )
-        cnp_combos.append(
-            {
-                "mask": (df["success"] == 1) & (df["ILD"] > 0),
-                "marker": ">",
-                "edgecolor": "green",
-            }
-        )
-        cnp_combos.append(
-            {
-                "mask": (df["success"] == -1) & (df["ILD"] < 0),
-                "marker": "<",
-                "edgecolor": "red",
-            }
-        )
-        cnp_combos.append(
-            {
-                "mask": (df["success"] == -1) & (df["ILD"] > 0),
-                "marker": ">",
-                "edgecolor": "red",
-            }
-        )
-        cnp_combos.append(
-            {"mask": (df["success"] == 0), "marker": "o", "edgecolor": "black"}
-        )
-        _scatter_by_conditions(
-            ax[1, 2], df, x_col="trial", y_col="cnp_time", combos=cnp_combos
-        )
-
-        # ------- Panel (2,0): Reaction time (timed_rt_ms) -------
-        rt_combos = []
-        rt_combos.append(
-            {
-                "mask": (df["success"] == 1) & (df["ILD"] < 0),
-                "marker": "<",
-                "edgecolor": "green",
-            }
-        )
-        rt_combos.append(
-            {
-                "mask": (df["success"] == 1) & (df["ILD"] > 0),
-                "marker": ">",
-                "edgecolor": "green",
-            }
-        )
-        rt_combos.append(
-            {
-                "mask": (df["success"] == -1) & (df["ILD"] < 0),
-                "marker": "<",
-                "edgecolor": "red",
-            }
-        )
-        rt_combos.append(
-            {
-                "mask": (df["success"] == -1) & (df["ILD"] > 0),
-                "marker": ">",
-                "edgecolor": "red",
-            }
-        )
-        rt_combos.append(
-            {"mask": (df["success"] == 0), "marker": "o", "edgecolor": "black"}
-        )
-        _scatter_by_conditions(
-            ax[2, 0], df, x_col="trial", y_col="timed_rt_ms", combos=rt_combos
-        )
-
-        # ------- Panel (2,1): Movement time (timed_mt_ms) -------
-        mt_combos = []
-        mt_combos.append(
+    # Add informative text in top-left cell position (uses figure coordinates)
+    info_text = _build_text_block(df)
+    plt.text(
+        ax[0, 0].get_position().x0 + 0.005,
+        ax[0, 0].get_position().y0 + 0.06,
+        info_text,
+        transform=fig.transFigure,
+        fontsize=8,
+        linespacing=1.5,
+    )
+
+    # ------- Panel (0,1): ILD condition and trial outcome markers -------
+    # For ILD we plot three success categories with different edge colors
+    combos_ild = []
+    for outcome, color in colors_success.items():
+        combos_ild.append(
             {
-                "mask": (df["success"] == 1) & (df["ILD"] < 0),
-                "marker": "<",
-                "edgecolor": "green",
-            }
-        )
-        mt_combos.append(
-            {
-                "mask": (df["success"] == 1) & (df["ILD"] > 0),
-                "marker": ">",
-                "edgecolor": "green",
-            }
-        )
-        mt_combos.append(
-            {
-                "mask": (df["success"] == -1) & (df["ILD"] < 0),
-                "marker": "<",
-                "edgecolor": "red",
+                "rows": by_outcome.get((outcome,), empty),
+                "marker": "o",
+                "edgecolor": color,
+                "edgewidth": 1.5,
             }
         )
-        mt_combos.append(
+    _scatter_by_conditions(ax[0, 1], df, x_col="trial", y_col="ILD", combos=combos_ild)
+
+    # ------- Panel (0,2): Outcome with abort tags -------
+    # Build combos for success & ILD sign using left "<" and right ">" markers and two levels (success:1, -1)
+    outcome_combos = []
+    # Success correct (1): left if ILD<0, right if ILD>0 (use same color)
+    outcome_combos.append(
+        {
+            "rows": by_side.get(("correct", "left"), empty),
+            "marker": "<",
+            "edgecolor": colors_aborts[0],
+            "y_const": 2,
+        }
+    )
+    outcome_combos.append(
+        {
+            "rows": by_side.get(("correct", "right"), empty),
+            "marker": ">",
+            "edgecolor": colors_aborts[0],
+            "y_const": 2,
+        }
+    )
+    # Incorrect (-1)
+    outcome_combos.append(
+        {
+            "rows": by_side.get(("incorrect", "left"), empty),
+            "marker": "<",
+            "edgecolor": colors_aborts[1],
+            "y_const": 1,
+        }
+    )
+    outcome_combos.append(
+        {
+            "rows": by_side.get(("incorrect", "right"), empty),
+            "marker": ">",
+            "edgecolor": colors_aborts[1],
+            "y_const": 1,
+        }
+    )
+
+    # Add abort type markers at fixed negative y positions (matching original mapping)
+    for idx, atype in enumerate(abort_types):
+        y_const = -(idx + 1)  # maps CNP->-1, Fixation->-2, ...
+        color = colors_aborts[idx + 2]
+        outcome_combos.append(
             {
-                "mask": (df["success"] == -1) & (df["ILD"] > 0),
-                "marker": ">",
-                "edgecolor": "red",
+                "rows": by_abort.get((atype,), empty),
+                "marker": "o",
+                "edgecolor": color,
+                "y_const": y_const,
             }
         )
-        mt_combos.append(
-            {"mask": (df["success"] == 0), "marker": "o", "edgecolor": "black"}
-        )
-        _scatter_by_conditions(
-            ax[2, 1], df, x_col="trial", y_col="timed_mt_ms", combos=mt_combos
-        )
 
-        # Save figure
-        fig_path = os.path.join(path, f"block_{block_num}.png")
-        fig.savefig(fig_path)
-        if backup_path is not None:
-            fig_backup_path = os.path.join(backup_path, f"block_{block_num}.png")
-            fig.savefig(fig_backup_path)
-        plt.close(fig)
+    _scatter_by_conditions(
+        ax[0, 2], df, x_col="trial", y_col="trial", combos=outcome_combos
+    )
+
+    # Adjust explicit y-ticks labels for outcome panel to match original mapping
+    ax[0, 2].set_yticks(
+        range(3, -9, -1),
+        [
+            "",
+            "Trial +",
+            "Trial -",
+            "",
+            "CNP",
+            "Fixation",
+            "RT+",
+            "RT-",
+            "MT+",
+            "MT-",
+            "LNP",
+            "IO",
+        ],
+    )
+
+    # ------- Panel (1,0): Running average performance (block_perf vs trial) -------
+    perf_combo = [
+        {
+            "rows": np.arange(df.shape[0]),
+            "marker": "o",
+            "edgecolor": "green",
+            "edgewidth": 1.5,
+        }
+    ]
+    _scatter_by_conditions(
+        ax[1, 0], df, x_col="trial", y_col="block_perf", combos=perf_combo
+    )
+
+    # ------- Panel (1,1): Performance per ILD (from the statistics layer) -------
+    perf = performance_by_ild(df)  # shape (n_steps, 3): [ild, performance, abort ratio]
+    # Plot perf[:,1] and perf[:,2] as in original
+    if perf is not None and perf.size:
+        ax[1, 1].plot(
+            perf[:, 0],
+            perf[:, 1],
+            "o-",
+            markerfacecolor="none",
+            markeredgecolor="green",
+            markeredgewidth=1.5,
+            color="green",
+        )
+        ax[1, 1].plot(
+            perf[:, 0],
+            perf[:, 2],
+            "o-",
+            markerfacecolor="none",
+            markeredgecolor="black",
+            markeredgewidth=1.5,
+            color="black",
+        )
+
+    # ------- Panel (1,2): Time to central nose poke (cnp_time) -------
+    # Use the same pattern as ILD/time panels: different markers for success/ILD sign
+    cnp_combos = []
+    cnp_combos.append(
+        {
+            "rows": by_side.get(("correct", "left"), empty),
+            "marker": "<",
+            "edgecolor": "green",
+        }
+    )
+    cnp_combos.append(
+        {
+            "rows": by_side.get(("correct", "right"), empty),
+            "marker": ">",
+            "edgecolor": "green",
+        }
+    )
+    cnp_combos.append(
+        {
+            "rows": by_side.get(("incorrect", "left"), empty),
+            "marker": "<",
+            "edgecolor": "red",
+        }
+    )
+    cnp_combos.append(
+        {
+            "rows": by_side.get(("incorrect", "right"), empty),
+            "marker": ">",
+            "edgecolor": "red",
+        }
+    )
+    cnp_combos.append(
+        {"rows": by_outcome.get(("abort",), empty), "marker": "o", "edgecolor": "black"}
+    )
+    _scatter_by_conditions(
+        ax[1, 2], df, x_col="trial", y_col="cnp_time", combos=cnp_combos
+    )
+
+    # ------- Panel (2,0): Reaction time (timed_rt_ms) -------
+    rt_combos = []
+    rt_combos.append(
+        {
+            "rows": by_side.get(("correct", "left"), empty),
+            "marker": "<",
+            "edgecolor": "green",
+        }
+    )
+    rt_combos.append(
+        {
+            "rows": by_side.get(("correct", "right"), empty),
+            "marker": ">",
+            "edgecolor": "green",
+        }
+    )
+    rt_combos.append(
+        {
+            "rows": by_side.get(("incorrect", "left"), empty),
+            "marker": "<",
+            "edgecolor": "red",
+        }
+    )
+    rt_combos.append(
+        {
+            "rows": by_side.get(("incorrect", "right"), empty),
+            "marker": ">",
+            "edgecolor": "red",
+        }
+    )
+    rt_combos.append(
+        {"rows": by_outcome.get(("abort",), empty), "marker": "o", "edgecolor": "black"}
+    )
+    _scatter_by_conditions(
+        ax[2, 0], df, x_col="trial", y_col="timed_rt_ms", combos=rt_combos
+    )
+
+    # ------- Panel (2,1): Movement time (timed_mt_ms) -------
+    mt_combos = []
+    mt_combos.append(
+        {
+            "rows": by_side.get(("correct", "left"), empty),
+            "marker": "<",
+            "edgecolor": "green",
+        }
+    )
+    mt_combos.append(
+        {
+            "rows": by_side.get(("correct", "right"), empty),
+            "marker": ">",
+            "edgecolor": "green",
+        }
+    )
+    mt_combos.append(
+        {
+            "rows": by_side.get(("incorrect", "left"), empty),
+            "marker": "<",
+            "edgecolor": "red",
+        }
+    )
+    mt_combos.append(
+        {
+            "rows": by_side.get(("incorrect", "right"), empty),
+            "marker": ">",
+            "edgecolor": "red",
+        }
+    )
+    mt_combos.append(
+        {"rows": by_outcome.get(("abort",), empty), "marker": "o", "edgecolor": "black"}
+    )
+    _scatter_by_conditions(
+        ax[2, 1], df, x_col="trial", y_col="timed_mt_ms", combos=mt_combos
+    )
+
+    # Render the figure only once
+    image = io.BytesIO()
+    fig.savefig(image, format="png")
+    plt.close(fig)
+    return image.getvalue()
+
+
+def _init_worker():
+    # Worker processes only render figures to memory, so they don't need an interactive backend
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _block_hash(df: pd.DataFrame) -> str:
+    # The figure depends on the rows of the block and on the plotting code
+    digest = hashlib.sha256(_CODE_HASH.encode())
+    digest.update(df.to_csv(index=False).encode())
+    return digest.hexdigest()
+
+
+def _load_hashes(path: str) -> dict:
+    try:
+        with open(os.path.join(path, PLOT_HASHES), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_hashes(path: str, hashes: dict):
+    with open(os.path.join(path, PLOT_HASHES), "w") as file:
+        json.dump(hashes, file, indent=4)
 
 
 def get_performance_by_ild(df):
-    ilds = np.sort(df["ILD"].unique())
-    array = np.zeros((ilds.size, 3))
-
-    for i in range(ilds.size):
-        df2 = df[df["ILD"] == ilds[i]]
-        array[i, 0] = ilds[i]
-        array[i, 2] = df2[df2["success"] == 0].shape[0] / float(df2.shape[0])
-        try:
-            array[i, 1] = (
-                float(df2[df2["success"] == 1].shape[0])
-                / df2[(df2["success"] == 1) | (df2["success"] == -1)].shape[0]
-            )
-        except Exception:
-            array[i, 1] = 0
-
-    return array
+    return performance_by_ild(encode_conditions(df))
@@ -0,0 +1,384 @@
+import argparse
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from sgen.setup import Camera
+from shutdown.frame_index import INDEX_SUFFIX, FrameIndex
+from shutdown.store import read_out
+from shutdown.tool import positive_int
+from shutdown.video_preprocessing import FRAME_EVENTS
+
+CLIP_DIR = "clips"
+SETUP_PATH = "../src/config/setup.json"
+
+# Maximum number of clips cut from the same video by a single FFmpeg process
+BATCH_SIZE = 16
+
+
+@dataclass(frozen=True)
+class Clip:
+    trial: int
+    event: str
+    video: Path
+    start_frame: int
+    end_frame: int
+    path: Path
+
+
+def load_camera(setup_path: Path = SETUP_PATH) -> Camera:
+    """
+    Loads the camera settings of the setup.
+
+    Parameters
+    ----------
+    setup_path : Path
+        the path to the `setup.json` file saved by the startup.
+
+    Returns
+    -------
+    Camera
+        the camera settings.
+    """
+    with open(setup_path, "r") as file:
+        setup = json.load(file)
+    return Camera.model_validate(setup["camera"])
+
+
+def find_videos(session_dir: Path) -> Dict[Path, FrameIndex]:
+    """
+    Finds the videos of a session that have a frame index, sorted by the time they began.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+
+    Returns
+    -------
+    dict
+        a dictionary with the paths to the videos as keys and the respective frame indexes as values.
+    """
+    videos = {}
+    for index_file in sorted(Path(session_dir).glob("*" + INDEX_SUFFIX)):
+        video = index_file.with_name(index_file.name[: -len(INDEX_SUFFIX)] + ".mp4")
+        index = FrameIndex(index_file)
+        if video.is_file() and len(index) > 0:
+            videos[video] = index
+    return videos
+
+
+def plan_clips(
+    out: pd.DataFrame,
+    videos: Dict[Path, FrameIndex],
+    clip_dir: Path,
+    frames_per_second: float,
+    event: str = "trial_start",
+    end_event: Optional[str] = None,
+    before: float = 1.0,
+    after: float = 2.0,
+) -> Dict[Path, List[Clip]]:
+    """
+    Computes the frame range of the clip of every trial and groups the clips by video.
+
+    Parameters
+    ----------
+    out : pd.DataFrame
+        the out DataFrame of the trials to cut, with the `*_frame` columns.
+    videos : dict
+        the videos of the session and their frame indexes, as returned by `find_videos`.
+    clip_dir : Path
+        the directory where the clips are saved.
+    frames_per_second : float
+        the frame rate of the videos.
+    event : str
+        the event at which the clips are centered (one of the keys of `FRAME_EVENTS`).
+    end_event : str, optional
+        the event at which the clips end. If None, the clips end at `event`.
+    before : float
+        the duration (s) of the clip before `event`.
+    after : float
+        the duration (s) of the clip after `end_event` (or `event`).
+
+    Returns
+    -------
+    dict
+        a dictionary with the paths to the videos as keys and the lists of their clips, sorted by start frame, as values.
+    """
+    end_event = event if end_event is None else end_event
+    start = out[FRAME_EVENTS[event]].to_numpy(dtype=float) - round(
+        before * frames_per_second
+    )
+    end = out[FRAME_EVENTS[end_event]].to_numpy(dtype=float) + round(
+        after * frames_per_second
+    )
+
+    # The clips are named after their trial and events, so that the clips of other events of the same trial aren't overwritten
+    events = event if end_event == event else event + "-" + end_event
+
+    # The frame numbers restart in every segment, so each trial is assigned to the video whose frames span the time of the event
+    times = out[event].to_numpy(dtype=float)
+    clips = {video: [] for video in videos}
+    for video, index in videos.items():
+        in_video = (times >= index.timestamps[0]) & (times <= index.timestamps[-1])
+        skipped = []
+        for i in np.flatnonzero(in_video & ~np.isnan(start)):
+            trial = int(out["trial"].iloc[i])
+
+            # The clip can't be cut if its end is missing or before its start (for example, when `end_event` happens before `event`)
+            start_frame = max(1, int(start[i]))
+            end_frame = -1 if np.isnan(end[i]) else min(len(index), int(end[i]))
+            if end_frame < start_frame:
+                skipped.append(str(trial))
+                continue
+
+            clips[video].append(
+                Clip(
+                    trial=trial,
+                    event=event,
+                    video=video,
+                    start_frame=start_frame,
+                    end_frame=end_frame,
+                    path=clip_dir
+                    / (video.stem + "_trial" + str(trial) + "_" + events + ".mp4"),
+                )
+            )
+        clips[video].sort(key=lambda clip: clip.start_frame)
+
+        if skipped:
+            print(
+                "Skipping "
+                + str(len(skipped))
+                + " clips of "
+                + str(video)
+                + " whose end frame is missing or before the start frame (trials "
+                + ", ".join(skipped)
+                + ")"
+            )
+
+    return {video: video_clips for video, video_clips in clips.items() if video_clips}
+
+
+def _codec_args(camera: Camera) -> List[str]:
+    # Encode the clips with the same settings used by the task to record the videos
+    if camera.codec == "h264_amf":
+        args = ["-c:v", "h264_amf", "-quality", "2", "-preset", "2", "-rc", "cqp"]
+        for option, value in [
+            ("-qp_i", camera.qp_i),
+            ("-qp_p", camera.qp_p),
+            ("-qp_b", camera.qp_b),
+        ]:
+            if value != -1:
+                args.extend([option, str(value)])
+        return args
+    return ["-c:v", camera.codec, "-vb", "20M"]
+
+
+def ffmpeg_command(
+    clips: List[Clip], camera: Camera, ffmpeg: str = "ffmpeg"
+) -> List[str]:
+    """
+    Builds a single FFmpeg command that cuts several clips from the same video.
+
+    Each clip is opened as a separate input that seeks directly to its start, so the video is never decoded from the beginning.
+
+    Parameters
+    ----------
+    clips : list[Clip]
+        the clips to cut, all from the same video.
+    camera : Camera
+        the camera settings of the setup.
+    ffmpeg : str
+        the FFmpeg executable.
+
+    Returns
+    -------
+    list[str]
+        the command arguments.
+    """
+    command = [ffmpeg, "-hide_banner", "-loglevel", "error", "-y"]
+    for clip in clips:
+        seek = (clip.start_frame - 1) / camera.frames_per_second
+        command.extend(["-ss", f"{seek:.6f}", "-i", str(clip.video)])
+
+    codec = _codec_args(camera)
+    for i, clip in enumerate(clips):
+        frames = clip.end_frame - clip.start_frame + 1
+        command.extend(["-map", f"{i}:v:0", "-frames:v", str(frames)])
+        command.extend(codec)
+        command.append(str(clip.path))
+    return command
+
+
+def _run_batch(command: List[str]) -> Optional[str]:
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        return result.stderr.strip()
+    return None
+
+
+def extract_clips(
+    session_dir: Path,
+    event: str = "trial_start",
+    end_event: Optional[str] = None,
+    before: float = 1.0,
+    after: float = 2.0,
+    trials: Optional[List[int]] = None,
+    abort_types: Optional[List[str]] = None,
+    camera: Optional[Camera] = None,
+    workers: Optional[int] = None,
+    ffmpeg: str = "ffmpeg",
+) -> List[Path]:
+    """
+    Cuts a clip around an event of each trial of a session and saves them to the `clips` directory of the session.
+
+    The clips of each video are cut in batches, each of them by a single FFmpeg process, and the batches run concurrently.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+    event : str
+        the event at which the clips are centered (one of the keys of `FRAME_EVENTS`).
+    end_event : str, optional
+        the event at which the clips end. If None, the clips end at `event`.
+    before : float
+        the duration (s) of the clip before `event`.
+    after : float
+        the duration (s) of the clip after `end_event` (or `event`).
+    trials : list[int], optional
+        the trials to cut. If None, every trial is cut.
+    abort_types : list[str], optional
+        the abort types of the trials to cut (for example, "CNP" or "RT+"). If None, the trials are not filtered by abort type.
+    camera : Camera, optional
+        the camera settings of the setup. If None, they're read from the `setup.json` file.
+    workers : int, optional
+        the maximum number of FFmpeg processes running at the same time.
+    ffmpeg : str
+        the FFmpeg executable.
+
+    Returns
+    -------
+    list[Path]
+        the paths to the clips that were saved.
+    """
+    session_dir = Path(session_dir)
+    if camera is None:
+        camera = load_camera()
+
+    out = read_out(
+        session_dir
+        / ("out_" + session_dir.parent.name + "_" + session_dir.name + ".csv")
+    )
+    if trials is not None:
+        out = out[out["trial"].isin(trials)]
+    if abort_types is not None:
+        out = out[out["abort_type"].isin(abort_types)]
+
+    clip_dir = session_dir / CLIP_DIR
+    clip_dir.mkdir(exist_ok=True)
+    clips = plan_clips(
+        out,
+        find_videos(session_dir),
+        clip_dir,
+        camera.frames_per_second,
+        event,
+        end_event,
+        before,
+        after,
+    )
+
+    batches = []
+    for video_clips in clips.values():
+        for i in range(0, len(video_clips), BATCH_SIZE):
+            batches.append(video_clips[i : i + BATCH_SIZE])
+
+    saved = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        commands = [ffmpeg_command(batch, camera, ffmpeg) for batch in batches]
+        for batch, error in zip(batches, pool.map(_run_batch, commands)):
+            if error is not None:
+                print("It was not possible to cut the clips of " + str(batch[0].video))
+                print(error)
+                continue
+            saved.extend(clip.path for clip in batch)
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cuts a video clip around an event of each trial of a session."
+    )
+    parser.add_argument("path", help="the session directory.")
+    parser.add_argument(
+        "-e",
+        "--event",
+        default="trial_start",
+        choices=list(FRAME_EVENTS),
+        help="the event at which the clips are centered (default: trial_start).",
+    )
+    parser.add_argument(
+        "--end-event",
+        default=None,
+        choices=list(FRAME_EVENTS),
+        help="the event at which the clips end (default: the same as --event).",
+    )
+    parser.add_argument(
+        "-b",
+        "--before",
+        type=float,
+        default=1.0,
+        help="the duration (s) of the clip before the event (default: 1).",
+    )
+    parser.add_argument(
+        "-a",
+        "--after",
+        type=float,
+        default=2.0,
+        help="the duration (s) of the clip after the event (default: 2).",
+    )
+    parser.add_argument(
+        "-t", "--trials", type=int, nargs="+", help="the trials to cut."
+    )
+    parser.add_argument(
+        "--aborts",
+        nargs="+",
+        help="cut only the trials with these abort types (for example, CNP RT+).",
+    )
+    parser.add_argument(
+        "-s",
+        "--setup",
+        default=SETUP_PATH,
+        help="the setup.json file with the camera settings.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=positive_int,
+        default=None,
+        help="the number of FFmpeg processes running at the same time (default: chosen by Python).",
+    )
+    parser.add_argument(
+        "--ffmpeg", default="ffmpeg", help="the FFmpeg executable (default: ffmpeg)."
+    )
+    args = parser.parse_args()
+
+    saved = extract_clips(
+        Path(args.path),
+        args.event,
+        args.end_event,
+        args.before,
+        args.after,
+        args.trials,
+        args.aborts,
+        load_camera(args.setup),
+        args.workers,
+        args.ffmpeg,
+    )
+    print(str(len(saved)) + " clips were saved")
@@ -0,0 +1,402 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    get_args,
+    get_origin,
+)
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+
+from sgen.output import Output
+from shutdown.reader import iter_out_chunks
+
+COLUMN_RENAMES = {
+    "animal_id": "animal",
+    "trial.number": "trial",
+    "trial.start_time": "trial_start",
+    "trial.tared_start_time": "tared_trial_start",
+    "trial.end_time": "trial_end",
+    "trial.duration": "trial_duration",
+    "block.number": "block",
+    "block.training_level": "training_level",
+    "block.trials_per_block": "trials_per_block",
+    "session.number": "session",
+    "session.type": "session_type",
+    "session.box": "box",
+    "sound.abl": "ABL",
+    "sound.ild": "ILD",
+    "sound.sound_index": "sound_index",
+    "sound.left_amp": "left_amp",
+    "sound.right_amp": "right_amp",
+    "sound.is_short_sound": "is_short_sound",
+    "sound.short_duration": "short_duration",
+    "iti.intended_duration": "intended_iti",
+    "iti.start_time": "iti_start",
+    "iti.end_time": "iti_end",
+    "iti.timed_duration": "iti_duration",
+    "cnp.start_time": "cnp_start",
+    "cnp.timed_value": "cnp_time",
+    "cnp.max_duration": "max_cnp",
+    "fixation_time.opto_onset_time.base_time": "base_ft_oot",
+    "fixation_time.opto_onset_time.exp_mean": "ft_oot_exp",
+    "fixation_time.opto_onset_time.intended_duration": "intended_ft_oot",
+    "fixation_time.opto_onset_time.timed_duration": "timed_ft_oot",
+    "fixation_time.sound_onset_time.base_time": "base_ft_sot",
+    "fixation_time.sound_onset_time.exp_mean": "ft_sot_exp",
+    "fixation_time.sound_onset_time.intended_duration": "intended_ft_sot",
+    "fixation_time.sound_onset_time.timed_duration": "duration_ft_sot",
+    "fixation_time.intended_duration": "intended_fix_time",
+    "fixation_time.timed_duration": "fix_time",
+    "fixation_time.total_duration": "total_fix_time",
+    "reaction_time.base_time": "base_rt",
+    "reaction_time.max_duration": "max_rt",
+    "reaction_time.start_time": "rt_start",
+    "reaction_time.timed_duration": "timed_rt",
+    "movement_time.max_duration": "max_mt",
+    "movement_time.start_time": "mt_start",
+    "movement_time.timed_duration": "timed_mt",
+    "lnp_time.intended_duration": "intended_lnp",
+    "lnp_time.start_time": "lnp_start",
+    "lnp_time.timed_duration": "timed_lnp",
+    "outcome.response_poke": "response_poke",
+    "outcome.success": "success",
+    "outcome.abort_type": "abort_type",
+    "outcome.block_performance": "block_perf",
+    "outcome.block_abort_ratio": "block_abort_ratio",
+    "penalty_times.incorrect": "incorrect_penalty",
+    "penalty_times.abort": "abort_penalty",
+    "penalty_times.fixation_abort": "ft_abort_penalty",
+    "reward.left": "reward_left",
+    "reward.right": "reward_right",
+    "reward.delivered": "reward_delivered",
+    "optogenetics.opto_trial": "opto_trial",
+    "optogenetics.duration": "opto_duration",
+    "optogenetics.mode": "opto_mode",
+    "optogenetics.led0_voltage": "led0_voltage",
+    "optogenetics.led0_power": "led0_power",
+    "optogenetics.led1_voltage": "led1_voltage",
+    "optogenetics.led1_power": "led1_power",
+}
+
+# NumPy dtype used to store each kind of leaf field
+KIND_DTYPES = {
+    "float": np.float64,
+    "int": np.int64,
+    "bool": np.bool_,
+    "str": object,
+}
+
+
+@dataclass(frozen=True)
+class Leaf:
+    """
+    A leaf (non-nested) field of the out structure.
+
+    Attributes
+    ----------
+    path : tuple[str, ...]
+        the sequence of keys needed to reach the field in a JSON record.
+    column : str
+        the name of the column in the final out DataFrame.
+    kind : Literal["float", "int", "bool", "str"]
+        the type of the field.
+    """
+
+    path: Tuple[str, ...]
+    column: str
+    kind: Literal["float", "int", "bool", "str"]
+
+
+def _leaf_kind(annotation: Any) -> str:
+    if annotation is bool:
+        return "bool"
+    if annotation is int:
+        return "int"
+    if annotation is float:
+        return "float"
+    if get_origin(annotation) is Literal:
+        kinds = {_leaf_kind(type(arg)) for arg in get_args(annotation)}
+        if len(kinds) == 1:
+            return kinds.pop()
+    return "str"
+
+
+def _collect_leaves(model: type[BaseModel], prefix: Tuple[str, ...] = ()) -> List[Leaf]:
+    """
+    Walks a pydantic model and returns its leaf fields in declaration order.
+    """
+    leaves = []
+    for name, field in model.model_fields.items():
+        path = prefix + (name,)
+        annotation = field.annotation
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            leaves.extend(_collect_leaves(annotation, path))
+        else:
+            dotted = ".".join(path)
+            leaves.append(
+                Leaf(path, COLUMN_RENAMES.get(dotted, dotted), _leaf_kind(annotation))
+            )
+    return leaves
+
+
+# The top-level scalar fields come first, which is the same column order produced by `pd.json_normalize`
+OUT_LEAVES = sorted(_collect_leaves(Output), key=lambda leaf: len(leaf.path) > 1)
+
+
+def _make_getter(leaves: List[Leaf]) -> Callable[[dict], tuple]:
+    """
+    Generates a function that extracts the values of all leaf fields from a record with direct indexing, which is much faster than walking each path in a loop.
+    """
+    items = ["record" + "".join(f"[{key!r}]" for key in leaf.path) for leaf in leaves]
+    source = "def getter(record):\n    return (" + ", ".join(items) + ",)\n"
+    namespace: Dict[str, Any] = {}
+    exec(source, namespace)
+    return namespace["getter"]
+
+
+def _make_checker(leaves: List[Leaf]) -> Callable[[dict], bool]:
+    """
+    Generates a function that checks whether a record has no other keys than the ones of the leaf fields (and of the dictionaries containing them), by comparing the number of keys of each nested dictionary. It's only valid for records from which the getter could extract every leaf field.
+    """
+    keys: Dict[Tuple[str, ...], set] = {}
+    for leaf in leaves:
+        for i in range(len(leaf.path)):
+            keys.setdefault(leaf.path[:i], set()).add(leaf.path[i])
+    items = [
+        "len(record" + "".join(f"[{key!r}]" for key in prefix) + f") == {len(names)}"
+        for prefix, names in keys.items()
+    ]
+    source = "def checker(record):\n    return " + " and ".join(items) + "\n"
+    namespace: Dict[str, Any] = {}
+    exec(source, namespace)
+    return namespace["checker"]
+
+
+def _unknown_fields(
+    record: dict, known: set, prefix: Tuple[str, ...] = ()
+) -> List[Tuple[Tuple[str, ...], Any]]:
+    # Walk the nested dictionaries of a record, returning the paths and values of the leaf fields that aren't known
+    fields = []
+    for key, value in record.items():
+        path = prefix + (key,)
+        if isinstance(value, dict):
+            fields.extend(_unknown_fields(value, known, path))
+        elif path not in known:
+            fields.append((path, value))
+    return fields
+
+
+class ColumnBuffers:
+    """
+    Preallocated typed columns that are filled with out records, one chunk at a time.
+
+    Values that don't fit the type declared in the `Output` schema (for example, "NaN" strings in integer fields, floats in integer fields or fields missing from older versions of the task) upcast the respective column to `float64` or `object`. Columns which never appear in the records are dropped and fields which aren't declared in the schema (for example, from newer versions of the task) are added as columns named after their dotted path, just like with `pd.json_normalize`.
+
+    Parameters
+    ----------
+    capacity : int
+        the initial number of rows of each column.
+    leaves : list[Leaf], optional
+        the leaf fields to extract from each record.
+    """
+
+    def __init__(self, capacity: int, leaves: Optional[List[Leaf]] = None):
+        self.leaves = list(OUT_LEAVES if leaves is None else leaves)
+        self.size = 0
+        self._capacity = max(capacity, 1)
+        self._getter = _make_getter(self.leaves)
+        self._checker = _make_checker(self.leaves)
+        self._arrays = [
+            np.empty(self._capacity, dtype=KIND_DTYPES[leaf.kind])
+            for leaf in self.leaves
+        ]
+        self._seen = np.zeros(len(self.leaves), dtype=bool)
+
+    def _get_slow(self, record: dict) -> tuple:
+        values = []
+        for j, leaf in enumerate(self.leaves):
+            value = record
+            try:
+                for key in leaf.path:
+                    value = value[key]
+            except (KeyError, TypeError):
+                value = np.nan
+            else:
+                self._seen[j] = True
+            values.append(value)
+        return tuple(values)
+
+    def _add_unknown_fields(self, record: dict) -> bool:
+        # Add a column for every field of the record that isn't declared in the schema, returning whether any was added
+        fields = _unknown_fields(record, {leaf.path for leaf in self.leaves})
+        if len(fields) == 0:
+            return False
+        for path, value in fields:
+            if type(value) is bool:
+                kind = "bool"
+            elif type(value) is int:
+                kind = "int"
+            elif type(value) is float:
+                kind = "float"
+            else:
+                kind = "str"
+            dotted = ".".join(path)
+            self.leaves.append(Leaf(path, COLUMN_RENAMES.get(dotted, dotted), kind))
+
+            # The field is missing from the rows written before, which are filled with NaN
+            if self.size == 0:
+                array = np.empty(self._capacity, dtype=KIND_DTYPES[kind])
+            elif kind in ("int", "float"):
+                array = np.full(self._capacity, np.nan)
+            else:
+                array = np.full(self._capacity, np.nan, dtype=object)
+            self._arrays.append(array)
+            self._seen = np.append(self._seen, False)
+
+        self._getter = _make_getter(self.leaves)
+        self._checker = _make_checker(self.leaves)
+        return True
+
+    def _reserve(self, n: int):
+        if self.size + n <= self._capacity:
+            return
+        while self._capacity < self.size + n:
+            self._capacity *= 2
+        for j, old in enumerate(self._arrays):
+            new = np.empty(self._capacity, dtype=old.dtype)
+            new[: self.size] = old[: self.size]
+            self._arrays[j] = new
+
+    def _write(self, j: int, values: tuple):
+        array = self._arrays[j]
+        chunk = slice(self.size, self.size + len(values))
+
+        if array.dtype.kind == "b" and not all(type(v) is bool for v in values):
+            array = self._upcast(j, object)
+        elif array.dtype.kind in "if":
+            # Floats would be truncated by an integer column
+            if array.dtype.kind == "i" and any(type(v) is float for v in values):
+                array = self._upcast(j, np.float64)
+            try:
+                array[chunk] = values
+                return
+            except (ValueError, TypeError):
+                array = self._upcast(j, np.float64 if _numeric(values) else object)
+                if array.dtype.kind == "f":
+                    array[chunk] = [np.nan if v == "NaN" else v for v in values]
+                    return
+
+        array[chunk] = values
+        if array.dtype == object:
+            window = array[chunk]
+            window[window == "NaN"] = np.nan
+
+    def _upcast(self, j: int, dtype) -> np.ndarray:
+        old = self._arrays[j]
+        new = np.empty(self._capacity, dtype=dtype)
+        new[: self.size] = old[: self.size]
+        self._arrays[j] = new
+        return new
+
+    def _rows(self, records: List[dict]) -> Tuple[List[tuple], bool, bool]:
+        # Extract the values of every record, adding the fields that aren't in the schema
+        rows = []
+        complete = False
+        added = False
+        for record in records:
+            try:
+                row = self._getter(record)
+                complete = True
+                if not self._checker(record):
+                    added |= self._add_unknown_fields(record)
+            except (KeyError, TypeError):
+                row = self._get_slow(record)
+                added |= self._add_unknown_fields(record)
+            rows.append(row)
+        return rows, complete, added
+
+    def extend(self, records: List[dict]):
+        """
+        Appends a chunk of parsed out records to the columns.
+
+        Parameters
+        ----------
+        records : list[dict]
+            the nested dictionaries parsed from the lines of an `out.json` file.
+        """
+        if len(records) == 0:
+            return
+
+        rows, complete, added = self._rows(records)
+        if added:
+            # Extract the rows again with the columns of the new fields
+            rows, complete, _ = self._rows(records)
+        if complete:
+            self._seen[:] = True
+
+        self._reserve(len(rows))
+        for j, values in enumerate(zip(*rows)):
+            self._write(j, values)
+        self.size += len(rows)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Builds the out DataFrame from the filled columns.
+
+        Returns
+        -------
+        pd.DataFrame
+            the DataFrame with the short column names from `COLUMN_RENAMES`.
+        """
+        columns: Dict[str, np.ndarray] = {
+            leaf.column: array[: self.size]
+            for leaf, array, seen in zip(self.leaves, self._arrays, self._seen)
+            if seen
+        }
+        return pd.DataFrame(columns, copy=False)
+
+
+def _numeric(values: tuple) -> bool:
+    return all(
+        v == "NaN" or (isinstance(v, (int, float)) and not isinstance(v, bool))
+        for v in values
+    )
+
+
+def _count_lines(file: Path) -> int:
+    count = 0
+    with open(file, "rb") as f:
+        while block := f.read(1 << 20):
+            count += block.count(b"\n")
+    return count
+
+
+def read_out_frame(file: Path, chunk_size: int = 1000) -> pd.DataFrame:
+    """
+    Parses an `out.json` file straight into a DataFrame with the columns of the `Output` schema.
+
+    Parameters
+    ----------
+    file : Path
+        path of the JSON-lines file to be read.
+    chunk_size : int, optional
+        the number of records parsed before being written to the columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        the out DataFrame with the short column names from `COLUMN_RENAMES`.
+    """
+    buffers = ColumnBuffers(_count_lines(file))
+    for chunk in iter_out_chunks(file, chunk_size):
+        buffers.extend(chunk)
+    return buffers.to_frame()
@@ -0,0 +1,161 @@
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+INDEX_SUFFIX = "_frames.npy"
+
+# Each record of the index has the number of a frame and its Harp timestamp (s)
+INDEX_DTYPE = np.dtype([("frame_id", "<i8"), ("timestamp", "<f8")])
+
+
+def video_path(session_dir: Path, time_str: str) -> Path:
+    """
+    Builds the path to the video of a session segment, which is saved by the task as `<animal>_<YYMMDD>_<hhmmss>.mp4`.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+    time_str : str
+        the string of the time the segment began in the "hhmmss" format.
+
+    Returns
+    -------
+    Path
+        the path to the video.
+    """
+    session_dir = Path(session_dir)
+    name = session_dir.parent.name + "_" + session_dir.name + "_" + time_str + ".mp4"
+    return session_dir / name
+
+
+def index_path(video: Path) -> Path:
+    video = Path(video)
+    return video.with_name(video.stem + INDEX_SUFFIX)
+
+
+def first_frames(
+    timestamps: np.ndarray, frame_ids: np.ndarray, times: np.ndarray
+) -> np.ndarray:
+    """
+    Finds the first frame at or after each time.
+
+    Parameters
+    ----------
+    timestamps : np.ndarray
+        the sorted Harp timestamps of the frames.
+    frame_ids : np.ndarray
+        the frame number corresponding to each timestamp.
+    times : np.ndarray
+        the times (s) to look up, with any shape.
+
+    Returns
+    -------
+    np.ndarray
+        the frame numbers, with the same shape as `times`. Times that are NaN or after the last frame get NaN.
+    """
+    times = np.asarray(times, dtype=float)
+    indices = np.searchsorted(timestamps, times, side="left")
+    valid = ~np.isnan(times) & (indices < timestamps.size)
+    frames = np.full(times.shape, np.nan)
+    frames[valid] = frame_ids[indices[valid]]
+    return frames
+
+
+def last_frames(
+    timestamps: np.ndarray, frame_ids: np.ndarray, times: np.ndarray
+) -> np.ndarray:
+    """
+    Finds the last frame at or before each time.
+
+    Times that are NaN or before the first frame get NaN. See `first_frames` for the parameters.
+    """
+    times = np.asarray(times, dtype=float)
+    indices = np.searchsorted(timestamps, times, side="right") - 1
+    valid = ~np.isnan(times) & (indices >= 0)
+    frames = np.full(times.shape, np.nan)
+    frames[valid] = frame_ids[indices[valid]]
+    return frames
+
+
+def write_frame_index(path: Path, frame_ids: np.ndarray, timestamps: np.ndarray):
+    """
+    Saves the synchronized frames of a video as a memory-mappable index.
+
+    Parameters
+    ----------
+    path : Path
+        the path to the index file.
+    frame_ids : np.ndarray
+        the number of each frame.
+    timestamps : np.ndarray
+        the sorted Harp timestamp of each frame.
+    """
+    index = np.empty(len(frame_ids), dtype=INDEX_DTYPE)
+    index["frame_id"] = frame_ids
+    index["timestamp"] = timestamps
+
+    # Write to a temporary file first so that readers never see a partial index
+    path = Path(path)
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "wb") as file:
+        np.save(file, index)
+    temp_path.replace(path)
+
+
+class FrameIndex:
+    """
+    Maps Harp timestamps to the frames of a video through the index saved during the conversion, without synchronizing the camera again.
+
+    The index is memory-mapped, so only the pages touched by the lookups are read, and every lookup is a binary search.
+
+    Parameters
+    ----------
+    path : Path
+        the path to the index file (`<video>_frames.npy`).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        index = np.load(self.path, mmap_mode="r")
+        self.frame_ids = index["frame_id"]
+        self.timestamps = index["timestamp"]
+
+    @classmethod
+    def for_video(cls, video: Path) -> "FrameIndex":
+        return cls(index_path(video))
+
+    def __len__(self) -> int:
+        return self.frame_ids.shape[0]
+
+    def frame_at(self, times: np.ndarray) -> np.ndarray:
+        """
+        Returns the first frame at or after each time (s), or NaN if there's no such frame.
+        """
+        return first_frames(self.timestamps, self.frame_ids, times)
+
+    def frame_range(
+        self, start: np.ndarray, end: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the frames recorded between the start and end times of each event.
+
+        Parameters
+        ----------
+        start : np.ndarray
+            the start times (s) of the events.
+        end : np.ndarray
+            the end times (s) of the events.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            the first frame at or after each start time and the last frame at or before each end time. Events without frames in their range get NaN on both.
+        """
+        first = first_frames(self.timestamps, self.frame_ids, start)
+        last = last_frames(self.timestamps, self.frame_ids, end)
+        empty = np.isnan(first) | np.isnan(last) | (first > last)
+        first[empty] = np.nan
+        last[empty] = np.nan
+        return first, last
@@ -0,0 +1,110 @@
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+# NumPy dtype of each Harp payload type (without the timestamp flag)
+PAYLOAD_DTYPES = {
+    0x01: np.uint8,
+    0x02: np.uint16,
+    0x04: np.uint32,
+    0x08: np.uint64,
+    0x81: np.int8,
+    0x82: np.int16,
+    0x84: np.int32,
+    0x88: np.int64,
+    0x44: np.float32,
+}
+TIMESTAMP_FLAG = 0x10
+
+# Harp timestamps are made of the seconds and of the number of 32 us ticks
+TICK_PERIOD = 32e-6
+
+# Bits of the Harp Behavior DigitalInputState register (address 32)
+DIPORT0 = 0x1
+DIPORT1 = 0x2
+DIPORT2 = 0x4
+DI3 = 0x8
+
+
+def message_dtype(payload_type: int, length: int) -> np.dtype:
+    """
+    Builds the structured dtype of a timestamped Harp message.
+
+    Parameters
+    ----------
+    payload_type : int
+        the payload type byte of the message.
+    length : int
+        the length byte of the message, i.e. the number of bytes after it.
+
+    Returns
+    -------
+    np.dtype
+        the structured dtype with the `header`, `seconds`, `ticks`, `payload` and `checksum` fields.
+    """
+    if not payload_type & TIMESTAMP_FLAG:
+        raise ValueError("Only timestamped Harp messages are supported.")
+
+    payload = np.dtype(PAYLOAD_DTYPES[payload_type & ~TIMESTAMP_FLAG]).newbyteorder("<")
+    count = (length + 2 - 12) // payload.itemsize
+    return np.dtype(
+        [
+            ("header", np.uint8, 5),
+            ("seconds", "<u4"),
+            ("ticks", "<u2"),
+            ("payload", payload, (count,)),
+            ("checksum", np.uint8),
+        ]
+    )
+
+
+def read_register(file: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads a Harp binary register file through a memory map, without loading the whole file into memory.
+
+    Parameters
+    ----------
+    file : Path
+        the path to the register file (for example, `behavior_32.bin`).
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        the timestamps (s) of the messages and their payloads. If every message has a single value, the payload array is one-dimensional.
+    """
+    if Path(file).stat().st_size == 0:
+        return np.empty(0), np.empty(0, dtype=np.uint8)
+
+    header = np.fromfile(file, dtype=np.uint8, count=5)
+    dtype = message_dtype(int(header[4]), int(header[1]))
+
+    # Ignore the last message if it was only partially written
+    count = Path(file).stat().st_size // dtype.itemsize
+    messages = np.memmap(file, dtype=dtype, mode="r", shape=(count,))
+
+    timestamps = messages["seconds"] + messages["ticks"] * TICK_PERIOD
+    payload = messages["payload"]
+    if payload.shape[1] == 1:
+        payload = payload[:, 0]
+    return timestamps, payload
+
+
+def falling_edges(state: np.ndarray, mask: int) -> np.ndarray:
+    """
+    Finds the messages in which the bits selected by `mask` go from set to clear.
+
+    Parameters
+    ----------
+    state : np.ndarray
+        the raw bitfield values of a register.
+    mask : int
+        the bitmask of the bit of interest.
+
+    Returns
+    -------
+    np.ndarray
+        the indices of the messages where a falling edge occurs.
+    """
+    bit = (state & mask) != 0
+    return np.flatnonzero(bit[:-1] & ~bit[1:]) + 1
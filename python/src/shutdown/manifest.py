@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import sgen.output
+
+MANIFEST_NAME = "conversion_manifest.json"
+CACHE_DIR = ".conversion_cache"
+
+# Source files whose changes affect the converted output
+_CODE_FILES = [
+    Path(__file__).parent / "reader.py",
+    Path(__file__).parent / "flatten.py",
+    Path(__file__).parent / "utils.py",
+    Path(__file__).parent / "store.py",
+    Path(__file__).parent / "block_plots.py",
+    Path(__file__).parent / "stats.py",
+    Path(__file__).parent / "video_preprocessing.py",
+    Path(__file__).parent / "harp_binary.py",
+    Path(__file__).parent / "frame_index.py",
+    Path(sgen.output.__file__),
+]
+
+
+def code_version() -> str:
+    """
+    Computes a hash of the conversion source code, so that sessions are converted again whenever the code changes.
+
+    Returns
+    -------
+    str
+        the hexadecimal SHA-256 digest of the conversion source files.
+    """
+    digest = hashlib.sha256()
+    for file in _CODE_FILES:
+        digest.update(file.read_bytes())
+    return digest.hexdigest()
+
+
+def file_hash(file: Path) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_entry(file: Path, previous: Optional[dict] = None) -> dict:
+    """
+    Describes a file by its size, modification time and content hash.
+
+    The hash is only computed when the size or the modification time differ from the previous entry of the same file.
+
+    Parameters
+    ----------
+    file : Path
+        the file to describe.
+    previous : dict, optional
+        the entry of the same file in the previous manifest.
+
+    Returns
+    -------
+    dict
+        a dictionary with the `size`, `mtime` and `hash` of the file.
+    """
+    stat = file.stat()
+    if (
+        previous is not None
+        and previous.get("size") == stat.st_size
+        and previous.get("mtime") == stat.st_mtime_ns
+    ):
+        return previous
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_hash(file)}
+
+
+def segment_inputs(session_dir: Path, out_file: Path) -> List[Path]:
+    """
+    Lists the input files of a session segment, i.e. the files that produce the rows of an `out.json` file.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+    out_file : Path
+        the path to the `out.json` file of the segment.
+
+    Returns
+    -------
+    list[Path]
+        the `out.json` file, and the camera metadata and Harp Behavior files of the segment if they exist.
+    """
+    time_str = out_file.name.split("_")[1].split(".")[0]
+    files = [
+        out_file,
+        session_dir / ("cam_metadata_" + time_str + ".csv"),
+        session_dir / "events" / time_str / "behavior" / "behavior_32.bin",
+    ]
+    return [file for file in files if file.is_file()]
+
+
+def describe_inputs(
+    session_dir: Path, files: List[Path], previous: Optional[dict] = None
+) -> Dict[str, dict]:
+    """
+    Builds the manifest entries of a list of input files.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory, to which the file names are relative.
+    files : list[Path]
+        the input files.
+    previous : dict, optional
+        the entries of the same files in the previous manifest.
+
+    Returns
+    -------
+    dict
+        a dictionary with the relative paths of the files as keys and their entries as values.
+    """
+    previous = {} if previous is None else previous
+    entries = {}
+    for file in files:
+        name = file.relative_to(session_dir).as_posix()
+        entries[name] = file_entry(file, previous.get(name))
+    return entries
+
+
+def output_name(session_dir: Path, file: Path) -> str:
+    """
+    Names an output file in the manifest by its path relative to the session directory, so that the manifest stays valid when the output directory is moved. Outputs on another drive (for example, in the backup directory) are named by their absolute path.
+    """
+    try:
+        return Path(os.path.relpath(file, session_dir)).as_posix()
+    except ValueError:
+        return Path(os.path.abspath(file)).as_posix()
+
+
+def describe_outputs(session_dir: Path, files: List[Path]) -> Dict[str, dict]:
+    entries = {}
+    for file in files:
+        stat = file.stat()
+        entries[output_name(session_dir, file)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+    return entries
+
+
+def outputs_unchanged(session_dir: Path, outputs: Dict[str, dict]) -> bool:
+    """
+    Checks whether the outputs recorded in a manifest still exist and haven't been modified since.
+    """
+    for name, entry in outputs.items():
+        try:
+            stat = os.stat(Path(session_dir) / name)
+        except OSError:
+            return False
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry["mtime"]:
+            return False
+    return True
+
+
+def load_manifest(session_dir: Path) -> dict:
+    """
+    Loads the conversion manifest of a session.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+
+    Returns
+    -------
+    dict
+        the manifest, or an empty dictionary if the session was never converted or the manifest can't be read.
+    """
+    try:
+        with open(session_dir / MANIFEST_NAME, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(session_dir: Path, manifest: dict):
+    with open(session_dir / MANIFEST_NAME, "w") as file:
+        json.dump(manifest, file, indent=4)
@@ -0,0 +1,66 @@
+import json
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+
+def iter_out_records(file: Path, offset: int = 0) -> Iterator[Tuple[dict, int]]:
+    """
+    Lazily parses the records of an `out.json` file, which contains one JSON object per line.
+
+    Only complete lines (the ones ending in '\\n') are parsed, so a truncated last line (for example, when Bonsai is still writing to the file or the session crashed) is ignored, just like in `read_out_json`.
+
+    Parameters
+    ----------
+    file : Path
+        path of the JSON-lines file to be read.
+    offset : int, optional
+        the byte offset from which the file should start to be read. It should always point to the beginning of a line.
+
+    Yields
+    ------
+    tuple[dict, int]
+        the parsed record and the byte offset right after its line, which can be used to resume reading the file later.
+    """
+    with open(file, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            # Stop at the truncated last line
+            if not line.endswith(b"\n"):
+                break
+
+            offset += len(line)
+
+            # Skip blank lines
+            if line.isspace():
+                continue
+
+            yield json.loads(line), offset
+
+
+def iter_out_chunks(
+    file: Path, chunk_size: int = 1000, offset: int = 0
+) -> Iterator[List[dict]]:
+    """
+    Parses an `out.json` file in chunks of at most `chunk_size` records, so that only one chunk is held in memory at a time.
+
+    Parameters
+    ----------
+    file : Path
+        path of the JSON-lines file to be read.
+    chunk_size : int, optional
+        the maximum number of records in each chunk.
+    offset : int, optional
+        the byte offset from which the file should start to be read.
+
+    Yields
+    ------
+    list[dict]
+        a list with the records of the current chunk.
+    """
+    records = (record for record, _ in iter_out_records(file, offset))
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
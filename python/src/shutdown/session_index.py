@@ -0,0 +1,91 @@
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Names of the session (YYMMDD), animal and batch directories
+SESSION_PATTERN = re.compile(r"^\d{6}$")
+ANIMAL_PATTERN = re.compile(r"^[A-Z]{2,6}\d{4}$")
+BATCH_PATTERN = re.compile(r"^[a-zA-Z0-9][a-zA-Z0-9_]*[a-zA-Z0-9]$")
+
+# Sorted subdirectory names of every listed directory, with the directory mtime they were read at
+_CACHE: Dict[Tuple[str, str], Tuple[int, List[str]]] = {}
+
+
+def is_session(dir: Path) -> bool:
+    return SESSION_PATTERN.fullmatch(Path(dir).name) is not None
+
+
+def is_animal(dir: Path) -> bool:
+    return ANIMAL_PATTERN.fullmatch(Path(dir).name) is not None
+
+
+def is_batch(dir: Path) -> bool:
+    return BATCH_PATTERN.fullmatch(Path(dir).name) is not None
+
+
+def list_dirs(dir: Path, pattern: re.Pattern) -> List[Path]:
+    """
+    Lists the subdirectories of a directory whose names match a pattern, sorted by name.
+
+    The directory is read with a single `os.scandir` and the result is cached until the modification time of the directory changes, which happens whenever an entry is added, removed or renamed. Repeated listings (for example, of a network share) only cost one `stat` call.
+
+    Parameters
+    ----------
+    dir : Path
+        the directory to list.
+    pattern : re.Pattern
+        the pattern the names of the subdirectories must fully match.
+
+    Returns
+    -------
+    list[Path]
+        the sorted subdirectories, or an empty list if the directory doesn't exist.
+    """
+    dir = Path(dir)
+    try:
+        mtime = os.stat(dir).st_mtime_ns
+    except OSError:
+        return []
+
+    key = (os.path.abspath(dir), pattern.pattern)
+    cached = _CACHE.get(key)
+    if cached is None or cached[0] != mtime:
+        with os.scandir(dir) as entries:
+            names = sorted(
+                entry.name
+                for entry in entries
+                if pattern.fullmatch(entry.name) and entry.is_dir()
+            )
+        cached = (mtime, names)
+        _CACHE[key] = cached
+    return [dir / name for name in cached[1]]
+
+
+def session_dirs(animal_dir: Path) -> List[Path]:
+    """
+    Lists the session directories of an animal, sorted by date (the `YYMMDD` names sort chronologically).
+    """
+    return list_dirs(animal_dir, SESSION_PATTERN)
+
+
+def last_session(animal_dir: Path) -> Optional[Path]:
+    """
+    Returns the latest session directory of an animal, or None if it has no sessions.
+    """
+    sessions = session_dirs(animal_dir)
+    return sessions[-1] if sessions else None
+
+
+def animal_dirs(batch_dir: Path) -> List[Path]:
+    """
+    Lists the animal directories of a batch, sorted by animal ID.
+    """
+    return list_dirs(batch_dir, ANIMAL_PATTERN)
+
+
+def batch_dirs(output_dir: Path) -> List[Path]:
+    """
+    Lists the batch directories of an output directory, sorted by name.
+    """
+    return list_dirs(output_dir, BATCH_PATTERN)
@@ -0,0 +1,124 @@
+import json
+import math
+import os
+from pathlib import Path
+from typing import List, Optional
+
+# File inside each animal directory with the state of the animal at the end of its last session
+STATE_NAME = "last_session.json"
+
+# Columns of the last trial needed to configure the next session
+STATE_COLUMNS = [
+    "session",
+    "block",
+    "trial",
+    "training_level",
+    "base_ft_oot",
+    "base_ft_sot",
+    "base_rt",
+    "intended_lnp",
+]
+
+
+def load_state(animal_dir: Path) -> Optional[dict]:
+    """
+    Loads the state of an animal saved at the end of its last session.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal output directory.
+
+    Returns
+    -------
+    dict, optional
+        a dictionary with the `date` of the last session (in the "YYMMDD" format) and the `last_trial`, with the values of `STATE_COLUMNS`, or None if the state doesn't exist or can't be read.
+    """
+    try:
+        with open(Path(animal_dir) / STATE_NAME, "r") as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or "date" not in state or "last_trial" not in state:
+        return None
+    return state
+
+
+def latest_state(animal_dirs: List[Path]) -> Optional[dict]:
+    """
+    Loads the most recent state among the animal directories (for example, the output and backup directories of the same animal).
+
+    Parameters
+    ----------
+    animal_dirs : list[Path]
+        the paths to the animal output directories.
+
+    Returns
+    -------
+    dict, optional
+        the state with the latest session date, or None if none of the directories has a state.
+    """
+    states = [load_state(d) for d in animal_dirs]
+    states = [s for s in states if s is not None]
+    if len(states) == 0:
+        return None
+    return max(states, key=lambda s: s["date"])
+
+
+def save_state(animal_dir: Path, date: str, last_trial) -> bool:
+    """
+    Saves the state of an animal at the end of a session, unless the directory already has the state of a later session.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal output directory.
+    date : str
+        the name of the session directory, in the "YYMMDD" format.
+    last_trial : pd.Series or dict
+        the last trial of the session, from which the values of `STATE_COLUMNS` are saved.
+
+    Returns
+    -------
+    bool
+        whether the state was saved.
+    """
+    animal_dir = Path(animal_dir)
+    previous = load_state(animal_dir)
+    if previous is not None and previous["date"] > date:
+        return False
+
+    state = {
+        "date": date,
+        "last_trial": {
+            column: _to_json(last_trial[column])
+            for column in STATE_COLUMNS
+            if column in last_trial
+        },
+    }
+
+    # The state is also read by the startup, so this module is only imported when it's saved
+    import tempfile
+
+    # Replace the file at once, so that startup never reads a partially written state, writing to a temporary file of its own so that concurrent saves don't write to the same file
+    with tempfile.NamedTemporaryFile(
+        "w", dir=animal_dir, prefix=STATE_NAME + ".", suffix=".tmp", delete=False
+    ) as file:
+        json.dump(state, file, indent=4)
+    try:
+        os.replace(file.name, animal_dir / STATE_NAME)
+    except OSError:
+        os.remove(file.name)
+        raise
+    return True
+
+
+def _to_json(value):
+    # The state is also read by the startup, so pandas and NumPy are only imported when it's saved
+    import numpy as np
+    import pandas as pd
+
+    # Missing values are saved as NaN, just like they are read from the CSV files
+    if pd.isna(value):
+        return math.nan
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,123 @@
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# Categories of the trial outcome, from the `success` column
+OUTCOMES = ["correct", "incorrect", "abort"]
+
+# Categories of the side of the sound, from the sign of the ILD
+SIDES = ["left", "center", "right"]
+
+ABORT_TYPES = ["CNP", "Fixation", "RT+", "RT-", "MT+", "MT-", "LNP", "IO"]
+
+
+def encode_conditions(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the categorical `outcome` and `side` columns to the out structure and encodes `abort_type` as categorical, so that the trials can be grouped by condition in a single pass.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        the out DataFrame.
+
+    Returns
+    -------
+    pd.DataFrame
+        a copy of the out DataFrame with the categorical columns. Trials with an unknown outcome or ILD get a missing category.
+    """
+    success = data["success"].to_numpy(dtype=float)
+    outcome = np.select([success == 1, success == -1, success == 0], [0, 1, 2], -1)
+
+    ild = data["ILD"].to_numpy(dtype=float)
+    side = np.select([ild < 0, ild == 0, ild > 0], [0, 1, 2], -1)
+
+    return data.assign(
+        outcome=pd.Categorical.from_codes(outcome, OUTCOMES),
+        side=pd.Categorical.from_codes(side, SIDES),
+        abort_type=pd.Categorical(data["abort_type"], ABORT_TYPES),
+    )
+
+
+def condition_indices(data: pd.DataFrame, by: List[str]) -> Dict[tuple, np.ndarray]:
+    """
+    Finds the positions of the trials of every combination of conditions.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        the out DataFrame, encoded with `encode_conditions`.
+    by : list[str]
+        the columns that define the conditions (for example, ["outcome", "side"]).
+
+    Returns
+    -------
+    dict
+        a dictionary with the combinations of conditions (always tuples) as keys and the sorted positions of their trials as values. Combinations without trials are not included.
+    """
+    indices = data.groupby(by, observed=True, sort=False).indices
+    return {
+        (key if isinstance(key, tuple) else (key,)): positions
+        for key, positions in indices.items()
+    }
+
+
+def summarize(data: pd.DataFrame, by: List[str]) -> pd.DataFrame:
+    """
+    Computes the number of trials of each outcome, the performance and the abort ratio of every group of trials in a single grouped pass.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        the out DataFrame, encoded with `encode_conditions`.
+    by : list[str]
+        the columns by which the trials are grouped (for example, ["block", "ILD"] or ["ABL"]).
+
+    Returns
+    -------
+    pd.DataFrame
+        a DataFrame indexed by the groups, sorted, with the `trials`, `correct`, `incorrect` and `abort` counts and the `performance` (proportion of correct trials among the answered ones, 0 if none were answered) and `abort_ratio` columns.
+    """
+    counts = (
+        data.groupby(by + ["outcome"], observed=False, dropna=True)
+        .size()
+        .unstack("outcome", fill_value=0)
+    )
+    counts = counts.reindex(columns=OUTCOMES, fill_value=0)
+    counts.columns = list(counts.columns)
+
+    # Drop the empty groups introduced by the categorical columns
+    trials = data.groupby(by, observed=True, dropna=True).size()
+    counts = counts.loc[trials.index]
+    counts.insert(0, "trials", trials)
+
+    answered = counts["correct"] + counts["incorrect"]
+    counts["performance"] = np.where(
+        answered > 0, counts["correct"] / answered.where(answered > 0, 1), 0.0
+    )
+    counts["abort_ratio"] = counts["abort"] / counts["trials"]
+    return counts.sort_index()
+
+
+def performance_by_ild(data: pd.DataFrame) -> np.ndarray:
+    """
+    Computes the performance and abort ratio of each ILD.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        the out DataFrame, encoded with `encode_conditions`.
+
+    Returns
+    -------
+    np.ndarray
+        an array with one row per ILD, sorted, and the ILD, performance and abort ratio as columns.
+    """
+    summary = summarize(data, ["ILD"])
+    return np.column_stack(
+        [
+            summary.index.to_numpy(dtype=float),
+            summary["performance"].to_numpy(),
+            summary["abort_ratio"].to_numpy(),
+        ]
+    )
@@ -0,0 +1,531 @@
+import csv
+import io
+import os
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import pandas as pd
+
+from shutdown.flatten import OUT_LEAVES
+
+# The columnar format is optional, so the CSV files are used whenever pyarrow isn't installed
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+PARQUET_COMPRESSION = "zstd"
+
+# Number of bytes read at a time from the end of a CSV file when looking for its last row
+TAIL_BLOCK_SIZE = 8192
+
+# Strings read as missing values from the out tables, which are the ones `pd.read_csv` reads as missing values by default except for "None", a valid value of some text columns (for example, `opto_mode`)
+NA_VALUES = [
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "n/a",
+    "nan",
+    "null",
+]
+
+# Columns added to the out structure after flattening
+FRAME_COLUMNS = [
+    "trial_start_frame",
+    "cnp_start_frame",
+    "rt_start_frame",
+    "mt_start_frame",
+    "lnp_start_frame",
+]
+
+
+def columnar_available() -> bool:
+    return pa is not None
+
+
+def out_schema() -> dict:
+    """
+    Builds the Arrow type of every column of the out structure from the `Output` schema.
+
+    Returns
+    -------
+    dict
+        a dictionary with the column names as keys and the respective Arrow types as values.
+    """
+    types = {
+        "float": pa.float64(),
+        "int": pa.int64(),
+        "bool": pa.bool_(),
+        "str": pa.string(),
+    }
+    schema = {leaf.column: types[leaf.kind] for leaf in OUT_LEAVES}
+    for column in FRAME_COLUMNS:
+        schema[column] = pa.int64()
+    return schema
+
+
+def cast_out_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the columns of an out DataFrame to the nullable pandas dtypes that correspond to the `Output` schema.
+
+    Nullable dtypes keep integer and boolean columns consistent across sessions, even when some of them have missing values. Columns that can't be cast keep their current dtype.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the out DataFrame.
+
+    Returns
+    -------
+    pd.DataFrame
+        the DataFrame with the cast columns.
+    """
+    dtypes = {"float": "float64", "int": "Int64", "bool": "boolean", "str": "string"}
+    schema = {leaf.column: dtypes[leaf.kind] for leaf in OUT_LEAVES}
+    for column in FRAME_COLUMNS:
+        schema[column] = "Int64"
+
+    df = df.copy()
+    for column in df.columns:
+        if column in schema:
+            try:
+                df[column] = df[column].astype(schema[column])
+            except (ValueError, TypeError):
+                pass
+    return df
+
+
+def to_arrow(df: pd.DataFrame) -> "pa.Table":
+    """
+    Converts an out DataFrame to an Arrow table with the types declared in the `Output` schema.
+
+    Columns whose values don't fit the declared type (for example, from older versions of the task) and columns that are not part of the schema keep the type inferred by Arrow. Strings such as "" or "None" are kept as they are in the table and only read back as missing values by `normalize_missing`, just like from the CSV files.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the out DataFrame.
+
+    Returns
+    -------
+    pa.Table
+        the Arrow table.
+    """
+    schema = out_schema()
+    arrays = []
+    for column in df.columns:
+        values = df[column]
+        try:
+            array = pa.array(values, type=schema.get(column), from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            array = pa.array(values, from_pandas=True)
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, names=[str(c) for c in df.columns])
+
+
+def normalize_missing(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replaces the strings in `NA_VALUES` with missing values, as well as the "None" strings of the numeric columns, so that an out table has the same missing values whether it's read from its CSV file or from its Parquet file.
+
+    A column is numeric if it's declared as a number in the `Output` schema (or is one of the `FRAME_COLUMNS`) or, for the columns that aren't in the schema, if all of its other values are numbers. The numeric columns with "None" strings are converted to numbers.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the out DataFrame.
+
+    Returns
+    -------
+    pd.DataFrame
+        the DataFrame with the missing values.
+    """
+    kinds = {leaf.column: leaf.kind for leaf in OUT_LEAVES}
+    for column in FRAME_COLUMNS:
+        kinds[column] = "float"
+
+    for column in df.columns:
+        values = df[column]
+        if not (values.dtype == object or isinstance(values.dtype, pd.StringDtype)):
+            continue
+        missing = values.isin(NA_VALUES)
+        none = values == "None"
+        if not (missing.any() or none.any()):
+            continue
+        values = values.mask(missing)
+
+        if none.any():
+            numbers = pd.to_numeric(values.mask(none), errors="coerce")
+            if column in kinds:
+                numeric = kinds[column] in ("float", "int")
+            else:
+                numeric = (
+                    numbers.notna().any()
+                    and (numbers.notna() | values.isna() | none).all()
+                )
+            if numeric:
+                values = numbers
+        df[column] = values
+    return df
+
+
+def write_parquet(df: pd.DataFrame, path: Path):
+    pq.write_table(to_arrow(df), path, compression=PARQUET_COMPRESSION)
+
+
+class OutWriter:
+    """
+    Writes an out table one chunk at a time to CSV files and, if available, to their Parquet versions, so that the whole table never needs to be in memory.
+
+    The chunks are written just like the whole table would be written at once. The columns are fixed by the first chunk and `extra_columns`: when a later chunk has new columns, they are appended to the table and the rows already written are rewritten with missing values in them. Likewise, when an integer column of a later chunk has floats (for example, missing values), the values already written are rewritten as floats, and when a later chunk has values that don't fit the Parquet type of a column, the column is widened and the Parquet files are rewritten.
+
+    The tables are written to temporary files, which replace the output files when the writer is closed. If the writer is used as a context manager and an error is raised, the temporary files are removed and the previous output files are kept.
+
+    Parameters
+    ----------
+    csv_paths : list[Path]
+        the paths to the CSV files. The Parquet files are saved next to them.
+    extra_columns : list[str], optional
+        columns added to the table even if the first chunk doesn't have them (for example, the frame columns of the segments with camera metadata).
+    """
+
+    def __init__(
+        self, csv_paths: List[Path], extra_columns: Optional[List[str]] = None
+    ):
+        self.csv_paths = [Path(p) for p in csv_paths]
+        self.extra_columns = [] if extra_columns is None else extra_columns
+        self.columns: Optional[List[str]] = None
+        self.rows = 0
+        self._csv_files = []
+        self._parquet_writers = []
+        self._schema = None
+        self._int_columns = set()
+        self._float_columns = set()
+
+    def __enter__(self) -> "OutWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, df: pd.DataFrame):
+        """
+        Appends a chunk to the out table.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            the next rows of the out structure.
+        """
+        if self.columns is None:
+            self._open(df)
+
+        new_columns = [c for c in df.columns if c not in self.columns]
+        if new_columns:
+            self._add_columns(df[new_columns])
+
+        df = self._match_dtypes(df.reindex(columns=self.columns))
+        for file in self._csv_files:
+            df.to_csv(file, index=False, header=False)
+        if self._parquet_writers:
+            table = to_arrow(df)
+            schema = self._widen_schema(table)
+            if schema != self._schema:
+                self._rewrite_parquet(schema)
+            table = table.cast(self._schema)
+            for writer in self._parquet_writers:
+                writer.write_table(table)
+        self.rows += df.shape[0]
+
+    def close(self):
+        """
+        Closes the files and replaces the output files with them.
+        """
+        paths = self._opened_paths()
+        self._close_files()
+        for path in paths:
+            os.replace(_temp_path(path), path)
+
+    def abort(self):
+        """
+        Closes and removes the files, keeping the previous output files.
+        """
+        paths = self._opened_paths()
+        self._close_files()
+        for path in paths:
+            try:
+                os.remove(_temp_path(path))
+            except OSError:
+                pass
+
+    def _opened_paths(self) -> List[Path]:
+        # The output files whose temporary files are open
+        paths = list(self.csv_paths) if self._csv_files else []
+        if self._parquet_writers:
+            paths += [parquet_path(p) for p in self.csv_paths]
+        return paths
+
+    def _close_files(self):
+        for file in self._csv_files:
+            file.close()
+        for writer in self._parquet_writers:
+            writer.close()
+        self._csv_files = []
+        self._parquet_writers = []
+
+    def _open(self, df: pd.DataFrame):
+        self.columns = list(df.columns) + [
+            c for c in self.extra_columns if c not in df.columns
+        ]
+        first = self._match_dtypes(df.reindex(columns=self.columns))
+
+        for path in self.csv_paths:
+            file = open(_temp_path(path), "w", newline="")
+            first.iloc[:0].to_csv(file, index=False)
+            self._csv_files.append(file)
+
+        if columnar_available():
+            self._schema = pa.schema(
+                [
+                    pa.field(field.name, _declared_type(field))
+                    for field in to_arrow(first).schema
+                ]
+            )
+            self._parquet_writers = [
+                pq.ParquetWriter(
+                    _temp_path(parquet_path(path)),
+                    self._schema,
+                    compression=PARQUET_COMPRESSION,
+                )
+                for path in self.csv_paths
+            ]
+
+    def _match_dtypes(self, df: pd.DataFrame) -> pd.DataFrame:
+        # Like in a concatenated table, an integer column becomes a float column as soon as any chunk has floats in it
+        floats = []
+        for column in df.columns:
+            kind = df[column].dtype.kind
+            if kind in "iu":
+                if column in self._float_columns:
+                    df[column] = df[column].astype("float64")
+                else:
+                    self._int_columns.add(column)
+            elif kind == "f":
+                if column in self._int_columns:
+                    self._int_columns.remove(column)
+                    floats.append(self.columns.index(column))
+                self._float_columns.add(column)
+
+        if floats:
+
+            def to_float(row: List[str]) -> List[str]:
+                for k in floats:
+                    if row[k] != "":
+                        row[k] = repr(float(row[k]))
+                return row
+
+            self._rewrite_csv(to_float)
+        return df
+
+    def _add_columns(self, df: pd.DataFrame):
+        # Append the columns to the header and an empty value to every row already written
+        columns = list(df.columns)
+        self.columns = self.columns + columns
+        self._rewrite_csv(lambda row: row + [""] * len(columns), columns)
+
+        if self._parquet_writers:
+            fields = [
+                pa.field(field.name, _declared_type(field))
+                for field in to_arrow(df).schema
+            ]
+            self._rewrite_parquet(pa.schema(list(self._schema) + fields))
+
+    def _rewrite_csv(
+        self,
+        transform: Callable[[List[str]], List[str]],
+        new_columns: Optional[List[str]] = None,
+    ):
+        # Rewrite the rows already written, appending the new columns to the header
+        for i, path in enumerate(self.csv_paths):
+            self._csv_files[i].close()
+            temp_path = _temp_path(path)
+            old_path = temp_path.with_name(temp_path.name + ".old")
+            os.replace(temp_path, old_path)
+            with open(old_path, "r", newline="") as source:
+                with open(temp_path, "w", newline="") as target:
+                    writer = csv.writer(target, lineterminator=os.linesep)
+                    for j, row in enumerate(csv.reader(source)):
+                        if j == 0:
+                            writer.writerow(row + (new_columns or []))
+                        else:
+                            writer.writerow(transform(row))
+            os.remove(old_path)
+            self._csv_files[i] = open(temp_path, "a", newline="")
+
+    def _widen_schema(self, table: "pa.Table") -> "pa.Schema":
+        # Widen the types of the columns whose values in the chunk can't be cast to them
+        fields = []
+        for field in self._schema:
+            column = table.column(field.name)
+            try:
+                column.cast(field.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                numeric = pa.types.is_integer(field.type) or pa.types.is_floating(
+                    field.type
+                )
+                if numeric and (
+                    pa.types.is_integer(column.type)
+                    or pa.types.is_floating(column.type)
+                ):
+                    field = field.with_type(pa.float64())
+                else:
+                    field = field.with_type(pa.string())
+            fields.append(field)
+        return pa.schema(fields)
+
+    def _rewrite_parquet(self, schema: "pa.Schema"):
+        # Parquet files can't be appended to, so the row groups already written are copied to a new file with the new schema
+        for i, path in enumerate(self.csv_paths):
+            self._parquet_writers[i].close()
+            temp_path = _temp_path(parquet_path(path))
+            old_path = temp_path.with_name(temp_path.name + ".old")
+            os.replace(temp_path, old_path)
+
+            writer = pq.ParquetWriter(
+                temp_path, schema, compression=PARQUET_COMPRESSION
+            )
+            with open(old_path, "rb") as source:
+                file = pq.ParquetFile(source)
+                for group in range(file.num_row_groups):
+                    table = file.read_row_group(group)
+                    writer.write_table(
+                        pa.Table.from_arrays(
+                            [
+                                table.column(field.name).cast(field.type)
+                                if field.name in table.column_names
+                                else pa.nulls(table.num_rows, field.type)
+                                for field in schema
+                            ],
+                            schema=schema,
+                        )
+                    )
+            os.remove(old_path)
+            self._parquet_writers[i] = writer
+        self._schema = schema
+
+
+def _declared_type(field: "pa.Field") -> "pa.DataType":
+    # Columns without values get the type declared in the schema
+    if pa.types.is_null(field.type):
+        return out_schema().get(field.name, pa.string())
+    return field.type
+
+
+def _temp_path(path: Path) -> Path:
+    return path.with_name(path.name + ".tmp")
+
+
+def parquet_path(csv_path: Path) -> Path:
+    return Path(csv_path).with_suffix(".parquet")
+
+
+def read_out(csv_path: Path) -> pd.DataFrame:
+    """
+    Reads an out table, preferring its Parquet version whenever it exists and is not older than the CSV file.
+
+    Parameters
+    ----------
+    csv_path : Path
+        the path to the out CSV file.
+
+    Returns
+    -------
+    pd.DataFrame
+        the out DataFrame.
+    """
+    csv_path = Path(csv_path)
+    columnar_path = parquet_path(csv_path)
+
+    if columnar_available() and columnar_path.is_file():
+        if (
+            not csv_path.is_file()
+            or columnar_path.stat().st_mtime_ns >= csv_path.stat().st_mtime_ns
+        ):
+            return normalize_missing(pq.read_table(columnar_path).to_pandas())
+
+    return _read_csv(csv_path)
+
+
+def read_last_row(csv_path: Path) -> pd.Series:
+    """
+    Reads the last row of an out table without parsing the whole table: only the last row group of the Parquet version (whenever `read_out` would use it) or the header and the last line of the CSV file are read.
+
+    Parameters
+    ----------
+    csv_path : Path
+        the path to the out CSV file.
+
+    Returns
+    -------
+    pd.Series
+        the last row of the out table, with the columns as index.
+    """
+    csv_path = Path(csv_path)
+    columnar_path = parquet_path(csv_path)
+
+    if columnar_available() and columnar_path.is_file():
+        if (
+            not csv_path.is_file()
+            or columnar_path.stat().st_mtime_ns >= csv_path.stat().st_mtime_ns
+        ):
+            file = pq.ParquetFile(columnar_path)
+            table = file.read_row_group(file.num_row_groups - 1)
+            last_row = table.slice(table.num_rows - 1).to_pandas()
+            return normalize_missing(last_row).iloc[-1]
+
+    with open(csv_path, "rb") as file:
+        header = file.readline()
+        start = len(header)
+        position = file.seek(0, os.SEEK_END)
+
+        # Read blocks from the end of the file until a whole line is found after the header
+        tail = b""
+        while position > start:
+            size = min(TAIL_BLOCK_SIZE, position - start)
+            position -= size
+            file.seek(position)
+            tail = file.read(size) + tail
+            lines = tail.rstrip(b"\r\n").split(b"\n")
+            if len(lines) > 1:
+                break
+
+    last_line = tail.rstrip(b"\r\n").split(b"\n")[-1]
+    if last_line.strip() == b"":
+        raise ValueError(str(csv_path) + " has no rows")
+
+    # Parse the header and the last line just like `read_out` parses the whole file
+    data = io.BytesIO(header + last_line + b"\n")
+    return _read_csv(data).iloc[-1]
+
+
+def _read_csv(source) -> pd.DataFrame:
+    # Read the missing values in the same way as from the Parquet files
+    return normalize_missing(
+        pd.read_csv(source, keep_default_na=False, na_values=NA_VALUES)
+    )
@@ -1,43 +1,217 @@
-import re
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from tkinter import filedialog
+from typing import Dict, List, Optional, Tuple
 
+import pandas as pd
+
+from shutdown.session_index import (
+    animal_dirs,
+    is_animal,
+    is_batch,
+    is_session,
+    session_dirs,
+)
+from shutdown.state import save_state
 from shutdown.utils import convert_output
 
 
 def convert_tool():
-    session_dir = filedialog.askdirectory()
-    recursive_convert(Path(session_dir))
-    print("Conversion completed!")
+    parser = argparse.ArgumentParser(
+        description="Converts the out files of every session inside a session, animal or batch directory."
+    )
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="the session, animal or batch directory. If omitted, a dialog is opened to choose it.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=positive_int,
+        default=os.cpu_count(),
+        help="the number of sessions converted in parallel (default: number of CPUs).",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="convert every session again, even the ones that are already up to date.",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        type=positive_int,
+        default=None,
+        help="convert the sessions in chunks of this number of trials, which bounds the memory used by each conversion (default: convert each session at once).",
+    )
+    args = parser.parse_args()
+
+    if args.path is None:
+        session_dir = filedialog.askdirectory()
+    else:
+        session_dir = args.path
+
+    sessions = find_sessions(Path(session_dir))
+    errors = convert_sessions(sessions, args.workers, args.force, args.chunk_size)
+
+    if len(errors) == 0:
+        print("Conversion completed!")
+    else:
+        print(
+            "Conversion completed with errors in "
+            + str(len(errors))
+            + " of "
+            + str(len(sessions))
+            + " sessions:"
+        )
+        for session, error in errors.items():
+            print("  " + str(session) + ": " + error)
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(value + " is not a positive integer")
+    return number
 
 
 def recursive_convert(dir: Path):
-    if _check_session(dir) and _check_unparsed_out(dir):
-        convert_output(dir)
-    elif _check_animal(dir):
-        for entry in dir.iterdir():
-            if not entry.is_file() and _check_session(entry):
-                recursive_convert(entry)
-    elif _check_batch(dir):
-        for entry in dir.iterdir():
-            if not entry.is_file() and _check_animal(entry):
-                recursive_convert(entry)
+    for session in find_sessions(dir):
+        convert_output(session)
+
+
+def find_sessions(dir: Path) -> List[Path]:
+    """
+    Finds every convertible session inside a session, animal or batch directory.
+
+    Parameters
+    ----------
+    dir : Path
+        the session, animal or batch directory.
+
+    Returns
+    -------
+    list[Path]
+        the sorted list of session directories that contain an `unparsed_out` directory.
+    """
+    sessions = []
+    if is_session(dir) and (dir / "unparsed_out").is_dir():
+        sessions.append(dir)
+    elif is_animal(dir):
+        for entry in session_dirs(dir):
+            sessions.extend(find_sessions(entry))
+    elif is_batch(dir):
+        for entry in animal_dirs(dir):
+            sessions.extend(find_sessions(entry))
+    return sessions
+
+
+def convert_sessions(
+    sessions: List[Path],
+    workers: Optional[int] = None,
+    force: bool = False,
+    chunk_size: Optional[int] = None,
+) -> dict:
+    """
+    Converts the out files of several sessions, running up to `workers` conversions in parallel.
+
+    Once every conversion finishes, the last trial of the latest converted session of each animal is saved as the state of the animal, so that conversions running in parallel never save the state of the same animal at the same time.
+
+    Parameters
+    ----------
+    sessions : list[Path]
+        the session directories to convert.
+    workers : int, optional
+        the number of worker processes. If 1, the sessions are converted sequentially in the current process.
+    force : bool, optional
+        whether to convert the sessions that are already up to date again.
+    chunk_size : int, optional
+        if given, each session is converted in chunks of at most this number of trials (see `convert_output`).
+
+    Returns
+    -------
+    dict
+        a dictionary with the sessions whose conversion failed as keys and the respective error messages as values.
+    """
+    errors = {}
+    last_trials = {}
+    total = len(sessions)
+
+    if workers == 1:
+        for i, session in enumerate(sessions):
+            error, last_trial = _convert_session(session, force, None, chunk_size)
+            _print_progress(i + 1, total, session, error)
+            if error is not None:
+                errors[session] = error
+            elif last_trial is not None:
+                last_trials[session] = last_trial
+        _save_states(last_trials)
+        return errors
+
+    # Sessions converted in parallel render their plots in their own process, so that the CPUs aren't oversubscribed
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(_convert_session, session, force, 1, chunk_size): session
+            for session in sessions
+        }
+        for i, future in enumerate(as_completed(futures)):
+            session = futures[future]
+            try:
+                error, last_trial = future.result()
+            except BrokenProcessPool as e:
+                # A worker process died (for example, when it ran out of memory), which fails every session that wasn't converted yet
+                error, last_trial = type(e).__name__ + ": " + str(e), None
+            _print_progress(i + 1, total, session, error)
+            if error is not None:
+                errors[session] = error
+            elif last_trial is not None:
+                last_trials[session] = last_trial
+
+    _save_states(last_trials)
+    return errors
+
 
+def _save_states(last_trials: Dict[Path, pd.Series]):
+    # Only the latest converted session of each animal can update its state
+    latest = {}
+    for session in last_trials:
+        if session.parent not in latest or session.name > latest[session.parent].name:
+            latest[session.parent] = session
+    for animal_dir, session in latest.items():
+        save_state(animal_dir, session.name, last_trials[session])
 
-def _check_unparsed_out(dir: Path) -> bool:
-    for entry in dir.iterdir():
-        if not entry.is_file() and entry.name == "unparsed_out":
-            return True
-    return False
 
+def _init_worker():
+    # Worker processes only save figures, so they don't need an interactive backend
+    import matplotlib
 
-def _check_session(dir: Path) -> bool:
-    return re.fullmatch(r"^\d{6}", dir.name)
+    matplotlib.use("Agg")
 
 
-def _check_animal(dir: Path) -> bool:
-    return re.fullmatch(r"^[A-Z]{2,6}\d{4}$", dir.name)
+def _convert_session(
+    session: Path,
+    force: bool = False,
+    plot_workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> Tuple[Optional[str], Optional[pd.Series]]:
+    # Return the error message, if any, and the last trial of the session, whose state is saved by the parent process
+    try:
+        last_trial = convert_output(
+            session,
+            force=force,
+            plot_workers=plot_workers,
+            chunk_size=chunk_size,
+            update_state=False,
+        )
+    except Exception as e:
+        return type(e).__name__ + ": " + str(e), None
+    return None, last_trial
 
 
-def _check_batch(dir: Path) -> bool:
-    return re.fullmatch(r"^[a-zA-Z0-9][a-zA-Z0-9_]*[a-zA-Z0-9]$", dir.name)
+def _print_progress(done: int, total: int, session: Path, error: Optional[str]):
+    status = "done" if error is None else "failed"
+    print("[" + str(done) + "/" + str(total) + "] " + str(session) + ": " + status)
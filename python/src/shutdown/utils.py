@@ -1,18 +1,41 @@
-import json
 import os
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 
-from shutdown.block_plots import generate_plots
-from shutdown.video_preprocessing import add_frame_numbers
+from shutdown.block_plots import BlockPlotter, generate_plots
+from shutdown.flatten import COLUMN_RENAMES, ColumnBuffers, read_out_frame  # noqa: F401
+from shutdown.frame_index import FrameIndex, index_path, video_path, write_frame_index
+from shutdown.manifest import (
+    CACHE_DIR,
+    code_version,
+    describe_inputs,
+    describe_outputs,
+    load_manifest,
+    output_name,
+    outputs_unchanged,
+    save_manifest,
+    segment_inputs,
+)
+from shutdown.reader import iter_out_chunks, iter_out_records
+from shutdown.state import save_state
+from shutdown.store import OutWriter, columnar_available, parquet_path, write_parquet
+from shutdown.video_preprocessing import (
+    FRAME_EVENTS,
+    SessionSync,
+    add_frame_numbers,
+    align_frames,
+)
+
+# Number of trials converted at a time by the chunked conversion
+CHUNK_SIZE = 1000
 
 
 def read_out_json(file: Path):
     """
-    Reads a `out.json` file, formats it to be a real JSON and returns a dictionary.
+    Reads a `out.json` file, which contains one JSON object per line, and returns a list with the parsed objects.
 
     Parameters
     ----------
@@ -21,169 +44,294 @@ def read_out_json(file: Path):
 
     Returns
     -------
-    dict
-        Dictionary containing the data parsed from the JSON file.
+    list[dict]
+        List containing the data parsed from the JSON file.
     """
-    # Read the fake JSON file
-    with open(file, "r") as f:
-        text = f.read()
-
     # Delete file if empty
-    if text == "":
+    if os.path.getsize(file) == 0:
         os.remove(file)
         return
 
-    # Delete last line if it doesn't end in '\n'
-    if text[-1] != "\n":
-        idx = text.rfind("\n")
-        text = text[: idx + 1]
-
-    # Split the JSON object into lines
-    lines = text.splitlines()
-
-    # Convert to real JSON
-    for i in range(len(lines) - 1):
-        lines[i] += ","
-    lines.insert(0, "[")
-    lines.append("]")
-    text = "\n".join(lines)
+    # Parse the JSON objects line by line, ignoring the last line if it doesn't end in '\n'
+    return [record for record, _ in iter_out_records(file)]
 
-    # Load the real JSON string
-    return json.loads(text)
 
-
-def convert_output(session_dir: Path, backup_dir: Optional[Path] = None):
+def convert_output(
+    session_dir: Path,
+    backup_dir: Optional[Path] = None,
+    force: bool = False,
+    plot_workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    update_state: bool = True,
+) -> Optional[pd.Series]:
     """
     Converts the out structure from JSON to CSV.
 
+    The inputs and outputs of the conversion are recorded in a manifest inside the session directory, so that sessions whose inputs didn't change are skipped and only the segments (`out.json` files) whose inputs changed are parsed again.
+
     Parameters
     ----------
     session_dir : Path
         the path to the session directory
     backup_dir : Path, optional
         the path to the backup directory
+    force : bool, optional
+        whether to ignore the manifest and convert every segment again.
+    plot_workers : int, optional
+        the number of processes rendering the block plots. If 1, the plots are rendered in the current process.
+    chunk_size : int, optional
+        if given, the session is converted in chunks of at most this number of trials, which are written to the output files and plotted one at a time, so that the memory used doesn't depend on the length of the session. The converted segments aren't cached in this mode.
+    update_state : bool, optional
+        whether to save the last trial as the state of the animal (see `shutdown.state.save_state`). Conversions running in parallel should leave it to the caller, which saves the state of the latest session of each animal once they finish.
+
+    Returns
+    -------
+    pd.Series, optional
+        the last trial of the session, or None if the session was already up to date or has no trials.
     """
     # Pandas config to get rid of warnings
     pd.set_option("future.no_silent_downcasting", True)
 
-    # Get all of the out.json files
-    out_files = [p for p in (session_dir / "unparsed_out").iterdir() if p.is_file()]
+    # Get all of the out.json files in chronological order (the "out_<hhmmss>.json" names sort by time), deleting the empty ones
+    out_files = []
+    for p in sorted((session_dir / "unparsed_out").iterdir()):
+        if p.is_file():
+            if os.path.getsize(p) == 0:
+                os.remove(p)
+            else:
+                out_files.append(p)
 
-    # Convert every JSON file to Pandas DataFrame and add them to the final DataFrame
-    for i in range(len(out_files)):
-        # Load the real JSON string
-        out_json = read_out_json(out_files[i])
+    # Describe the inputs of every segment, reusing the hashes from the previous conversion whenever possible
+    manifest = {} if force else load_manifest(session_dir)
+    version = code_version()
+    previous = (
+        manifest.get("segments", {}) if manifest.get("version") == version else {}
+    )
+    segments = {
+        p.name: describe_inputs(
+            session_dir, segment_inputs(session_dir, p), previous.get(p.name)
+        )
+        for p in out_files
+    }
 
-        # Continue to next file if current one was empty
-        if out_json is None:
-            continue
+    # Declare the output paths
+    out_name = "out_" + session_dir.parent.name + "_" + session_dir.name + ".csv"
+    csv_paths = [session_dir / out_name]
+    plot_paths = [session_dir / "plots"]
+    if backup_dir is not None:
+        csv_paths.append(backup_dir / out_name)
+        plot_paths.append(backup_dir / "plots")
+    expected_outputs = list(csv_paths)
+    if columnar_available():
+        expected_outputs += [parquet_path(p) for p in csv_paths]
+
+    # Skip the session if neither the inputs nor the outputs changed since the last conversion
+    outputs = manifest.get("outputs", {})
+    if (
+        segments == previous
+        and all(output_name(session_dir, p) in outputs for p in expected_outputs)
+        and outputs_unchanged(session_dir, outputs)
+    ):
+        print(str(session_dir) + " is already up to date")
+        return
+
+    if chunk_size is None:
+        converted = _convert_segments(
+            session_dir,
+            out_files,
+            segments,
+            previous,
+            csv_paths,
+            plot_paths,
+            plot_workers,
+        )
+    else:
+        converted = _convert_in_chunks(
+            session_dir, out_files, csv_paths, plot_paths, chunk_size
+        )
+    if converted is None:
+        print("There are no trials to convert in " + str(session_dir))
+        return
+    blocks, last_trial = converted
+
+    # Record the inputs and outputs of this conversion
+    for block_num in blocks:
+        for path in plot_paths:
+            expected_outputs.append(path / f"block_{block_num}.png")
+    save_manifest(
+        session_dir,
+        {
+            "version": version,
+            "segments": segments,
+            "outputs": describe_outputs(session_dir, expected_outputs),
+        },
+    )
+
+    # Save the state of the animal at the end of the session, which is read by the startup of its next session
+    if update_state:
+        save_state(session_dir.parent, session_dir.name, last_trial)
+        if backup_dir is not None:
+            save_state(backup_dir.parent, session_dir.name, last_trial)
+
+    return last_trial
 
-        # Convert JSON to pandas DataFrame, rename the columns to shorter and more intuitive names and replace "NaN" strings
-        df = pd.json_normalize(out_json)
-        df = df.rename(columns=COLUMN_RENAMES)
-        df.replace("NaN", np.nan, inplace=True)
 
+def _convert_segments(
+    session_dir: Path,
+    out_files: List[Path],
+    segments: dict,
+    previous: dict,
+    csv_paths: List[Path],
+    plot_paths: List[Path],
+    plot_workers: Optional[int],
+) -> Optional[Tuple[list, pd.Series]]:
+    """
+    Converts every segment to a DataFrame, reusing the cached ones whose inputs didn't change, and saves the whole out structure and its block plots at once.
+
+    Returns
+    -------
+    tuple[list, pd.Series], optional
+        the numbers of the plotted blocks and the last trial of the session, or None if there are no trials.
+    """
+    # Convert every JSON file to Pandas DataFrame
+    cache_dir = session_dir / CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    frames = []
+    sync = SessionSync(session_dir)
+    for i in range(len(out_files)):
         # Declare expected camera metadata file
         time_str = out_files[i].name.split("_")[1].split(".")[0]
         cam_metadata_path = session_dir / ("cam_metadata_" + time_str + ".csv")
+        frame_index_path = index_path(video_path(session_dir, time_str))
+
+        # Reuse the converted segment if its inputs didn't change
+        cache_path = cache_dir / (out_files[i].stem + ".pkl")
+        if segments[out_files[i].name] == previous.get(out_files[i].name) and (
+            cache_path.is_file()
+        ):
+            frames.append(pd.read_pickle(cache_path))
+            if cam_metadata_path.is_file() and not frame_index_path.is_file():
+                _save_frame_index(sync, time_str, frame_index_path)
+            continue
+
+        # Parse the JSON-lines file straight into the typed columns of the out structure
+        df = read_out_frame(out_files[i])
+        if df.shape[0] == 0:
+            continue
 
         # Create columns of the frame numbers that correspond to specific events of a trial if camera metadata exists
         if cam_metadata_path.is_file():
             try:
-                df = add_frame_numbers(df, session_dir, time_str)
+                df = add_frame_numbers(df, session_dir, time_str, sync)
             except Exception:
                 print("It was not possible to process the camera metadata")
+            else:
+                _save_frame_index(sync, time_str, frame_index_path)
 
-        # If variable containing out structure already exists, append data to it, otherwise create it
-        if "out" not in locals():
-            out = df.copy()
-        else:
-            out = pd.concat([out, df], ignore_index=True)
+        df.to_pickle(cache_path)
+        frames.append(df)
 
-    # Save out structure to CSV
-    out_name = "out_" + session_dir.parent.name + "_" + session_dir.name + ".csv"
-    out_path = session_dir / out_name
-    out.to_csv(out_path, index=False)
-    if backup_dir is not None:
-        out_backup_path = backup_dir / out_name
-        out.to_csv(out_backup_path, index=False)
+    # Concatenate the data from all of the files at once
+    if len(frames) == 0:
+        return None
+    out = pd.concat(frames, ignore_index=True)
 
-    # Declare path to the directory where the plots will be saved
-    plot_path = session_dir / "plots"
-    os.makedirs(plot_path, exist_ok=True)
-    plot_backup_path = None
-    if backup_dir is not None:
-        plot_backup_path = backup_dir / "plots"
-        os.makedirs(plot_backup_path, exist_ok=True)
+    # Save out structure to CSV and, if available, to the columnar format
+    for path in csv_paths:
+        out.to_csv(path, index=False)
+    if columnar_available():
+        for path in csv_paths:
+            write_parquet(out, parquet_path(path))
 
     # Generate plots with some metrics for the each block of the current session
-    generate_plots(out, plot_path, plot_backup_path)
-
-
-COLUMN_RENAMES = {
-    "animal_id": "animal",
-    "trial.number": "trial",
-    "trial.start_time": "trial_start",
-    "trial.tared_start_time": "tared_trial_start",
-    "trial.end_time": "trial_end",
-    "trial.duration": "trial_duration",
-    "block.number": "block",
-    "block.training_level": "training_level",
-    "block.trials_per_block": "trials_per_block",
-    "session.number": "session",
-    "session.type": "session_type",
-    "session.box": "box",
-    "sound.abl": "ABL",
-    "sound.ild": "ILD",
-    "sound.sound_index": "sound_index",
-    "sound.left_amp": "left_amp",
-    "sound.right_amp": "right_amp",
-    "sound.is_short_sound": "is_short_sound",
-    "sound.short_duration": "short_duration",
-    "iti.intended_duration": "intended_iti",
-    "iti.start_time": "iti_start",
-    "iti.end_time": "iti_end",
-    "iti.timed_duration": "iti_duration",
-    "cnp.start_time": "cnp_start",
-    "cnp.timed_value": "cnp_time",
-    "cnp.max_duration": "max_cnp",
-    "fixation_time.opto_onset_time.base_time": "base_ft_oot",
-    "fixation_time.opto_onset_time.exp_mean": "ft_oot_exp",
-    "fixation_time.opto_onset_time.intended_duration": "intended_ft_oot",
-    "fixation_time.opto_onset_time.timed_duration": "timed_ft_oot",
-    "fixation_time.sound_onset_time.base_time": "base_ft_sot",
-    "fixation_time.sound_onset_time.exp_mean": "ft_sot_exp",
-    "fixation_time.sound_onset_time.intended_duration": "intended_ft_sot",
-    "fixation_time.sound_onset_time.timed_duration": "duration_ft_sot",
-    "fixation_time.intended_duration": "intended_fix_time",
-    "fixation_time.timed_duration": "fix_time",
-    "fixation_time.total_duration": "total_fix_time",
-    "reaction_time.base_time": "base_rt",
-    "reaction_time.max_duration": "max_rt",
-    "reaction_time.start_time": "rt_start",
-    "reaction_time.timed_duration": "timed_rt",
-    "movement_time.max_duration": "max_mt",
-    "movement_time.start_time": "mt_start",
-    "movement_time.timed_duration": "timed_mt",
-    "lnp_time.intended_duration": "intended_lnp",
-    "lnp_time.start_time": "lnp_start",
-    "lnp_time.timed_duration": "timed_lnp",
-    "outcome.response_poke": "response_poke",
-    "outcome.success": "success",
-    "outcome.abort_type": "abort_type",
-    "outcome.block_performance": "block_perf",
-    "outcome.block_abort_ratio": "block_abort_ratio",
-    "penalty_times.incorrect": "incorrect_penalty",
-    "penalty_times.abort": "abort_penalty",
-    "penalty_times.fixation_abort": "ft_abort_penalty",
-    "reward.left": "reward_left",
-    "reward.right": "reward_right",
-    "reward.delivered": "reward_delivered",
-    "optogenetics.opto_trial": "opto_trial",
-    "optogenetics.duration": "opto_duration",
-    "optogenetics.mode": "opto_mode",
-    "optogenetics.led0_voltage": "led0_voltage",
-    "optogenetics.led0_power": "led0_power",
-    "optogenetics.led1_voltage": "led1_voltage",
-    "optogenetics.led1_power": "led1_power",
-}
+    for path in plot_paths:
+        os.makedirs(path, exist_ok=True)
+    plot_backup_path = plot_paths[1] if len(plot_paths) > 1 else None
+    generate_plots(out, plot_paths[0], plot_backup_path, plot_workers)
+
+    return list(out["block"].unique()), out.iloc[-1]
+
+
+def _convert_in_chunks(
+    session_dir: Path,
+    out_files: List[Path],
+    csv_paths: List[Path],
+    plot_paths: List[Path],
+    chunk_size: int,
+) -> Optional[Tuple[list, pd.Series]]:
+    """
+    Converts the segments in chunks of at most `chunk_size` trials, writing each chunk to the output files and to the block plots before reading the next one, so that the memory used doesn't depend on the length of the session.
+
+    Returns
+    -------
+    tuple[list, pd.Series], optional
+        the numbers of the plotted blocks and the last trial of the session, or None if there are no trials.
+    """
+    sync = SessionSync(session_dir)
+
+    # The frame columns are added to all of the trials if any segment has camera metadata, since the columns of the output files are fixed by the first chunk
+    time_strs = [p.name.split("_")[1].split(".")[0] for p in out_files]
+    has_camera = any(
+        (session_dir / ("cam_metadata_" + t + ".csv")).is_file() for t in time_strs
+    )
+    extra_columns = list(FRAME_EVENTS.values()) if has_camera else []
+
+    plotter = None
+    with OutWriter(csv_paths, extra_columns) as writer:
+        # The segments are read in chronological order, so that the blocks are contiguous
+        for out_file, time_str in zip(out_files, time_strs):
+            cam_metadata_path = session_dir / ("cam_metadata_" + time_str + ".csv")
+            frame_index_path = index_path(video_path(session_dir, time_str))
+
+            frames = None
+            if cam_metadata_path.is_file():
+                frames = _segment_frames(sync, time_str, frame_index_path)
+
+            for records in iter_out_chunks(out_file, chunk_size):
+                buffers = ColumnBuffers(len(records))
+                buffers.extend(records)
+                df = buffers.to_frame()
+                if frames is not None:
+                    df = align_frames(df, *frames)
+
+                writer.write(df)
+                if plotter is None:
+                    for path in plot_paths:
+                        os.makedirs(path, exist_ok=True)
+                    plotter = BlockPlotter(*plot_paths)
+                plotter.add(df)
+
+    if plotter is None:
+        return None
+    plotter.close()
+    return plotter.blocks, df.iloc[-1]
+
+
+def _segment_frames(
+    sync: SessionSync, time_str: str, frame_index_path: Path
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    # Synchronize the camera of the segment and save its frame index
+    try:
+        table = sync.frame_table(time_str)
+    except Exception:
+        print("It was not possible to process the camera metadata")
+        return None
+    _save_frame_index(sync, time_str, frame_index_path)
+
+    # Look the frames up in the memory-mapped index instead of keeping them in memory
+    if frame_index_path.is_file():
+        sync.release(time_str)
+        index = FrameIndex(frame_index_path)
+        return index.timestamps, index.frame_ids
+    return table["Timestamp"].to_numpy(dtype=float), table["FrameID"].to_numpy()
+
+
+def _save_frame_index(sync: SessionSync, time_str: str, path: Path):
+    # Keep the synchronized frames next to the video, so that other tools don't need to synchronize the camera again
+    try:
+        frames = sync.frame_table(time_str)
+        write_frame_index(
+            path, frames["FrameID"].to_numpy(), frames["Timestamp"].to_numpy()
+        )
+    except Exception:
+        print("It was not possible to save the frame index of " + str(path.parent))
@@ -1,11 +1,26 @@
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 
-import harp
 import numpy as np
 import pandas as pd
 
+from shutdown.frame_index import first_frames
+from shutdown.harp_binary import DI3, DIPORT1, falling_edges, read_register
 
-def add_frame_numbers(out: pd.DataFrame, path: Path, time_str: str):
+# The out columns with the timestamps of the trial events and the columns where the respective frame numbers are saved
+FRAME_EVENTS = {
+    "trial_start": "trial_start_frame",
+    "cnp_start": "cnp_start_frame",
+    "rt_start": "rt_start_frame",
+    "mt_start": "mt_start_frame",
+    # FIXME: find out why some data is not being saved correctly
+    "lnp_start": "lnp_start_frame",
+}
+
+
+def add_frame_numbers(
+    out: pd.DataFrame, path: Path, time_str: str, sync: Optional["SessionSync"] = None
+):
     """
     Adds the frame numbers to the out structure for the following events: trial start, CNP start, sound (RT) start, MT start and MT end (or LNP start)
 
@@ -17,91 +32,50 @@ def add_frame_numbers(out: pd.DataFrame, path: Path, time_str: str):
         the path to the camera metadata file
     time_str : str
         the string of the time the session began in the "hhmmss" format
+    sync : SessionSync, optional
+        the synchronization of the session, which is shared by all of its segments. If None, the cached synchronization of the session is used.
 
     Returns
     -------
     pd.DataFrame
         the final out DataFrame structure
     """
-    # Synchronize the camera frames with the Harp timestamps
-    strobe = synch_camera(path, time_str)
-    strobe = strobe[strobe["Timestamp"] >= 0]
-
-    # Create a temporary copy of the out structure
-    temp_out = out.copy()
-
-    # Convert the type of the relevant columns to float
-    temp_out["trial_start"] = temp_out["trial_start"].astype(float)
-    temp_out["cnp_start"] = temp_out["cnp_start"].astype(float)
-    temp_out["rt_start"] = temp_out["rt_start"].astype(float)
-    temp_out["mt_start"] = temp_out["mt_start"].astype(float)
-    temp_out["lnp_start"] = temp_out["lnp_start"].astype(float)
-
-    # Get the frame number of the start of each trial
-    df = pd.merge_asof(
-        left=temp_out[temp_out["trial_start"].notna()],
-        right=strobe,
-        left_on="trial_start",
-        right_on="Timestamp",
-        direction="forward",
-    )
-    df = df.rename(columns={"FrameID": "trial_start_frame"})
-    df = df[["trial", "trial_start_frame"]]
-    out = out.merge(df, how="left", on="trial")
-
-    # Get the frame number of the CNP events for each trial
-    df = pd.merge_asof(
-        left=temp_out[temp_out["cnp_start"].notna()],
-        right=strobe,
-        left_on="cnp_start",
-        right_on="Timestamp",
-        direction="forward",
-    )
-    df = df.rename(columns={"FrameID": "cnp_start_frame"})
-    df = df[["trial", "cnp_start_frame"]]
-    out = out.merge(df, how="left", on="trial")
-
-    # Get the frame number of the sound start for each trial
-    df = pd.merge_asof(
-        left=temp_out[temp_out["rt_start"].notna()],
-        right=strobe,
-        left_on="rt_start",
-        right_on="Timestamp",
-        direction="forward",
-    )
-    df = df.rename(columns={"FrameID": "rt_start_frame"})
-    df = df[["trial", "rt_start_frame"]]
-    out = out.merge(df, how="left", on="trial")
-
-    # Get the frame number of the moment the animal leaves the central port for each trial
-    df = pd.merge_asof(
-        left=temp_out[temp_out["mt_start"].notna()],
-        right=strobe,
-        left_on="mt_start",
-        right_on="Timestamp",
-        direction="forward",
+    # Get the Harp timestamp of every camera frame of the segment
+    if sync is None:
+        sync = session_sync(path)
+    frames = sync.frame_table(time_str)
+
+    return align_frames(
+        out, frames["Timestamp"].to_numpy(dtype=float), frames["FrameID"].to_numpy()
     )
-    df = df.rename(columns={"FrameID": "mt_start_frame"})
-    df = df[["trial", "mt_start_frame"]]
-    out = out.merge(df, how="left", on="trial")
 
-    # FIXME: find out why some data is not being saved correctly
-    # Get the frame number of the moment the animal enters one of the lateral pokes for each trial
-    try:
-        df = pd.merge_asof(
-            left=temp_out[(temp_out["lnp_start"].notna())],
-            right=strobe,
-            left_on="lnp_start",
-            right_on="Timestamp",
-            direction="forward",
-        )
-        df = df.rename(columns={"FrameID": "lnp_start_frame"})
-        df = df[["trial", "lnp_start_frame"]]
-        out = out.merge(df, how="left", on="trial")
-    except Exception:
-        print("It was not possible to add the lnp_start_frame column")
 
-    return out
+def align_frames(out: pd.DataFrame, timestamps: np.ndarray, frame_ids: np.ndarray):
+    """
+    Adds the number of the first frame at or after each trial event to the out structure, for all of the events at once.
+
+    Parameters
+    ----------
+    out : pd.DataFrame
+        the out DataFrame structure without the frame data
+    timestamps : np.ndarray
+        the sorted Harp timestamps of the camera frames
+    frame_ids : np.ndarray
+        the frame number corresponding to each timestamp
+
+    Returns
+    -------
+    pd.DataFrame
+        the out DataFrame structure with a `*_frame` column for each event
+    """
+    events = [column for column in FRAME_EVENTS if column in out.columns]
+
+    # Find the first frame whose timestamp is not earlier than each event (events without a timestamp or after the last frame get no frame)
+    frames = first_frames(timestamps, frame_ids, out[events].to_numpy(dtype=float))
+
+    return out.assign(
+        **{FRAME_EVENTS[column]: frames[:, i] for i, column in enumerate(events)}
+    )
 
 
 def synch_camera(path: Path, time_str: str):
@@ -120,16 +94,17 @@ def synch_camera(path: Path, time_str: str):
     pd.DataFrame
         a pandas DataFrame containing a Harp timestamp for every frame, as well as the state of the camera GPIOs and the relevant Harp Behavior GPIOs
     """
-    # for timestr in timestr_array:
+    # Memory-map the DigitalInputState register and keep only the camera strobes (DI3 falling edges)
     events_path = path / "events" / time_str / "behavior"
-    reader = harp.create_reader(events_path)
-
-    strobe = reader.DigitalInputState.read(events_path / "behavior_32.bin")
-    strobe = strobe[(~strobe["DI3"]) & (strobe["DI3"].shift(1))]
-    strobe = strobe[["DI3", "DIPort1"]]
-    timestamps = strobe.index.to_numpy()
-    strobe = strobe.reset_index(drop=True)
-    strobe["Timestamp"] = timestamps
+    timestamps, state = read_register(events_path / "behavior_32.bin")
+    edges = falling_edges(state, DI3)
+    strobe = pd.DataFrame(
+        {
+            "DI3": (state[edges] & DI3) != 0,
+            "DIPort1": (state[edges] & DIPORT1) != 0,
+            "Timestamp": timestamps[edges],
+        }
+    )
 
     metadata = pd.read_csv(
         path / ("cam_metadata_" + time_str + ".csv"),
@@ -143,10 +118,9 @@ def synch_camera(path: Path, time_str: str):
     strobe_index = strobe[si_mask].index.to_numpy()[0]
 
     # Check the state of the camera GPIO0 (0x1)
-    mi_mask = (~(metadata["GPIO"].fillna(-1).astype(int) & 0x1)) & (
-        metadata["GPIO"].shift(1).fillna(-1).astype(int) & 0x1
-    )
-    metadata_index = metadata[mi_mask.astype(bool)].index.to_numpy()[0]
+    gpio0 = metadata["GPIO"].fillna(-1).astype(int) & 0x1
+    mi_mask = (gpio0 == 0) & (gpio0.shift(1, fill_value=1) != 0)
+    metadata_index = metadata[mi_mask].index.to_numpy()[0]
 
     sl_after = strobe.iloc[strobe_index:].shape[0]
     ml_after = metadata.iloc[metadata_index:].shape[0]
@@ -176,3 +150,201 @@ def synch_camera(path: Path, time_str: str):
     )
 
     return synched_data
+
+
+class SessionSync:
+    """
+    Synchronizes the camera frames of every segment of a session (i.e. every restart of the task) with the Harp timestamps.
+
+    The strobe and camera metadata of each segment are read only once, the first time the segment is needed, and the resulting frame-to-Harp-time mapping is cached.
+
+    The camera clock is mapped to the Harp clock with a linear fit across all of the sync pulses (DIPort1 falling edges seen both by the Harp Behavior and by the camera GPIO0) of the segment, which accounts for clock drift and dropped frames. The pulses of both devices are paired by their times rather than by their order, so a pulse missed by one of them only drops that pulse from the fit. Each frame then gets the timestamp of the closest camera strobe. When there aren't enough sync pulses for the fit, the first-pulse alignment from `synch_camera` is used instead.
+
+    Every segment is fitted on its own, since the task restarts the camera and the Harp Behavior logging, so the clocks of different segments aren't related by a single mapping.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+    """
+
+    def __init__(self, session_dir: Path):
+        self.session_dir = Path(session_dir)
+        self._tables: Dict[str, pd.DataFrame] = {}
+
+    def frame_table(self, time_str: str) -> pd.DataFrame:
+        """
+        Returns the synchronized frames of a segment.
+
+        Parameters
+        ----------
+        time_str : str
+            the string of the time the segment began in the "hhmmss" format
+
+        Returns
+        -------
+        pd.DataFrame
+            a DataFrame with the `FrameID` and the Harp `Timestamp` of every frame, sorted by timestamp
+        """
+        if time_str not in self._tables:
+            self._tables[time_str] = self._synchronize(time_str)
+        return self._tables[time_str]
+
+    def release(self, time_str: str):
+        """
+        Removes the synchronized frames of a segment from the cache, once they are no longer needed.
+        """
+        self._tables.pop(time_str, None)
+
+    def _strobe_path(self, time_str: str) -> Path:
+        return self.session_dir / "events" / time_str / "behavior" / "behavior_32.bin"
+
+    def _synchronize(self, time_str: str) -> pd.DataFrame:
+        timestamps, state = read_register(self._strobe_path(time_str))
+        edges = falling_edges(state, DI3)
+        strobe_ts = timestamps[edges]
+        strobe_sync = (state[edges] & DIPORT1) != 0
+
+        metadata = pd.read_csv(
+            self.session_dir / ("cam_metadata_" + time_str + ".csv"),
+            header=None,
+            names=["Timestamp", "FrameID", "GPIO"],
+        )
+        camera_ts = metadata["Timestamp"].to_numpy(dtype=float)
+        camera_sync = (metadata["GPIO"].fillna(-1).to_numpy(dtype=int) & 0x1) != 0
+
+        fit = _fit_clocks(strobe_ts, strobe_sync, camera_ts, camera_sync)
+        if fit is None:
+            strobe = synch_camera(self.session_dir, time_str)
+            strobe = strobe[strobe["Timestamp"] >= 0]
+            return strobe[["FrameID", "Timestamp"]].reset_index(drop=True)
+
+        # Give each frame the timestamp of the closest strobe, or the fitted timestamp if the strobe is missing
+        predicted = fit[0] * camera_ts + fit[1]
+        period = np.median(np.diff(strobe_ts))
+        nearest = _nearest(strobe_ts, predicted)
+        matched = np.abs(strobe_ts[nearest] - predicted) < period / 2
+        frame_ts = np.where(matched, strobe_ts[nearest], predicted)
+
+        return pd.DataFrame(
+            {
+                "FrameID": np.arange(1, camera_ts.size + 1),
+                "Timestamp": np.maximum.accumulate(frame_ts),
+            }
+        )
+
+
+def _sync_edges(sync: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(sync[:-1] & ~sync[1:]) + 1
+
+
+def _fit_clocks(
+    strobe_ts: np.ndarray,
+    strobe_sync: np.ndarray,
+    camera_ts: np.ndarray,
+    camera_sync: np.ndarray,
+) -> Optional[Tuple[float, float]]:
+    """
+    Fits the linear mapping from the camera clock to the Harp clock using the sync pulses seen by both devices.
+
+    The pulses are paired by time: a first mapping is estimated from the frame periods of both clocks and the offset that pairs the most pulses, and it's then refined by fitting the paired pulses and pairing them again with a smaller tolerance.
+
+    Returns
+    -------
+    tuple[float, float] or None
+        the slope and the intercept of the mapping, or None if there aren't enough sync pulses or the camera timestamps are unusable.
+    """
+    strobe_pulses = strobe_ts[_sync_edges(strobe_sync)]
+    camera_pulses = camera_ts[_sync_edges(camera_sync)]
+    if (
+        min(strobe_pulses.size, camera_pulses.size) < 2
+        or strobe_ts.size < 2
+        or np.any(np.diff(camera_ts) <= 0)
+    ):
+        return None
+
+    # Center the camera timestamps so that the fit is well conditioned even with large clock values
+    origin = camera_ts[0]
+    x = camera_pulses - origin
+
+    # Every frame produces a strobe, so the ratio of the mean frame periods of both clocks is a first estimate of the slope
+    period = np.median(np.diff(strobe_ts))
+    slope = (np.ptp(strobe_ts) / (strobe_ts.size - 1)) / (
+        np.ptp(camera_ts) / (camera_ts.size - 1)
+    )
+
+    # Try the offsets that pair any of the first pulses of both devices and keep the one that pairs the most pulses
+    tolerance = max(np.median(np.diff(strobe_pulses)) / 2, 2 * period)
+    k = min(10, strobe_pulses.size, camera_pulses.size)
+    candidates = (strobe_pulses[:k][None, :] - slope * x[:k][:, None]).ravel()
+    counts = [
+        _pair_pulses(strobe_pulses, slope * x + c, tolerance)[0].size
+        for c in candidates
+    ]
+    intercept = candidates[int(np.argmax(counts))]
+
+    # Refine the mapping until the pairs don't change with the final tolerance of two frames
+    pairs = None
+    for _ in range(20):
+        camera_index, strobe_index = _pair_pulses(
+            strobe_pulses, slope * x + intercept, tolerance
+        )
+        if camera_index.size < 2:
+            return None
+        slope, intercept = np.polyfit(x[camera_index], strobe_pulses[strobe_index], 1)
+        if tolerance == 2 * period and np.array_equal(camera_index, pairs):
+            break
+        pairs = camera_index
+        tolerance = max(tolerance / 2, 2 * period)
+
+    if slope <= 0:
+        return None
+    return slope, intercept - slope * origin
+
+
+def _pair_pulses(
+    pulses: np.ndarray, predicted: np.ndarray, tolerance: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    # Pair each predicted pulse with the closest pulse within the tolerance, dropping the pulses claimed by more than one prediction
+    nearest = _nearest(pulses, predicted)
+    paired = np.flatnonzero(np.abs(pulses[nearest] - predicted) <= tolerance)
+    values, counts = np.unique(nearest[paired], return_counts=True)
+    paired = paired[np.isin(nearest[paired], values[counts == 1])]
+    return paired, nearest[paired]
+
+
+def _nearest(sorted_values: np.ndarray, values: np.ndarray) -> np.ndarray:
+    indices = np.clip(np.searchsorted(sorted_values, values), 1, sorted_values.size - 1)
+    left = sorted_values[indices - 1]
+    right = sorted_values[indices]
+    return indices - ((values - left) < (right - values))
+
+
+# Synchronizations of the sessions used in this process, with the modification times of their inputs
+_SESSION_CACHE: Dict[Path, Tuple[tuple, SessionSync]] = {}
+
+
+def session_sync(session_dir: Path) -> SessionSync:
+    """
+    Returns the cached synchronization of a session, which is recomputed if any of its inputs changed.
+
+    Parameters
+    ----------
+    session_dir : Path
+        the path to the session directory.
+
+    Returns
+    -------
+    SessionSync
+        the synchronization of the session.
+    """
+    session_dir = Path(session_dir)
+    files = sorted(session_dir.glob("cam_metadata_*.csv")) + sorted(
+        session_dir.glob("events/*/behavior/behavior_32.bin")
+    )
+    key = tuple((str(file), file.stat().st_mtime_ns) for file in files)
+    cached = _SESSION_CACHE.get(session_dir)
+    if cached is None or cached[0] != key:
+        cached = (key, SessionSync(session_dir))
+        _SESSION_CACHE[session_dir] = cached
+    return cached[1]
@@ -1,9 +1,10 @@
 import os
-from datetime import datetime
+from pathlib import Path
 
-import pandas as pd
 import yaml
 
+from shutdown.session_index import last_session
+from shutdown.state import latest_state
 from startup.config_to_json import converter, save_setup
 from startup.startup import (
     ask_animal,
@@ -12,6 +13,7 @@ from startup.startup import (
     ask_last_training_level,
     ask_starting_training_level,
     ask_time_parameters,
+    read_last_session,
     save_yaml,
     verify_session,
 )
@@ -48,45 +50,23 @@ def main():
     with open(animal_file, "r") as file:
         animal_config = yaml.safe_load(file)
 
-    # Possible path to the current animal output directory
+    # Possible paths to the current animal output directories
     animal_out_dir = config["paths"]["output"] + "/" + batch + "/" + animal
-    dirs = ["200101"]
-    if os.path.isdir(animal_out_dir):
-        entries = os.listdir(animal_out_dir)
-        dirs = [
-            entry
-            for entry in entries
-            if os.path.isdir(os.path.join(animal_out_dir, entry))
-        ]
-
     animal_out_backup = config["paths"]["output_backup"] + "/" + batch + "/" + animal
-    output_dirs = ["200101"]
-    if os.path.isdir(animal_out_backup):
-        entries = os.listdir(animal_out_backup)
-        output_dirs = [
-            entry
-            for entry in entries
-            if os.path.isdir(os.path.join(animal_out_backup, entry))
-        ]
 
-    if datetime.strptime(dirs[-1], "%y%m%d") >= datetime.strptime(
-        output_dirs[-1], "%y%m%d"
-    ):
-        animal_out = os.path.join(animal_out_dir, dirs[-1])
-        out_name = "out_" + animal + "_" + str(dirs[-1]) + ".csv"
-    else:
-        animal_out = os.path.join(animal_out_backup, output_dirs[-1])
-        out_name = "out_" + animal + "_" + str(output_dirs[-1]) + ".csv"
+    # Use the state saved by the shutdown of the last session, which avoids reading the whole out.csv file, unless a later session has no state (for example, when its conversion failed or was done by an older version)
+    animal_dirs = [Path(animal_out_dir), Path(animal_out_backup)]
+    state = latest_state(animal_dirs)
+    sessions = [last_session(d) for d in animal_dirs]
+    if state is None or any(s is not None and s.name > state["date"] for s in sessions):
+        state = read_last_session(animal, animal_out_dir, animal_out_backup)
 
-    # Try to read the last out.csv file and return from function if something goes wrong
+    # Ask for user input to update animal.yml file and return from function if something goes wrong
     try:
-        df = pd.read_csv(os.path.join(animal_out, out_name))
-        # Ask for user input to update animal.yml file
-        verify_session(animal_config, df, dirs[-1])
-        ask_time_parameters(animal_config, df)
-        animal_config["session"]["starting_trial_number"] = int(
-            df.loc[df.index[-1], "trial"] + 1
-        )
+        last_trial = state["last_trial"]
+        verify_session(animal_config, last_trial, state["date"])
+        ask_time_parameters(animal_config, last_trial)
+        animal_config["session"]["starting_trial_number"] = int(last_trial["trial"] + 1)
     except Exception:
         animal_config["session"]["block_number"] = 1
 
@@ -1,21 +1,30 @@
+import csv
+import hashlib
 import json
-from typing import Literal
+import shutil
+from pathlib import Path
+from typing import List, Literal
 
-import numpy as np
-import pandas as pd
+CONFIG_DIR = Path("../src/config")
 
+# Directory with the compiled config files, named after the hash of the CSV file they were compiled from
+COMPILED_DIR = CONFIG_DIR / ".compiled"
 
-class NpEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        if isinstance(obj, np.bool):
-            return bool(obj)
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return super(NpEncoder, self).default(obj)
+SCHEMAS = {
+    "setup": "https://raw.githubusercontent.com/fchampalimaud/CDC.SoundLateralizationTask/refs/heads/main/src/config/schemas/setup-schema.json",
+    "training": "https://raw.githubusercontent.com/fchampalimaud/CDC.SoundLateralizationTask/refs/heads/main/src/config/schemas/training-schema.json",
+}
+
+# Name of the list of items in the JSON file of each type of config file
+LIST_NAMES = {"setup": "setups", "training": "levels"}
+
+# The compiled files depend on this module and on the models they are validated against
+_SGEN_DIR = Path(__file__).parent.parent / "sgen"
+_CODE_VERSION = hashlib.sha256(
+    Path(__file__).read_bytes()
+    + (_SGEN_DIR / "setup.py").read_bytes()
+    + (_SGEN_DIR / "training.py").read_bytes()
+).hexdigest()
 
 
 def unflatten_json(json_dict: dict):
@@ -41,10 +50,75 @@ def unflatten_json(json_dict: dict):
     return result_dict
 
 
+def read_config_csv(filepath: str) -> List[dict]:
+    """
+    Reads the rows of a CSV config file (setup.csv or training.csv) as nested dictionaries.
+
+    Values are kept as strings, except for the lists (for example, `[1, 2]` or `['a', 'b']`), which are parsed from JSON. The types of the values are given by the models the rows are validated against.
+
+    Parameters
+    ----------
+    filepath : str
+        the path to the CSV file.
+
+    Returns
+    -------
+    list[dict]
+        a list with one nested dictionary per row.
+    """
+    with open(filepath, "r", newline="") as file:
+        rows = list(csv.DictReader(file))
+
+    for row in rows:
+        for key, value in row.items():
+            if value is not None and value.strip().startswith("["):
+                row[key] = json.loads(value.replace("'", '"'))
+    return [unflatten_json(row) for row in rows]
+
+
+def compile_config(filepath: str, filetype: Literal["setup", "training"]) -> List[dict]:
+    """
+    Validates a CSV config file against its model (`sgen.setup.Setup` or the `sgen.training.Level` items of `sgen.training.Training`) and converts its rows to the types declared in the model. The columns that aren't declared in the model are kept, with the numbers and booleans parsed from their text.
+
+    Parameters
+    ----------
+    filepath : str
+        the path to the CSV file.
+    filetype : Literal["setup", "training"]
+        indicates whether the file is the setup.csv or training.csv.
+
+    Returns
+    -------
+    list[dict]
+        a list with one JSON-compatible dictionary per row.
+
+    Raises
+    ------
+    pydantic.ValidationError
+        if any row doesn't match the model. The error lists the row and field of every invalid value.
+    """
+    # The models are only imported when a file actually needs to be compiled
+    from pydantic import TypeAdapter
+
+    if filetype == "setup":
+        from sgen.setup import Setup as Model
+    else:
+        from sgen.training import Level as Model
+
+    rows = read_config_csv(filepath)
+    adapter = TypeAdapter(List[Model])
+    items = adapter.dump_python(adapter.validate_python(rows), mode="json")
+
+    # The columns that the model doesn't declare are ignored by the validation, but they're still passed to Bonsai
+    return [_merge_extra(item, row) for item, row in zip(items, rows)]
+
+
 def converter(filepath: str, filetype: Literal["setup", "training"]):
     """
     Converts a CSV config file into a JSON file so that Bonsai is able to read it.
 
+    The CSV file is only validated and converted when it changes: the compiled JSON file is cached in `COMPILED_DIR`, keyed by the hash of the CSV file, and simply copied on the following launches.
+
     Parameters
     ----------
     filepath : str
@@ -52,67 +126,107 @@ def converter(filepath: str, filetype: Literal["setup", "training"]):
     filetype : Literal["setup", "training"]
         indicates whether the file being converted is the setup.csv or training.csv.
     """
-    df = pd.read_csv(filepath)
-    headers = df.columns.tolist()
-
-    # Add the respective header to the JSON file
-    if filetype == "setup":
-        header = """{
-    "$schema": "https://raw.githubusercontent.com/fchampalimaud/CDC.SoundLateralizationTask/refs/heads/main/src/config/schemas/setup-schema.json",
-    "setups": ["""
-
-        footer = """    ]
-}"""
-    elif filetype == "training":
-        header = """{
-    "$schema": "https://raw.githubusercontent.com/fchampalimaud/CDC.SoundLateralizationTask/refs/heads/main/src/config/schemas/training-schema.json",
-    "levels": ["""
-
-        footer = """    ]
-}"""
-
-    lines = []
-    for i in range(df.shape[0]):
-        values = df.iloc[i].tolist()
-        if filetype == "setup":
-            values[1] = json.loads(values[1].replace("'", '"'))
-        else:
-            values[6] = json.loads(values[6])
-        dictionary = dict(zip(headers, values))
-        nested_dict = unflatten_json(dictionary)
-        lines.append(nested_dict)
-
-    # Save the JSON file
-    with open("../src/config/" + filetype + ".json", "w") as f:
-        f.write(header + "\n")
-        for i in range(len(lines)):
-            json_line = json.dumps(lines[i], cls=NpEncoder)
-            if i == len(lines) - 1:
-                f.write("        " + json_line + "\n")
-            else:
-                f.write("        " + json_line + ",\n")
-        f.write(footer + "\n")
+    artifact = COMPILED_DIR / (filetype + "_" + _source_key(filepath) + ".json")
+    if not artifact.is_file():
+        _compile(filepath, filetype)
+    shutil.copyfile(artifact, CONFIG_DIR / (filetype + ".json"))
 
 
 def save_setup(filepath: str, index: int):
-    df = pd.read_csv(filepath)
-    setup_dict = df.to_dict(orient="records")[index]
-    setup_dict["sounds"] = json.loads(setup_dict["sounds"].replace("'", '"'))
-    setup_dict = unflatten_json(setup_dict)
-
-    # Save file
-    with open("../src/config/setup.json", "w") as file:
-        json.dump(setup_dict, file, indent=4)
-
-
-# def save_training(filepath: str, index: int):
-#     df = pd.read_csv(filepath)
-#     training_dict = df.to_dict(orient="records")[index]
-#     training_dict["sounds"]["abl"]["abl_list"] = json.loads(
-#         training_dict["sounds"]["abl"]["abl_list"]  # .replace("'", '"')
-#     )
-#     training_dict = unflatten_json(training_dict)
-
-#     # Save file
-#     with open("../src/config/training.json", "w") as file:
-#         json.dump(training_dict, file, indent=4)
+    """
+    Saves the setup with the given index from the setup.csv file to the setup.json file read by Bonsai.
+
+    Like in `converter`, the setup.csv file is only validated and converted when it changes.
+
+    Parameters
+    ----------
+    filepath : str
+        the path to the setup.csv file.
+    index : int
+        the index of the setup (row) in the file.
+    """
+    key = _source_key(filepath)
+    artifact = COMPILED_DIR / ("setup_" + key + "_" + str(index) + ".json")
+    if not artifact.is_file():
+        _compile(filepath, "setup")
+        if not artifact.is_file():
+            raise IndexError(
+                "There's no setup with index " + str(index) + " in " + filepath
+            )
+    shutil.copyfile(artifact, CONFIG_DIR / "setup.json")
+
+
+def _merge_extra(item: dict, row: dict) -> dict:
+    # Add the fields of the CSV row that are missing from the validated item, at any level
+    for key, value in row.items():
+        if key not in item:
+            item[key] = _parse_value(value)
+        elif isinstance(value, dict) and isinstance(item[key], dict):
+            _merge_extra(item[key], value)
+    return item
+
+
+def _parse_value(value):
+    # Parse the values of the undeclared columns like `pd.read_csv` would
+    if isinstance(value, dict):
+        return {key: _parse_value(v) for key, v in value.items()}
+    if not isinstance(value, str):
+        return value
+    if value.strip() == "":
+        return None
+    if value in ("True", "False", "true", "false"):
+        return value.lower() == "true"
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _source_key(filepath: str) -> str:
+    digest = hashlib.sha256(_CODE_VERSION.encode())
+    digest.update(Path(filepath).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def _compile(filepath: str, filetype: Literal["setup", "training"]):
+    """
+    Compiles a CSV config file into the cached JSON files: the whole file (`<filetype>_<key>.json`, with the same layout as the file read by Bonsai) and, for setups, each setup on its own (`setup_<key>_<index>.json`). The files compiled from previous versions of the CSV file are removed.
+    """
+    key = _source_key(filepath)
+    items = compile_config(filepath, filetype)
+
+    COMPILED_DIR.mkdir(parents=True, exist_ok=True)
+    for old in COMPILED_DIR.glob(filetype + "_*.json"):
+        if not old.name.startswith(filetype + "_" + key):
+            old.unlink()
+
+    # One item per line, like the files converted by previous versions
+    lines = ",\n".join("        " + json.dumps(item) for item in items)
+    text = (
+        "{\n"
+        + '    "$schema": "'
+        + SCHEMAS[filetype]
+        + '",\n'
+        + '    "'
+        + LIST_NAMES[filetype]
+        + '": [\n'
+        + lines
+        + "\n    ]\n}\n"
+    )
+    _write_text(COMPILED_DIR / (filetype + "_" + key + ".json"), text)
+
+    if filetype == "setup":
+        for index, item in enumerate(items):
+            _write_text(
+                COMPILED_DIR / ("setup_" + key + "_" + str(index) + ".json"),
+                json.dumps(item, indent=4),
+            )
+
+
+def _write_text(path: Path, text: str):
+    # Replace the file at once, so that an interrupted compilation never leaves a partial file in the cache
+    temp_path = path.with_name(path.name + ".tmp")
+    temp_path.write_text(text)
+    temp_path.replace(path)
@@ -1,13 +1,14 @@
 import os
 import re
 from datetime import datetime
-from typing import Literal
+from typing import Literal, Optional
 
-import pandas as pd
 import yaml
 
+from shutdown.session_index import ANIMAL_PATTERN, BATCH_PATTERN, last_session
 
-def verify_session(animal_config: dict, output_data: pd.DataFrame, last_dir: str):
+
+def verify_session(animal_config: dict, last_trial: dict, last_dir: str):
     """
     Asks the user whether it should start a new session or not and updates the animal.yml file accordingly.
 
@@ -15,8 +16,8 @@ def verify_session(animal_config: dict, output_data: pd.DataFrame, last_dir: str
     ----------
     animal_config : dict
         the dictionary containing the parameters from the animal.yml file.
-    output_data : pd.DataFrame
-        the dataframe containing the data from the last session out.csv.
+    last_trial : dict or pd.Series
+        the last trial of the last session, from its saved state or its out.csv.
     last_dir : str
         the name of the directory from last session, which is in the format `YYMMDD`
     """
@@ -24,20 +25,14 @@ def verify_session(animal_config: dict, output_data: pd.DataFrame, last_dir: str
     last_session_date = datetime.strptime(last_dir, "%y%m%d").date()
 
     if last_session_date == datetime.today().date():
-        animal_config["session"]["number"] = int(
-            output_data.loc[output_data.index[-1], "session"]
-        )
-        animal_config["session"]["block_number"] = int(
-            output_data.loc[output_data.index[-1], "block"] + 1
-        )
+        animal_config["session"]["number"] = int(last_trial["session"])
+        animal_config["session"]["block_number"] = int(last_trial["block"] + 1)
     else:
-        animal_config["session"]["number"] = int(
-            output_data.loc[output_data.index[-1], "session"] + 1
-        )
+        animal_config["session"]["number"] = int(last_trial["session"] + 1)
         animal_config["session"]["block_number"] = 1
 
 
-def ask_time_parameters(animal_config: dict, df: pd.DataFrame):
+def ask_time_parameters(animal_config: dict, last_trial: dict):
     """
     Asks the user whether it should update the time-related parameters (fixation time, reaction time and lnp time) in the animal.yml file.
 
@@ -45,8 +40,8 @@ def ask_time_parameters(animal_config: dict, df: pd.DataFrame):
     ----------
     animal_config : dict
         the dictionary containing the parameters from the animal.yml file.
-    output_data : pd.DataFrame
-        the dataframe containing the data from the last session out.csv.
+    last_trial : dict or pd.Series
+        the last trial of the last session, from its saved state or its out.csv.
     """
     while True:
         # Ask for user input
@@ -57,21 +52,21 @@ def ask_time_parameters(animal_config: dict, df: pd.DataFrame):
 
         if update_lower == "y" or update_lower == "":
             animal_config["fixation_time"]["opto_onset_time"]["min_value"] = float(
-                df.loc[df.index[-1], "base_ft_oot"]
+                last_trial["base_ft_oot"]
             )
             animal_config["fixation_time"]["sound_onset_time"]["min_value"] = float(
-                df.loc[df.index[-1], "base_ft_sot"]
+                last_trial["base_ft_sot"]
             )
             animal_config["session"]["starting_training_level"] = int(
-                df.loc[df.index[-1], "training_level"]
+                last_trial["training_level"]
             )
             if "reaction_time" in animal_config:
                 animal_config["reaction_time"]["min_value"] = float(
-                    df.loc[df.index[-1], "base_rt"]
+                    last_trial["base_rt"]
                 )
             if "lnp_time" in animal_config:
                 animal_config["lnp_time"]["min_value"] = float(
-                    df.loc[df.index[-1], "intended_lnp"]
+                    last_trial["intended_lnp"]
                 )
             break
         elif update_lower == "n":
@@ -80,6 +75,47 @@ def ask_time_parameters(animal_config: dict, df: pd.DataFrame):
             print("Not a valid input.")
 
 
+def read_last_session(
+    animal: str, animal_out_dir: str, animal_out_backup: str
+) -> Optional[dict]:
+    """
+    Finds the last session of an animal in its output and backup directories and reads its last trial from the end of the out.csv file. Used when there's no state saved by the shutdown (see `shutdown.state`).
+
+    Parameters
+    ----------
+    animal : str
+        the animal ID.
+    animal_out_dir : str
+        the path to the animal output directory.
+    animal_out_backup : str
+        the path to the animal backup directory.
+
+    Returns
+    -------
+    dict, optional
+        a dictionary with the `date` of the last session and its `last_trial`, or None if the out file can't be read.
+    """
+    # The session directories are named `YYMMDD`, so the latest one is also the last in alphabetical order
+    sessions = [
+        session
+        for session in [last_session(animal_out_dir), last_session(animal_out_backup)]
+        if session is not None
+    ]
+    if len(sessions) == 0:
+        return None
+    session = max(sessions, key=lambda s: s.name)
+    out_name = "out_" + animal + "_" + session.name + ".csv"
+
+    # The out file is only read here, so the prompts don't wait for pandas to be imported
+    from shutdown.store import read_last_row
+
+    try:
+        last_trial = read_last_row(session / out_name)
+        return {"date": session.name, "last_trial": last_trial}
+    except Exception:
+        return None
+
+
 def ask_experimenter():
     while True:
         experimenter = input("Hello! :) Let me know who you are, please: ")
@@ -115,7 +151,7 @@ def ask_batch():
     while True:
         batch = input("Are you training an animal from which batch? ")
 
-        if not re.fullmatch(r"^[a-zA-Z0-9][a-zA-Z0-9_]*[a-zA-Z0-9]$", batch):
+        if not BATCH_PATTERN.fullmatch(batch):
             print(
                 "This is not a valid batch name! You can only use ASCII letters and numbers. Additionally, you can use underscores (_) in the middle of the name."
             )
@@ -130,7 +166,7 @@ def ask_animal():
         animal = input("Which furry friend is going to be joining us? ")
 
         # Check if the animal ID is valid
-        if not re.fullmatch(r"^[A-Z]{2,6}\d{4}$", animal):
+        if not ANIMAL_PATTERN.fullmatch(animal):
             print(
                 "This is not a valid animal ID! The animal ID must be composed by 2 to 6 letters followed by 4 digits (ex: ANIMAL0000)."
             )
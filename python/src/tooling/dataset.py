@@ -0,0 +1,151 @@
+import json
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+
+from shutdown.store import normalize_missing, parquet_path, read_out, write_parquet
+
+DATASET_DIR = "dataset"
+INDEX_NAME = "index.json"
+
+
+def _partition_path(animal_dir: Path, session: str) -> Path:
+    return animal_dir / DATASET_DIR / ("date=" + session) / "part-0.parquet"
+
+
+def _source_path(animal_dir: Path, session_dir: Path) -> Path:
+    return session_dir / ("out_" + animal_dir.name + "_" + session_dir.name + ".csv")
+
+
+def _source_stat(csv_path: Path) -> dict:
+    # The partition depends on both formats of the session file, since read_out may use either of them
+    stat = {}
+    for path in [csv_path, parquet_path(csv_path)]:
+        if path.is_file():
+            st = path.stat()
+            stat[path.name] = [st.st_size, st.st_mtime_ns]
+    return stat
+
+
+def load_index(animal_dir: Path) -> dict:
+    """
+    Loads the index of the per-animal dataset.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal directory.
+
+    Returns
+    -------
+    dict
+        the index, which maps each session to the source files and the columns of its partition.
+    """
+    try:
+        with open(animal_dir / DATASET_DIR / INDEX_NAME, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {"sessions": {}}
+
+
+def save_index(animal_dir: Path, index: dict):
+    with open(animal_dir / DATASET_DIR / INDEX_NAME, "w") as file:
+        json.dump(index, file, indent=4)
+
+
+def update_dataset(animal_dir: Path, session_dirs: List[Path]) -> dict:
+    """
+    Updates the per-animal dataset, which keeps one Parquet partition per session.
+
+    Only the sessions that are new or whose out files changed since the last update are read and written, and the partitions of sessions that no longer exist are removed.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal directory.
+    session_dirs : list[Path]
+        the session directories of the animal.
+
+    Returns
+    -------
+    dict
+        the updated index.
+    """
+    index = load_index(animal_dir)
+    (animal_dir / DATASET_DIR).mkdir(exist_ok=True)
+
+    sessions = {}
+    for session_dir in session_dirs:
+        csv_path = _source_path(animal_dir, session_dir)
+        source = _source_stat(csv_path)
+        if len(source) == 0:
+            continue
+
+        entry = index["sessions"].get(session_dir.name)
+        partition = _partition_path(animal_dir, session_dir.name)
+        if entry is not None and entry["source"] == source and partition.is_file():
+            sessions[session_dir.name] = entry
+            continue
+
+        df = read_out(csv_path)
+        partition.parent.mkdir(exist_ok=True)
+        write_parquet(df, partition)
+        sessions[session_dir.name] = {
+            "source": source,
+            "rows": df.shape[0],
+            "columns": [str(c) for c in df.columns],
+        }
+
+    # Remove the partitions of the sessions that were deleted
+    for session in set(index["sessions"]) - set(sessions):
+        shutil.rmtree(_partition_path(animal_dir, session).parent, ignore_errors=True)
+
+    index["sessions"] = dict(sorted(sessions.items()))
+    save_index(animal_dir, index)
+    return index
+
+
+def read_dataset(
+    animal_dir: Path,
+    columns: Optional[List[str]] = None,
+    sessions: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Reads the per-animal dataset, loading only the requested sessions and columns.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal directory.
+    columns : list[str], optional
+        the columns to read. If None, all columns are read.
+    sessions : list[str], optional
+        the sessions (in the `YYMMDD` format) to read. If None, all sessions are read.
+
+    Returns
+    -------
+    pd.DataFrame
+        the out data of the requested sessions, sorted by session.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    index = load_index(animal_dir)
+    tables = []
+    for session, entry in index["sessions"].items():
+        if sessions is not None and session not in sessions:
+            continue
+        available = (
+            None if columns is None else [c for c in columns if c in entry["columns"]]
+        )
+        tables.append(
+            pq.read_table(_partition_path(animal_dir, session), columns=available)
+        )
+
+    if len(tables) == 0:
+        return pd.DataFrame(columns=columns)
+    return normalize_missing(
+        pa.concat_tables(tables, promote_options="permissive").to_pandas()
+    )
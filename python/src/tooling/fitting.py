@@ -0,0 +1,380 @@
+import argparse
+import hashlib
+import json
+from pathlib import Path
+from tkinter import filedialog
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import least_squares, minimize
+from scipy.special import expit
+
+from shutdown.manifest import file_entry
+from shutdown.session_index import animal_dirs, batch_dirs, is_animal, session_dirs
+from shutdown.store import read_out
+
+FITS_NAME = "fits.json"
+
+# Columns of the out structure used by the fits
+FIT_COLUMNS = ["block", "ILD", "success", "response_poke", "timed_rt"]
+
+# Initial parameters and bounds of the psychometric function: bias (dB), slope (1/dB) and lapse rate
+PSYCHOMETRIC_START = np.array([0.0, 0.3, 0.02])
+PSYCHOMETRIC_BOUNDS = [(-40.0, 40.0), (1e-3, 20.0), (0.0, 0.45)]
+
+# Initial parameters and bounds of the chronometric function: base RT (s), amplitude (s) and ILD scale (dB)
+CHRONOMETRIC_START = np.array([0.1, 0.1, 4.0])
+CHRONOMETRIC_BOUNDS = ([-np.inf, -np.inf, 1e-2], [np.inf, np.inf, 100.0])
+
+PSYCHOMETRIC_PARAMS = ["bias", "slope", "lapse"]
+CHRONOMETRIC_PARAMS = ["rt_base", "rt_amplitude", "rt_scale"]
+
+_CODE_VERSION = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+def psychometric(ild: np.ndarray, bias: float, slope: float, lapse: float):
+    """
+    The probability of a right response for each ILD: a logistic function with a symmetric lapse rate.
+    """
+    return lapse + (1 - 2 * lapse) * expit(slope * (ild - bias))
+
+
+def chronometric(abs_ild: np.ndarray, base: float, amplitude: float, scale: float):
+    """
+    The mean reaction time for each absolute ILD: an exponential decay towards the base RT.
+    """
+    return base + amplitude * np.exp(-abs_ild / scale)
+
+
+def _psychometric_nll(params: np.ndarray, ild, right, total):
+    # Binomial negative log-likelihood and its gradient, evaluated for all ILDs at once
+    bias, slope, lapse = params
+    s = expit(slope * (ild - bias))
+    p = np.clip(lapse + (1 - 2 * lapse) * s, 1e-9, 1 - 1e-9)
+    nll = -np.sum(right * np.log(p) + (total - right) * np.log(1 - p))
+
+    dp = -(right / p - (total - right) / (1 - p))
+    ds = dp * (1 - 2 * lapse) * s * (1 - s)
+    grad = np.array(
+        [
+            np.sum(-ds * slope),
+            np.sum(ds * (ild - bias)),
+            np.sum(dp * (1 - 2 * s)),
+        ]
+    )
+    return nll, grad
+
+
+def curve_counts(trials: pd.DataFrame) -> dict:
+    """
+    Computes the counts that both fits depend on, so that groups of trials can be pooled by summing their counts instead of reading the trials again.
+
+    Parameters
+    ----------
+    trials : pd.DataFrame
+        the trials, with the columns in `FIT_COLUMNS`.
+
+    Returns
+    -------
+    dict
+        the number of right responses (`right`) and of answered trials (`total`) of each `ild`, and the sum (`rt_sum`) and number (`rt_count`) of the reaction times of each absolute ILD (`abs_ild`).
+    """
+    # Trials with a missing outcome aren't counted as answered
+    answered = trials[trials["success"].isin([1, -1]) & trials["ILD"].notna()]
+    choices = (
+        answered.assign(right=answered["response_poke"] > 0)
+        .groupby("ILD")["right"]
+        .agg(["sum", "count"])
+    )
+    timed = answered[answered["timed_rt"].notna()]
+    rt = timed.groupby(timed["ILD"].abs())["timed_rt"].agg(["sum", "count"])
+    return {
+        "trials": int(trials.shape[0]),
+        "ild": choices.index.to_numpy(dtype=float).tolist(),
+        "right": choices["sum"].to_numpy(dtype=float).tolist(),
+        "total": choices["count"].to_numpy(dtype=float).tolist(),
+        "abs_ild": rt.index.to_numpy(dtype=float).tolist(),
+        "rt_sum": rt["sum"].to_numpy(dtype=float).tolist(),
+        "rt_count": rt["count"].to_numpy(dtype=float).tolist(),
+    }
+
+
+def pool_counts(counts: List[dict]) -> dict:
+    """
+    Sums the counts (see `curve_counts`) of several groups of trials.
+    """
+    if len(counts) == 0:
+        return curve_counts(pd.DataFrame(columns=FIT_COLUMNS))
+    choices = pd.concat(
+        [pd.DataFrame({k: c[k] for k in ["ild", "right", "total"]}) for c in counts]
+    )
+    choices = choices.groupby("ild").sum()
+    rt = pd.concat(
+        [
+            pd.DataFrame({k: c[k] for k in ["abs_ild", "rt_sum", "rt_count"]})
+            for c in counts
+        ]
+    )
+    rt = rt.groupby("abs_ild").sum()
+    return {
+        "trials": sum(c["trials"] for c in counts),
+        "ild": choices.index.to_numpy(dtype=float).tolist(),
+        "right": choices["right"].tolist(),
+        "total": choices["total"].tolist(),
+        "abs_ild": rt.index.to_numpy(dtype=float).tolist(),
+        "rt_sum": rt["rt_sum"].tolist(),
+        "rt_count": rt["rt_count"].tolist(),
+    }
+
+
+def fit_psychometric(counts: dict, start: Optional[np.ndarray] = None) -> dict:
+    """
+    Fits the psychometric function to the choices of each ILD by maximum likelihood.
+
+    Parameters
+    ----------
+    counts : dict
+        the counts of the trials (see `curve_counts`).
+    start : np.ndarray, optional
+        the initial bias, slope and lapse (for example, the fit of the previous session). If None, `PSYCHOMETRIC_START` is used.
+
+    Returns
+    -------
+    dict
+        the `bias`, `slope` and `lapse` of the fit, its negative log-likelihood (`nll`) and whether it `converged`. The parameters are NaN if there are less than 2 ILDs.
+    """
+    if len(counts["ild"]) < 2:
+        return {
+            **dict.fromkeys(PSYCHOMETRIC_PARAMS, np.nan),
+            "nll": np.nan,
+            "converged": False,
+        }
+
+    ild = np.array(counts["ild"])
+    right = np.array(counts["right"])
+    total = np.array(counts["total"])
+
+    x0 = PSYCHOMETRIC_START if start is None or np.any(np.isnan(start)) else start
+    result = minimize(
+        _psychometric_nll,
+        np.clip(x0, *np.array(PSYCHOMETRIC_BOUNDS).T),
+        args=(ild, right, total),
+        jac=True,
+        method="L-BFGS-B",
+        bounds=PSYCHOMETRIC_BOUNDS,
+    )
+    return {
+        **dict(zip(PSYCHOMETRIC_PARAMS, result.x.tolist())),
+        "nll": float(result.fun),
+        "converged": bool(result.success),
+    }
+
+
+def fit_chronometric(counts: dict, start: Optional[np.ndarray] = None) -> dict:
+    """
+    Fits the chronometric function to the mean reaction time of each absolute ILD, weighted by the number of trials.
+
+    Parameters
+    ----------
+    counts : dict
+        the counts of the trials (see `curve_counts`).
+    start : np.ndarray, optional
+        the initial base RT, amplitude and scale. If None, `CHRONOMETRIC_START` is used.
+
+    Returns
+    -------
+    dict
+        the `rt_base`, `rt_amplitude` and `rt_scale` of the fit. The parameters are NaN if there are less than 3 absolute ILDs.
+    """
+    if len(counts["abs_ild"]) < 3:
+        return dict.fromkeys(CHRONOMETRIC_PARAMS, np.nan)
+
+    abs_ild = np.array(counts["abs_ild"])
+    mean = np.array(counts["rt_sum"]) / np.array(counts["rt_count"])
+    weight = np.sqrt(counts["rt_count"])
+
+    x0 = CHRONOMETRIC_START if start is None or np.any(np.isnan(start)) else start
+    result = least_squares(
+        lambda params: weight * (chronometric(abs_ild, *params) - mean),
+        np.clip(x0, *CHRONOMETRIC_BOUNDS),
+        bounds=CHRONOMETRIC_BOUNDS,
+    )
+    return dict(zip(CHRONOMETRIC_PARAMS, result.x.tolist()))
+
+
+def fit_counts(counts: dict, start: Optional[dict] = None) -> dict:
+    """
+    Fits the psychometric and chronometric functions to a group of trials.
+
+    Parameters
+    ----------
+    counts : dict
+        the counts of the trials (see `curve_counts`).
+    start : dict, optional
+        a previous fit whose parameters are used as the initial parameters.
+
+    Returns
+    -------
+    dict
+        the number of `trials` and the parameters of both fits.
+    """
+    psy_start = None
+    rt_start = None
+    if start is not None:
+        psy_start = np.array([start[k] for k in PSYCHOMETRIC_PARAMS], dtype=float)
+        rt_start = np.array([start[k] for k in CHRONOMETRIC_PARAMS], dtype=float)
+
+    return {
+        "trials": counts["trials"],
+        **fit_psychometric(counts, psy_start),
+        **fit_chronometric(counts, rt_start),
+    }
+
+
+def load_fits(animal_dir: Path) -> dict:
+    # The cached fits are discarded whenever the fitting code changes
+    try:
+        with open(animal_dir / FITS_NAME, "r") as file:
+            fits = json.load(file)
+        if fits.get("version") == _CODE_VERSION:
+            return fits
+    except (OSError, ValueError):
+        pass
+    return {"version": _CODE_VERSION, "sessions": {}}
+
+
+def save_fits(animal_dir: Path, fits: dict):
+    with open(animal_dir / FITS_NAME, "w") as file:
+        json.dump(fits, file, indent=4)
+
+
+def fit_animal(animal_dir: Path, blocks: bool = True) -> pd.DataFrame:
+    """
+    Fits every session (and, optionally, every block) of an animal and all of its sessions together.
+
+    The counts and fits of each session are cached in `fits.json` inside the animal directory, keyed by the hash of the session's out file, so only new or modified sessions are read and fitted again. Each session starts from the fit of the previous one and each block from the fit of its session.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal directory.
+    blocks : bool
+        whether to fit the blocks of each session too.
+
+    Returns
+    -------
+    pd.DataFrame
+        a DataFrame with one row per fit, identified by the `level` ("block", "session" or "animal"), `animal`, `session` and `block` columns.
+    """
+    fits = load_fits(animal_dir)
+    sessions = {}
+    previous = None
+
+    for session_dir in session_dirs(animal_dir):
+        out_path = session_dir / (
+            "out_" + animal_dir.name + "_" + session_dir.name + ".csv"
+        )
+        if not out_path.is_file():
+            continue
+
+        entry = fits["sessions"].get(session_dir.name, {})
+        source = file_entry(out_path, entry.get("source"))
+        if entry.get("source", {}).get("hash") != source["hash"] or (
+            blocks and "blocks" not in entry
+        ):
+            trials = read_out(out_path)[FIT_COLUMNS]
+            counts = curve_counts(trials)
+            entry = {"counts": counts, "fit": fit_counts(counts, previous)}
+            if blocks:
+                entry["blocks"] = {
+                    str(block): fit_counts(curve_counts(df), entry["fit"])
+                    for block, df in trials.groupby("block")
+                }
+        entry["source"] = source
+        sessions[session_dir.name] = entry
+        previous = entry["fit"]
+
+    fits["sessions"] = sessions
+    fits["counts"] = pool_counts([entry["counts"] for entry in sessions.values()])
+    fits["fit"] = fit_counts(fits["counts"], previous)
+    save_fits(animal_dir, fits)
+
+    rows = []
+    for session, entry in sessions.items():
+        rows.append({"level": "session", "session": session, **entry["fit"]})
+        if blocks:
+            for block, fit in entry.get("blocks", {}).items():
+                rows.append(
+                    {"level": "block", "session": session, "block": block, **fit}
+                )
+    rows.append({"level": "animal", **fits["fit"]})
+
+    table = pd.DataFrame(rows)
+    table.insert(1, "animal", animal_dir.name)
+    return table
+
+
+def fit_batch(batch_dir: Path, blocks: bool = True) -> pd.DataFrame:
+    """
+    Fits every animal of a batch, as in `fit_animal`, and all of the sessions of the batch together.
+
+    Parameters
+    ----------
+    batch_dir : Path
+        the path to the batch directory.
+    blocks : bool
+        whether to fit the blocks of each session too.
+
+    Returns
+    -------
+    pd.DataFrame
+        a DataFrame with one row per fit, with a `batch` column and a "batch" `level` for the pooled fit.
+    """
+    tables = []
+    counts = []
+    for animal_dir in animal_dirs(batch_dir):
+        tables.append(fit_animal(animal_dir, blocks))
+        # The animal counts were just saved, so the batch is pooled without reading the trials again
+        counts.append(load_fits(animal_dir)["counts"])
+    if len(tables) == 0:
+        return pd.DataFrame()
+
+    pooled = {"level": "batch", **fit_counts(pool_counts(counts))}
+    table = pd.concat(tables + [pd.DataFrame([pooled])], ignore_index=True)
+    table.insert(0, "batch", batch_dir.name)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fits the psychometric and chronometric curves of an animal, a batch or a whole output directory."
+    )
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="the animal, batch or output directory. If omitted, a dialog is opened to choose the directory.",
+    )
+    parser.add_argument(
+        "--no-blocks", action="store_true", help="don't fit the individual blocks."
+    )
+    args = parser.parse_args()
+
+    if args.path is None:
+        path = Path(filedialog.askdirectory())
+    else:
+        path = Path(args.path)
+    blocks = not args.no_blocks
+
+    if is_animal(path):
+        table = fit_animal(path, blocks)
+    elif len(animal_dirs(path)) > 0:
+        table = fit_batch(path, blocks)
+    else:
+        tables: List[pd.DataFrame] = [
+            fit_batch(entry, blocks) for entry in batch_dirs(path)
+        ]
+        table = pd.concat(tables, ignore_index=True)
+
+    table.to_csv(path / "fits.csv", index=False)
+    print("Fits saved to " + str(path / "fits.csv"))
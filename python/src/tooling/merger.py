@@ -1,34 +1,140 @@
-import re
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tkinter import filedialog
+from typing import List, Optional
 
 import pandas as pd
 
+from shutdown.session_index import (
+    animal_dirs,
+    batch_dirs,
+    is_animal,
+    session_dirs,
+)
+from shutdown.store import cast_out_dtypes, columnar_available, read_out, write_parquet
+from shutdown.tool import positive_int
+from tooling.dataset import read_dataset, update_dataset
+
 
 def main():
-    animal_dir = Path(filedialog.askdirectory())
-
-    if _check_animal(animal_dir):
-        for entry in animal_dir.iterdir():
-            if not entry.is_file() and _check_session(entry):
-                out_path = entry / (
-                    "out_" + animal_dir.name + "_" + entry.name + ".csv"
-                )
-                if out_path.is_file():
-                    df = pd.read_csv(out_path, na_values=["NaN"])
-                    if "out" not in locals():
-                        out = df.copy()
-                    else:
-                        out = pd.concat([out, df], ignore_index=True)
-
-        out.to_csv(animal_dir / "out.csv", index=False)
+    parser = argparse.ArgumentParser(
+        description="Merges the out files of an animal, a batch or a whole output directory."
+    )
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="the animal, batch or output directory. If omitted, a dialog is opened to choose an animal directory.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=positive_int,
+        default=None,
+        help="the number of session files read concurrently (default: chosen by Python).",
+    )
+    args = parser.parse_args()
+
+    if args.path is None:
+        path = Path(filedialog.askdirectory())
+    else:
+        path = Path(args.path)
+
+    if is_animal(path):
+        merge_animal(path)
+    else:
+        merge_cohort(path, args.workers)
 
     print("Merge completed!")
 
 
-def _check_session(dir: Path) -> bool:
-    return re.fullmatch(r"^\d{6}", dir.name)
+def merge_animal(animal_dir: Path):
+    """
+    Merges the out files from every session of an animal into a single `out.csv` file.
+
+    If the columnar format is available, the per-animal dataset (one Parquet partition per session) is updated first, so that only new or modified sessions are read from the session directories.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal directory.
+    """
+    sessions = session_dirs(animal_dir)
+
+    if columnar_available():
+        update_dataset(animal_dir, sessions)
+        out = read_dataset(animal_dir)
+    else:
+        # Read every session file first and concatenate them only once
+        frames = []
+        for entry in sessions:
+            out_path = entry / ("out_" + animal_dir.name + "_" + entry.name + ".csv")
+            if out_path.is_file():
+                frames.append(read_out(out_path))
+        out = pd.concat(frames, ignore_index=True)
+
+    out.to_csv(animal_dir / "out.csv", index=False)
+
+
+def merge_cohort(dir: Path, workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Merges the out files from every session of a batch, or of every batch inside an output directory, into a single cohort dataset.
+
+    The session files are read concurrently and the merged data is saved to `out.csv` (and `out.parquet` if the columnar format is available) inside `dir`.
+
+    Parameters
+    ----------
+    dir : Path
+        the path to the batch or output directory.
+    workers : int, optional
+        the maximum number of session files read concurrently.
+
+    Returns
+    -------
+    pd.DataFrame
+        the merged out data, with the nullable dtypes of the `Output` schema.
+    """
+    out_paths = find_out_files(dir)
+    if len(out_paths) == 0:
+        print("No session files were found in " + str(dir))
+        return pd.DataFrame()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(read_out, out_paths))
+
+    out = cast_out_dtypes(pd.concat(frames, ignore_index=True))
+    out.to_csv(dir / "out.csv", index=False)
+    if columnar_available():
+        write_parquet(out, dir / "out.parquet")
+    return out
+
+
+def find_out_files(dir: Path) -> List[Path]:
+    """
+    Finds the out files of every session inside a batch or an output directory.
+
+    Parameters
+    ----------
+    dir : Path
+        the path to the batch or output directory.
 
+    Returns
+    -------
+    list[Path]
+        the paths to the out CSV files, sorted by batch, animal and session.
+    """
+    # A batch directory contains animal directories, while the output directory contains batch directories
+    animals = animal_dirs(dir)
+    if len(animals) == 0:
+        out_paths = []
+        for entry in batch_dirs(dir):
+            out_paths.extend(find_out_files(entry))
+        return out_paths
 
-def _check_animal(dir: Path) -> bool:
-    return re.fullmatch(r"^[A-Z]{2,6}\d{4}$", dir.name)
+    out_paths = []
+    for animal_dir in animals:
+        for entry in session_dirs(animal_dir):
+            out_path = entry / ("out_" + animal_dir.name + "_" + entry.name + ".csv")
+            if out_path.is_file() or out_path.with_suffix(".parquet").is_file():
+                out_paths.append(out_path)
+    return out_paths
@@ -0,0 +1,364 @@
+import argparse
+import hashlib
+import json
+from pathlib import Path
+from tkinter import filedialog
+from typing import List
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from shutdown.manifest import file_entry
+from shutdown.session_index import animal_dirs, is_animal, session_dirs
+from shutdown.stats import ABORT_TYPES, encode_conditions, summarize
+from shutdown.store import read_out
+
+PROGRESS_NAME = "progress.json"
+
+# Columns of the out structure used by the aggregates
+PROGRESS_COLUMNS = [
+    "block",
+    "training_level",
+    "ILD",
+    "success",
+    "response_poke",
+    "abort_type",
+    "timed_rt",
+    "timed_mt",
+]
+
+# Bin edges (s) of the reaction and movement time histograms
+RT_BINS = np.linspace(0, 1, 51)
+MT_BINS = np.linspace(0, 2, 51)
+
+_CODE_VERSION = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+def session_aggregates(trials: pd.DataFrame) -> dict:
+    """
+    Computes the aggregates of a session from which the progress report is built.
+
+    Every aggregate is a count, so the aggregates of several sessions can be combined by summing them.
+
+    Parameters
+    ----------
+    trials : pd.DataFrame
+        the trials of the session, with the columns in `PROGRESS_COLUMNS`.
+
+    Returns
+    -------
+    dict
+        the outcome counts and training level of each block (`blocks`), the number of trials of each abort type (`aborts`), the number of `left` and `right` responses and the histograms of the reaction (`rt_hist`) and movement (`mt_hist`) times of the answered trials.
+    """
+    encoded = encode_conditions(trials)
+    blocks = summarize(encoded, ["block"])
+    levels = trials.groupby("block")["training_level"].last()
+    answered = encoded[encoded["outcome"] != "abort"]
+
+    return {
+        "blocks": [
+            {
+                "block": int(block),
+                "training_level": int(levels[block]),
+                "trials": int(row["trials"]),
+                "correct": int(row["correct"]),
+                "incorrect": int(row["incorrect"]),
+                "abort": int(row["abort"]),
+            }
+            for block, row in blocks.iterrows()
+        ],
+        "aborts": {
+            str(k): int(v)
+            for k, v in encoded["abort_type"].value_counts(sort=False).items()
+        },
+        "left": int((answered["response_poke"] < 0).sum()),
+        "right": int((answered["response_poke"] > 0).sum()),
+        "rt_hist": np.histogram(answered["timed_rt"].dropna(), RT_BINS)[0].tolist(),
+        "mt_hist": np.histogram(answered["timed_mt"].dropna(), MT_BINS)[0].tolist(),
+    }
+
+
+def load_progress(animal_dir: Path) -> dict:
+    # The cached aggregates are discarded whenever the aggregation code changes
+    try:
+        with open(animal_dir / PROGRESS_NAME, "r") as file:
+            progress = json.load(file)
+        if progress.get("version") == _CODE_VERSION:
+            return progress
+    except (OSError, ValueError):
+        pass
+    return {"version": _CODE_VERSION, "sessions": {}}
+
+
+def save_progress(animal_dir: Path, progress: dict):
+    with open(animal_dir / PROGRESS_NAME, "w") as file:
+        json.dump(progress, file, indent=4)
+
+
+def update_progress(animal_dir: Path) -> dict:
+    """
+    Updates the per-session aggregates of an animal, which are kept in `progress.json` inside the animal directory.
+
+    Only the sessions that are new or whose out files changed are read again.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal directory.
+
+    Returns
+    -------
+    dict
+        a dictionary with the sessions (in the `YYMMDD` format) as keys and their aggregates as values.
+    """
+    progress = load_progress(animal_dir)
+    sessions = {}
+    changed = False
+    for session_dir in session_dirs(animal_dir):
+        out_path = session_dir / (
+            "out_" + animal_dir.name + "_" + session_dir.name + ".csv"
+        )
+        if not out_path.is_file():
+            continue
+
+        entry = progress["sessions"].get(session_dir.name, {})
+        source = file_entry(out_path, entry.get("source"))
+        if entry.get("source", {}).get("hash") != source["hash"]:
+            entry = {
+                "aggregates": session_aggregates(read_out(out_path)[PROGRESS_COLUMNS])
+            }
+            changed = True
+        changed = changed or entry.get("source") != source
+        entry["source"] = source
+        sessions[session_dir.name] = entry
+
+    # Only save the aggregates when some session was added, modified or removed
+    if changed or list(sessions) != list(progress["sessions"]):
+        progress["sessions"] = sessions
+        save_progress(animal_dir, progress)
+    return {session: entry["aggregates"] for session, entry in sessions.items()}
+
+
+def _hist_quantiles(hist: np.ndarray, edges: np.ndarray, quantiles: List[float]):
+    # Interpolate the quantiles from the cumulative histogram
+    total = hist.sum()
+    if total == 0:
+        return [np.nan] * len(quantiles)
+    cumulative = np.concatenate([[0], np.cumsum(hist)]) / total
+    return [float(np.interp(q, cumulative, edges)) for q in quantiles]
+
+
+def progress_table(aggregates: dict) -> pd.DataFrame:
+    """
+    Builds the per-session progress table of an animal from its aggregates.
+
+    Parameters
+    ----------
+    aggregates : dict
+        the aggregates of each session, as returned by `update_progress`.
+
+    Returns
+    -------
+    pd.DataFrame
+        a DataFrame with one row per session and the `training_level` (at the end of the session), `trials`, `performance`, `abort_ratio`, `bias` (the proportion of right responses minus the proportion of left responses), the abort ratio of each abort type and the quartiles of the reaction and movement times.
+    """
+    rows = []
+    for session, agg in aggregates.items():
+        blocks = pd.DataFrame(agg["blocks"])
+        if blocks.shape[0] == 0:
+            continue
+        trials = blocks["trials"].sum()
+        answered = blocks["correct"].sum() + blocks["incorrect"].sum()
+        responses = agg["left"] + agg["right"]
+        row = {
+            "session": session,
+            "training_level": blocks["training_level"].iloc[-1],
+            "blocks": blocks.shape[0],
+            "trials": trials,
+            "performance": blocks["correct"].sum() / answered if answered else np.nan,
+            "abort_ratio": blocks["abort"].sum() / trials,
+            "bias": (agg["right"] - agg["left"]) / responses if responses else np.nan,
+        }
+        for abort_type in ABORT_TYPES:
+            row["abort_" + abort_type] = agg["aborts"].get(abort_type, 0) / trials
+        for name, key, edges in [
+            ("rt", "rt_hist", RT_BINS),
+            ("mt", "mt_hist", MT_BINS),
+        ]:
+            q1, q2, q3 = _hist_quantiles(np.array(agg[key]), edges, [0.25, 0.5, 0.75])
+            row.update({name + "_q1": q1, name + "_median": q2, name + "_q3": q3})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def plot_animal(table: pd.DataFrame, title: str, path: Path):
+    """
+    Saves the progress report of an animal: training level, performance and abort ratio, abort ratio by type, reaction and movement times and bias over sessions.
+
+    Parameters
+    ----------
+    table : pd.DataFrame
+        the progress table of the animal, as returned by `progress_table`.
+    title : str
+        the title of the figure.
+    path : Path
+        the path to the PNG file.
+    """
+    fig, ax = plt.subplots(2, 3, figsize=(15, 8))
+    plt.subplots_adjust(wspace=0.3, hspace=0.4)
+    fig.suptitle(title, fontweight="bold")
+    x = np.arange(table.shape[0])
+
+    ax[0, 0].step(x, table["training_level"], where="mid", color="black")
+    ax[0, 0].set_title("Training level", fontsize=8, fontweight="bold")
+
+    ax[0, 1].plot(x, table["performance"], "o-", color="green", label="Performance")
+    ax[0, 1].plot(x, table["abort_ratio"], "o-", color="black", label="Abort ratio")
+    ax[0, 1].axhline(0.5, color="black", linestyle=":")
+    ax[0, 1].set_ylim(0, 1)
+    ax[0, 1].legend(fontsize=8)
+    ax[0, 1].set_title("Performance and abort ratio", fontsize=8, fontweight="bold")
+
+    colors = plt.cm.hsv(np.linspace(0.75, 0, len(ABORT_TYPES) + 2))[2:]
+    bottom = np.zeros(table.shape[0])
+    for abort_type, color in zip(ABORT_TYPES, colors):
+        values = table["abort_" + abort_type].to_numpy()
+        ax[0, 2].bar(x, values, bottom=bottom, color=color, label=abort_type)
+        bottom += values
+    ax[0, 2].legend(fontsize=6, ncol=2)
+    ax[0, 2].set_title("Abort ratio by type", fontsize=8, fontweight="bold")
+
+    for axis, name, label in [
+        (ax[1, 0], "rt", "Reaction time"),
+        (ax[1, 1], "mt", "Movement time"),
+    ]:
+        axis.fill_between(
+            x, table[name + "_q1"], table[name + "_q3"], color="lightgray"
+        )
+        axis.plot(x, table[name + "_median"], "o-", color="black")
+        axis.set_title(label + " (median and IQR)", fontsize=8, fontweight="bold")
+        axis.set_ylabel("Time (s)", fontsize=8)
+
+    ax[1, 2].plot(x, table["bias"], "o-", color="black")
+    ax[1, 2].axhline(0, color="black", linestyle=":")
+    ax[1, 2].set_ylim(-1, 1)
+    ax[1, 2].set_title("Bias (right - left)", fontsize=8, fontweight="bold")
+
+    for axis in ax.flat:
+        axis.set_xticks(x, table["session"], rotation=90, fontsize=6)
+        axis.tick_params(axis="y", labelsize=8)
+        axis.spines["top"].set_visible(False)
+        axis.spines["right"].set_visible(False)
+
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def animal_report(animal_dir: Path) -> pd.DataFrame:
+    """
+    Updates the aggregates of an animal and saves its progress table (`progress.csv`) and report (`progress.png`) to the animal directory.
+
+    The report is only rendered again when the progress table changed.
+
+    Parameters
+    ----------
+    animal_dir : Path
+        the path to the animal directory.
+
+    Returns
+    -------
+    pd.DataFrame
+        the progress table of the animal.
+    """
+    table = progress_table(update_progress(animal_dir))
+    csv_path = animal_dir / "progress.csv"
+    png_path = animal_dir / "progress.png"
+    text = table.to_csv(index=False)
+    if csv_path.is_file() and png_path.is_file() and csv_path.read_text() == text:
+        return table
+
+    csv_path.write_text(text)
+    if table.shape[0] > 0:
+        plot_animal(
+            table,
+            animal_dir.parent.name + " / " + animal_dir.name,
+            png_path,
+        )
+    return table
+
+
+def batch_report(batch_dir: Path) -> pd.DataFrame:
+    """
+    Builds the report of every animal of a batch and saves a batch summary (`progress.csv`), with the last session of each animal, and an overview figure (`progress.png`) to the batch directory.
+
+    Parameters
+    ----------
+    batch_dir : Path
+        the path to the batch directory.
+
+    Returns
+    -------
+    pd.DataFrame
+        the summary of the batch, with one row per animal.
+    """
+    tables = {}
+    for animal_dir in animal_dirs(batch_dir):
+        table = animal_report(animal_dir)
+        if table.shape[0] > 0:
+            tables[animal_dir.name] = table
+
+    summary = pd.DataFrame(
+        [
+            {"animal": animal, **table.iloc[-1].to_dict()}
+            for animal, table in tables.items()
+        ]
+    )
+    csv_path = batch_dir / "progress.csv"
+    png_path = batch_dir / "progress.png"
+    text = summary.to_csv(index=False)
+    if csv_path.is_file() and png_path.is_file() and csv_path.read_text() == text:
+        return summary
+    csv_path.write_text(text)
+
+    if len(tables) > 0:
+        fig, ax = plt.subplots(1, 3, figsize=(15, 4))
+        fig.suptitle(batch_dir.name, fontweight="bold")
+        for animal, table in tables.items():
+            x = np.arange(table.shape[0])
+            ax[0].step(x, table["training_level"], where="mid", label=animal)
+            ax[1].plot(x, table["performance"], "o-", markersize=3)
+            ax[2].plot(x, table["abort_ratio"], "o-", markersize=3)
+        for axis, title in zip(ax, ["Training level", "Performance", "Abort ratio"]):
+            axis.set_title(title, fontsize=8, fontweight="bold")
+            axis.set_xlabel("Session", fontsize=8)
+            axis.spines["top"].set_visible(False)
+            axis.spines["right"].set_visible(False)
+        ax[0].legend(fontsize=6)
+        fig.savefig(png_path)
+        plt.close(fig)
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Builds the progress report of an animal or of every animal of a batch."
+    )
+    parser.add_argument(
+        "path",
+        nargs="?",
+        help="the animal or batch directory. If omitted, a dialog is opened to choose the directory.",
+    )
+    args = parser.parse_args()
+
+    if args.path is None:
+        path = Path(filedialog.askdirectory())
+    else:
+        path = Path(args.path)
+
+    if is_animal(path):
+        animal_report(path)
+    else:
+        print(batch_report(path).to_string(index=False))
+    print("Progress report saved to " + str(path))